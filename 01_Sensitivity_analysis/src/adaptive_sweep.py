@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive sampling of the op_factor x imp_flex sensitivity surface.
+
+The sweep starts on a coarse grid (by default the op_array and ip_array of the sensitivity
+analysis) and refines, quadtree-wise, every cell over which total rationing or total output
+changes by more than a tolerance. A refined cell is split into four, which needs the
+midpoints of its edges and its centre; all new points of one refinement level are solved
+as one batch through the scenario engine. Flat regions of the surface keep their coarse
+cells, so the same number of solves is spent where rationing changes sharply.
+
+The result is the refined point cloud and a piecewise linear interpolant over it.
+"""
+import numpy as np
+import pandas as pd
+from scipy.interpolate import LinearNDInterpolator
+
+from scenario_engine import ScenarioEngine
+
+
+METRICS = ('rationing', 'output')
+
+
+class AdaptiveSweep(object):
+    """
+    Parameters
+        - engine - **ScenarioEngine** used for every evaluation
+        - disr_dict_sup, disr_dict_dem - the disruption, fixed over the sweep
+        - op_grid, ip_grid - coarse starting grid
+        - tol - a cell is refined when a metric changes over it by more than tol times the
+          largest absolute value of that metric seen so far
+        - max_level - maximum number of refinements of a starting cell
+        - max_evals - maximum total number of solves
+    """
+
+    def __init__(self, engine, disr_dict_sup, disr_dict_dem=None,
+                 op_grid=(1, 1.01, 1.025, 1.05, 1.075, 1.1), ip_grid=(0, 0.25, 1),
+                 tol=0.05, max_level=4, max_evals=200, all_disimp=1):
+
+        self.engine = engine
+        self.disr_dict_sup = disr_dict_sup
+        self.disr_dict_dem = disr_dict_dem or {}
+        self.op_grid = sorted(op_grid)
+        self.ip_grid = sorted(ip_grid)
+        self.tol = tol
+        self.max_level = max_level
+        self.max_evals = max_evals
+        self.all_disimp = all_disimp
+
+        self.points = {}
+
+    @staticmethod
+    def _key(op, ip):
+
+        return (round(op, 12), round(ip, 12))
+
+    def evaluate(self, coords, level):
+        """
+        Solve all points not evaluated before as one batch.
+        """
+        new = []
+        for op, ip in coords:
+            key = self._key(op, ip)
+            if key not in self.points and key not in new:
+                new.append(key)
+
+        new = new[:max(0, self.max_evals - len(self.points))]
+
+        scenarios = [{'key': key, 'op_factor': key[0], 'imp_flex': key[1], 'all_disimp': self.all_disimp,
+                      'disr_dict_sup': self.disr_dict_sup, 'disr_dict_dem': self.disr_dict_dem} for key in new]
+
+        for record in self.engine.imap(scenarios):
+            ok = record['status'] == 'optimal'
+            self.points[record['key']] = {'op': record['key'][0], 'ip': record['key'][1], 'level': level,
+                                          'status': record['status'],
+                                          'rationing': record['Ddis'].sum() if ok else np.nan,
+                                          'output': record['Xdis'].sum() if ok else np.nan}
+        return len(new)
+
+    def _needs_refinement(self, cell):
+
+        (op0, op1), (ip0, ip1) = cell
+        corners = [self.points.get(self._key(op, ip)) for op in (op0, op1) for ip in (ip0, ip1)]
+        if any(c is None for c in corners):
+            return False
+
+        for metric in METRICS:
+            values = np.array([c[metric] for c in corners])
+            if np.isnan(values).any():
+                # infeasible corners mark a boundary of the surface
+                return True
+            scale = np.nanmax(np.abs([p[metric] for p in self.points.values()]))
+            if values.max() - values.min() > self.tol * max(scale, 10**-12):
+                return True
+        return False
+
+    def run(self):
+        """
+        Run the sweep and return the point cloud and the interpolants.
+
+        Outputs
+            - DataFrame with op, ip, refinement level, final stage status and the metrics of every point
+            - dictionary {metric: interpolant(op, ip)}
+        """
+        self.evaluate([(op, ip) for op in self.op_grid for ip in self.ip_grid], 0)
+
+        cells = [((self.op_grid[i], self.op_grid[i + 1]), (self.ip_grid[j], self.ip_grid[j + 1]))
+                 for i in range(len(self.op_grid) - 1) for j in range(len(self.ip_grid) - 1)]
+
+        for level in range(1, self.max_level + 1):
+            refine = [cell for cell in cells if self._needs_refinement(cell)]
+            if not refine or len(self.points) >= self.max_evals:
+                break
+
+            children, coords = [], []
+            for (op0, op1), (ip0, ip1) in refine:
+                opm, ipm = (op0 + op1) / 2, (ip0 + ip1) / 2
+                coords += [(opm, ip0), (opm, ip1), (op0, ipm), (op1, ipm), (opm, ipm)]
+                children += [((op0, opm), (ip0, ipm)), ((opm, op1), (ip0, ipm)),
+                             ((op0, opm), (ipm, ip1)), ((opm, op1), (ipm, ip1))]
+
+            if self.evaluate(coords, level) == 0:
+                break
+            cells = children
+
+        return self.result()
+
+    def result(self):
+
+        cloud = pd.DataFrame(list(self.points.values())).sort_values(['op', 'ip']).reset_index(drop=True)
+
+        interpolants = {}
+        valid = cloud.dropna(subset=list(METRICS))
+        for metric in METRICS:
+            interpolants[metric] = LinearNDInterpolator(valid[['op', 'ip']].to_numpy(), valid[metric].to_numpy())
+
+        return cloud, interpolants
+
+
+def adaptive_sweep(DATA, distance_dict, solvername, disr_dict_sup, processes=1, new_Xbase=None,
+                   engine_options=None, **sweep_options):
+    """
+    Run an adaptive op_factor x imp_flex sweep for one disruption, see **AdaptiveSweep**.
+    """
+    engine = ScenarioEngine(DATA, distance_dict, solvername, new_Xbase=new_Xbase, processes=processes,
+                            **(engine_options or {}))
+    with engine:
+        return AdaptiveSweep(engine, disr_dict_sup, **sweep_options).run()
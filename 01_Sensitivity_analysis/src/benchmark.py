@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the MRIA stage models across solver backends and option sets.
+
+Every stage model (MRIA_SUT of mria_new_SUT_*.py) is built and solved on its own, on a set of
+reference scenarios, with every available backend (see solver_dispatch.py) and option set:
+
+    - base            corrected baseline (once per backend and option set)
+    - min_ration      minimise rationing
+    - min_X           minimise supply, at the rationing of the reference min_ration
+    - inverse         output that satisfies the rationing of the reference min_ration
+    - lexicographic   minimise rationing, then supply, on one model
+
+All runs of a stage get the same inputs: the corrected baseline, and for min_X and inverse the
+rationing, outputs and imports of the reference run (the first backend and option set by
+default), so that the deltas compare the solvers and not the stages before them.
+
+The reference scenarios are
+
+    - the sensitivity grid: the disruption matrix at dis_array x op_array x ip_array
+    - a criticality sample: single region-sector disruptions drawn from the table
+    - the C20 disruption ladder: the chemicals sector disrupted in all regions at growing levels
+
+For every run the report holds the build time (model construction, without the solves), the
+solve time, the number of solves and iterations (where the solver interface exposes them), the
+status and objective, and the objective and solution deltas against the reference. It is
+written as JSON (with the machine, versions and settings of the run) and as CSV, so that runs
+can be tracked over time:
+
+    python benchmark.py ../data benchmark --sample 10
+"""
+import argparse
+import json
+import platform
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+import pyomo
+from pyomo.environ import value
+
+import solver_dispatch
+from criticality_pairs import single_key
+from mria_new_SUT_base import MRIA_SUT as MRIAnew
+from mria_new_SUT_base_ration_inverse import MRIA_SUT as MRIAratdemand
+from mria_new_SUT_lexicographic import MRIA_SUT as MRIAlex
+from mria_new_SUT_min_ration import MRIA_SUT as MRIAration
+from mria_new_SUT_min_X import MRIA_SUT as MRIAminx
+from scenario_engine import teardown
+
+
+STAGES = ('base', 'min_ration', 'min_X', 'inverse', 'lexicographic')
+
+VARIABLES = {'base': ('X',),
+             'min_ration': ('Xdis', 'Ddis', 'disimp'),
+             'min_X': ('Xdis', 'Ddis', 'disimp'),
+             'inverse': ('X',),
+             'lexicographic': ('Xdis', 'Ddis', 'disimp')}
+
+"""
+Option sets: scaling of the stage models (scaling.py), and solver options per backend, added
+to the options of every solve with that backend.
+"""
+
+OPTION_SETS = {
+    'default': {},
+    'scaled': {'scaling': True},
+    'simplex': {'solver': {'mosek': {'iparam.optimizer': 'optimizertype.free_simplex'},
+                           'highs': {'solver': 'simplex'}}},
+    'interior_point': {'solver': {'mosek': {'iparam.optimizer': 'optimizertype.intpnt'},
+                                  'highs': {'solver': 'ipm'}}},
+}
+
+
+def disruption_matrix(path='Disruption_matrix.xlsx'):
+    """
+    Disrupted region-sector pairs of the disruption matrix, as in the sensitivity analysis.
+    """
+    dis_mat = pd.read_excel(path, index_col= [0])
+    return {(region, sector): value
+            for sector, row in dis_mat.iterrows()
+            for region, value in row.items()
+            if value == 1}
+
+
+def sensitivity_grid(dismat_dict, dis_array=(0.1,), op_array=(1, 1.01, 1.025, 1.05, 1.075, 1.1), ip_array=(0, 0.25, 1)):
+
+    for dis_value in dis_array:
+        for op_factor in op_array:
+            for imp_flex in ip_array:
+                yield {'key': ('grid', dis_value, op_factor, imp_flex),
+                       'disr_dict_sup': {key: val - dis_value for key, val in dismat_dict.items()},
+                       'op_factor': op_factor, 'imp_flex': imp_flex}
+
+
+def criticality_sample(DATA, n=10, dis_value=0.1, seed=0, op_factor=1.025, imp_flex=1):
+
+    cells = [(R, S) for R in DATA.countries for S in DATA.sectors]
+    rng = np.random.default_rng(seed)
+    for i in sorted(rng.choice(len(cells), min(n, len(cells)), replace=False)):
+        yield {'key': single_key(cells[i], dis_value),
+               'disr_dict_sup': {cells[i]: 1 - dis_value},
+               'op_factor': op_factor, 'imp_flex': imp_flex}
+
+
+def c20_ladder(DATA, levels=(0.1, 0.25, 0.5, 0.75, 1), sector='C20', regions=None, op_factor=1.025, imp_flex=1):
+
+    regions = DATA.countries if regions is None else regions
+    for level in levels:
+        yield {'key': ('ladder', sector, level),
+               'disr_dict_sup': {(R, sector): 1 - level for R in regions},
+               'op_factor': op_factor, 'imp_flex': imp_flex}
+
+
+def reference_scenarios(DATA, dismat_dict, sample=10, seed=0):
+    """
+    Dictionary {suite: list of scenarios} of the three reference suites.
+    """
+    return {'sensitivity_grid': list(sensitivity_grid(dismat_dict)),
+            'criticality_sample': list(criticality_sample(DATA, sample, seed=seed)),
+            'c20_ladder': list(c20_ladder(DATA))}
+
+
+def _solution(MRIA_RUN, stage):
+
+    return {name: getattr(MRIA_RUN, name).get_values() for name in VARIABLES[stage]}
+
+
+def _delta(solution, reference):
+    """
+    Largest absolute difference over the variables of a stage, and relative to the largest
+    absolute reference value.
+    """
+    diff, scale = 0.0, 0.0
+    for name, values in reference.items():
+        for index, ref in values.items():
+            ref = ref or 0.0
+            diff = max(diff, abs((solution[name].get(index) or 0.0) - ref))
+            scale = max(scale, abs(ref))
+    return diff, diff / max(scale, 10**-12)
+
+
+class Benchmark(object):
+    """
+    Parameters
+        - DATA - the **sut_basic** class object
+        - distance_dict - distance dictionary of the disaster imports
+        - scenarios - dictionary {suite: list of scenarios}, see reference_scenarios()
+        - backends - backends to run; all available ones by default
+        - option_sets - dictionary {name: option set}, see OPTION_SETS
+        - stages - stages to run, see STAGES
+        - reference - (backend, option set) of the reference; the first ones by default
+        - num_thres - threshold of the disaster imports of the disaster stages
+        - all_disimp - switch of the disaster imports of scenarios that do not set it
+        - new_Xbase - corrected baseline of the disaster stages; that of the reference base
+          stage if None (the base stage must then be run)
+    """
+
+    def __init__(self, DATA, distance_dict, scenarios, backends=None, option_sets=None, stages=STAGES,
+                 reference=None, num_thres=10**-30, all_disimp=1, new_Xbase=None):
+
+        self.DATA = DATA
+        self.distance_dict = distance_dict
+        self.scenarios = scenarios
+        self.backends = list(backends or solver_dispatch.available_backends())
+        self.option_sets = dict(option_sets or OPTION_SETS)
+        self.stages = [stage for stage in STAGES if stage in stages]
+        self.reference = tuple(reference or (self.backends[0], next(iter(self.option_sets))))
+        configs = [(backend, name) for backend in self.backends for name in self.option_sets]
+        if self.reference not in configs:
+            raise ValueError('Reference {} is not one of the (backend, option set) pairs benchmarked: {}'.format(
+                self.reference, configs))
+        self.num_thres = num_thres
+        self.all_disimp = all_disimp
+
+        self.rows = []
+        self.inputs = {} if new_Xbase is None else {'baseline': new_Xbase}
+        self.solutions = {}
+
+    def _configs(self):
+        """
+        (backend, option set) pairs, the reference first.
+        """
+        configs = [(backend, name) for backend in self.backends for name in self.option_sets]
+        configs.remove(self.reference)
+        return [self.reference] + configs
+
+    def _build(self, stage, scenario):
+
+        DATA = self.DATA
+        classes = {'base': MRIAnew, 'min_ration': MRIAration, 'min_X': MRIAminx,
+                   'inverse': MRIAratdemand, 'lexicographic': MRIAlex}
+        MRIA_RUN = classes[stage](DATA.name, DATA.countries, DATA.sectors, DATA.products)
+        MRIA_RUN.create_sets()
+        MRIA_RUN.create_alias()
+
+        if stage == 'base':
+            MRIA_RUN.baseline_data(DATA)
+            return MRIA_RUN
+
+        key = scenario['key']
+        if stage == 'inverse':
+            MRIA_RUN.baseline_data(DATA, self.inputs[key]['Ddis'])
+            return MRIA_RUN
+
+        MRIA_RUN.baseline_data(DATA, self.inputs['baseline'])
+        disaster = (scenario.get('disr_dict_sup', {}), scenario.get('disr_dict_dem', {}),
+                    scenario.get('op_factor', 1), scenario.get('all_disimp', self.all_disimp),
+                    scenario.get('imp_flex', 0), self.distance_dict)
+        if stage == 'min_X':
+            inputs = self.inputs[key]
+            MRIA_RUN.create_disaster_data(*disaster, inputs['Ddis'], inputs['Xdis'], inputs['disimp'], self.num_thres)
+        else:
+            MRIA_RUN.create_disaster_data(*disaster, self.num_thres)
+        return MRIA_RUN
+
+    def run_stage(self, suite, stage, scenario, backend, name):
+        """
+        Build and solve one stage and add its row to the report.
+        """
+        options = self.option_sets[name]
+        stats = solver_dispatch.default_dispatch().stats
+        before = dict(stats)
+        key = scenario['key']
+        row = {'suite': suite, 'scenario': json.dumps(key, default=str), 'stage': stage,
+               'backend': backend, 'option_set': name}
+
+        MRIA_RUN = None
+        start = time.perf_counter()
+        try:
+            MRIA_RUN = self._build(stage, scenario)
+            if stage in ('base', 'inverse'):
+                MRIA_RUN.run_basemodel(backend, options.get('scaling', False))
+            else:
+                MRIA_RUN.run_impactmodel(backend, options.get('scaling', False))
+            total = time.perf_counter() - start
+
+            solve_time = stats['solve_time'] - before['solve_time']
+            objective = value(MRIA_RUN.m.objective, exception=False)
+            row.update({'status': str(MRIA_RUN.termination_condition),
+                        'used_backend': getattr(MRIA_RUN, 'backend', None),
+                        'build_time': total - solve_time,
+                        'solve_time': solve_time,
+                        'solves': stats['solves'] - before['solves'],
+                        'iterations': None if stats['unknown_iterations'] > before['unknown_iterations']
+                                      else stats['iterations'] - before['iterations'],
+                        'objective': objective})
+
+            if row['status'] != 'optimal':
+                return row
+
+            solution = _solution(MRIA_RUN, stage)
+            if (backend, name) == self.reference:
+                self.solutions[stage, key] = (objective, solution)
+                if stage == 'base':
+                    self.inputs.setdefault('baseline', solution['X'])
+                elif stage == 'min_ration':
+                    self.inputs[key] = solution
+
+            if (stage, key) in self.solutions:
+                ref_objective, reference = self.solutions[stage, key]
+                row['objective_delta'] = objective - ref_objective
+                row['objective_rel_delta'] = abs(objective - ref_objective) / max(abs(ref_objective), 10**-12)
+                row['solution_delta'], row['solution_rel_delta'] = _delta(solution, reference)
+
+        except Exception:
+            row.update({'status': 'error', 'error': traceback.format_exc(limit=3)})
+        finally:
+            teardown(MRIA_RUN)
+            self.rows.append(row)
+
+        return row
+
+    def run(self, log=None):
+        """
+        Run all stages, scenarios, backends and option sets.
+
+        Outputs
+            - DataFrame of the report, one row per run
+        """
+        previous = solver_dispatch.default_dispatch()
+        try:
+            for backend, name in self._configs():
+                # no fallback, so that every result comes from the backend under test
+                solver_dispatch.configure(seats=previous.seats, lock_dir=previous.lock_dir, fallback=None,
+                                          wait=None, options=self.option_sets[name].get('solver'))
+
+                for stage in self.stages:
+                    if stage == 'base':
+                        runs = [('baseline', {'key': 'baseline'})]
+                    else:
+                        runs = [(suite, scenario) for suite, scenarios in self.scenarios.items() for scenario in scenarios]
+
+                    for suite, scenario in runs:
+                        if stage in ('min_X', 'inverse') and scenario['key'] not in self.inputs:
+                            continue
+                        row = self.run_stage(suite, stage, scenario, backend, name)
+                        if log is not None:
+                            log('{} {} {} {}: {} in {:.2f}s'.format(backend, name, stage, row['scenario'],
+                                                                   row['status'], row.get('solve_time', 0)))
+        finally:
+            solver_dispatch.DISPATCH = previous
+
+        return self.report()
+
+    def report(self):
+
+        return pd.DataFrame(self.rows)
+
+    def metadata(self):
+
+        return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'host': platform.node(),
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'python': platform.python_version(),
+                'pyomo': pyomo.version.version,
+                'table': self.DATA.name,
+                'regions': len(self.DATA.countries),
+                'sectors': len(self.DATA.sectors),
+                'products': len(self.DATA.products),
+                'backends': self.backends,
+                'option_sets': self.option_sets,
+                'stages': self.stages,
+                'reference': list(self.reference),
+                'num_thres': self.num_thres}
+
+    def write(self, prefix):
+        """
+        Write the report to prefix.json (metadata and rows) and prefix.csv (rows).
+        """
+        report = self.report()
+        report.to_csv(prefix + '.csv', index=False)
+        rows = json.loads(report.to_json(orient='records'))
+        with open(prefix + '.json', 'w') as f:
+            json.dump({'metadata': self.metadata(), 'rows': rows}, f, indent=1, default=str)
+        return report
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark the MRIA stage models across solver backends.')
+    parser.add_argument('input_path', help='input directory with the SUT table in MRIO/')
+    parser.add_argument('prefix', help='path of the report, without extension (.json and .csv are written)')
+    parser.add_argument('--tensor-path', default=None, help='directory of the SUT tensor exports')
+    parser.add_argument('--disruption-matrix', default='Disruption_matrix.xlsx')
+    parser.add_argument('--backends', nargs='*', default=None, help='backends to run (default: all available)')
+    parser.add_argument('--option-sets', nargs='*', default=list(OPTION_SETS), choices=list(OPTION_SETS))
+    parser.add_argument('--stages', nargs='*', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--sample', type=int, default=10, help='size of the criticality sample')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from input_loader import mria_inputs
+
+    DATA, regions = mria_inputs(args.input_path, tensor_path=args.tensor_path)
+    # beta = 0, as in the sensitivity analysis: disaster imports are not limited by distance
+    distance_dict = {(r1, r2): 1 for r1 in regions for r2 in regions}
+    scenarios = reference_scenarios(DATA, disruption_matrix(args.disruption_matrix), args.sample, args.seed)
+
+    benchmark = Benchmark(DATA, distance_dict, scenarios, backends=args.backends,
+                          option_sets={name: OPTION_SETS[name] for name in args.option_sets}, stages=args.stages)
+    benchmark.run(log=print)
+    benchmark.write(args.prefix)
+    print('report written to {}.json and {}.csv'.format(args.prefix, args.prefix))
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
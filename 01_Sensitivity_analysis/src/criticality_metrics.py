@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Location quotient and criticality metrics of the region-sector pairs.
+
+Vectorised versions of the metrics of 02_Criticality_Analysis (LQ.ipynb and
+Criticality_estimation.ipynb), for an output matrix x with sectors as rows and regions as
+columns, the layout of Xbase.xlsx:
+
+    - location quotient       LQ[s, r] = (x[s, r] / sum_s x[s, r]) / (sum_r x[s, r] / sum x)
+    - output share            x[s, r] / sum x                    (xbase_critical.xlsx)
+    - rationing criticality   rationing[s, r] / sum rationing      (rat_criticality.xlsx)
+
+where rationing[s, r] is the total rationing when sector s in region r is disrupted.
+
+The metrics are computed with broadcasting on the whole matrix. The output can be given as a
+DataFrame (Xbase.xlsx), a dictionary {(R, S): value} (the corrected baseline new_Xbase), an
+MRIA model (its Xbase) or an (R, S) array; the rationing can also be read from the single
+shock records of a **ResultStore** (see criticality_pairs.py).
+"""
+import numpy as np
+import pandas as pd
+
+from criticality_pairs import single_key
+from scenario_engine import values_to_array
+
+
+def output_matrix(xbase, DATA=None):
+    """
+    Output as a DataFrame with sectors as rows and regions as columns.
+
+    Parameters
+        - xbase - DataFrame (sectors x regions), dictionary {(R, S): value}, MRIA model with an
+          Xbase parameter, or (R, S) array
+        - DATA - the **sut_basic** class object, for the order of dictionaries, models and arrays
+    """
+    if isinstance(xbase, pd.DataFrame):
+        return xbase.astype(float)
+
+    if hasattr(xbase, 'Xbase'):
+        xbase = xbase.Xbase.extract_values()
+
+    if isinstance(xbase, dict):
+        if DATA is not None:
+            countries, sectors = DATA.countries, DATA.sectors
+        else:
+            countries = sorted(set(k[0] for k in xbase))
+            sectors = sorted(set(k[1] for k in xbase))
+        xbase = values_to_array(xbase, countries, sectors)
+    else:
+        countries, sectors = DATA.countries, DATA.sectors
+
+    return pd.DataFrame(np.asarray(xbase, dtype=float).T, index=sectors, columns=countries)
+
+
+def _ratio(a, b):
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(b != 0, a / np.where(b != 0, b, 1), np.nan)
+
+
+def location_quotient(xbase, DATA=None):
+    """
+    Location quotient of every sector (rows) in every region (columns).
+    """
+    x = output_matrix(xbase, DATA)
+    arr = x.to_numpy()
+
+    region_share = _ratio(arr, arr.sum(axis=0, keepdims=True))
+    sector_share = _ratio(arr.sum(axis=1, keepdims=True), arr.sum())
+
+    return pd.DataFrame(_ratio(region_share, sector_share), index=x.index, columns=x.columns)
+
+
+def output_share(xbase, DATA=None):
+    """
+    Share of every region-sector pair in the total output.
+    """
+    x = output_matrix(xbase, DATA)
+    return x / x.to_numpy().sum()
+
+
+def store_rationing(store, DATA, dis_value):
+    """
+    Total rationing of the single shocks of dis_value in a **ResultStore**, with sectors as rows
+    and regions as columns. Missing and failed shocks are NaN.
+    """
+    rationing = pd.DataFrame(np.nan, index=DATA.sectors, columns=DATA.countries)
+    for r in DATA.countries:
+        for s in DATA.sectors:
+            record = store.get(single_key((r, s), dis_value))
+            if record is not None and record['status'] == 'optimal':
+                rationing.loc[s, r] = record['Ddis'].sum()
+    return rationing
+
+
+def rationing_criticality(rationing):
+    """
+    Rationing of every disrupted region-sector pair, normalised by the total over all pairs.
+
+    Parameters
+        - rationing - DataFrame of total rationing, sectors as rows and regions as columns
+          (see store_rationing)
+    """
+    rationing = rationing.astype(float)
+    return rationing / np.nansum(rationing.to_numpy())
+
+
+def criticality_table(xbase, rationing=None, DATA=None):
+    """
+    Long table of all metrics, one row per region-sector pair.
+    """
+    metrics = {'xbase': output_matrix(xbase, DATA),
+               'location_quotient': location_quotient(xbase, DATA),
+               'output_share': output_share(xbase, DATA)}
+    if rationing is not None:
+        metrics['rationing_criticality'] = rationing_criticality(rationing)
+
+    x = metrics['xbase']
+    index = pd.MultiIndex.from_product([x.index, x.columns], names=['sector', 'region'])
+    return pd.DataFrame({name: frame.reindex(index=x.index, columns=x.columns).to_numpy().reshape(-1)
+                         for name, frame in metrics.items()}, index=index)
\ No newline at end of file
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Pairwise (double) disruption criticality, with optional bound-based screening.
+
+The criticality analysis disrupts one region-sector pair at a time. For compound shocks the
+number of pairs grows quadratically (about 300k pairs for 12 regions x 64 sectors). By default
+every pair is solved and the top-k is exact. With a *coupling* weight, only the pairs that can
+still enter the top-k by a screening bound are solved:
+
+    - lower bound: the rationing of a pair is at least the larger of its two single shock
+      values, since disrupting more capacity only shrinks the feasible set of the LP
+    - upper bound: the sum of the two single shock values plus an interaction term, which is
+      the extra rationing the linear estimator (linear_estimator.py) finds for the pair
+      above its two parts, multiplied by *coupling*. The interaction term captures the
+      spare capacity and disaster imports that absorb either shock alone but not both.
+
+The upper bound is a screening bound, not a proof: pairs are solved in descending order of
+upper bound, in batches through the scenario engine, and all pairs whose upper bound falls
+below the k-th largest solved value are pruned. A pair whose true rationing exceeds its
+screening bound can therefore be pruned although it belongs to the top-k, so with pruning the
+result is a screened approximation of the top-k, is reported as such (exact=False) and run()
+warns about it. A larger coupling prunes less; coupling=None (the default) disables pruning.
+
+Results are kept in a **ResultStore**, so single shocks (and pairs) already solved in an
+earlier run are read instead of solved again.
+"""
+import heapq
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from linear_estimator import LinearEstimator
+
+
+def single_key(cell, dis_value):
+
+    return ('single',) + tuple(cell) + (dis_value,)
+
+
+def pair_key(cell_a, cell_b, dis_value):
+
+    return ('pair',) + tuple(cell_a) + tuple(cell_b) + (dis_value,)
+
+
+def _solve_missing(engine, store, scenarios):
+    """
+    Solve the scenarios that are not in the store yet, add them, and return the total
+    rationing of every scenario key and the number of scenarios solved. Failed solves
+    (status 'error') are not stored, so that they are tried again in a later run.
+    """
+    totals = {}
+    missing = []
+    for scenario in scenarios:
+        record = store.get(scenario['key']) if store is not None else None
+        if record is None:
+            missing.append(scenario)
+        else:
+            totals[scenario['key']] = record['Ddis'].sum() if record['status'] == 'optimal' else np.nan
+
+    for record in engine.imap(missing):
+        if store is not None and record['status'] != 'error':
+            store.put(record['key'], record)
+        totals[record['key']] = record['Ddis'].sum() if record['status'] == 'optimal' else np.nan
+
+    return totals, len(missing)
+
+
+class PairwiseCriticality(object):
+    """
+    Parameters
+        - engine - **ScenarioEngine** used for the exact solves
+        - DATA - the **sut_basic** class object
+        - dis_value - share of capacity lost in each disrupted region-sector pair
+        - cells - region-sector pairs to combine; all pairs of DATA by default
+        - store - **ResultStore** for single and pair results (optional)
+        - op_factor, imp_flex, all_disimp - model parameters, as in the criticality analysis
+        - coupling - weight of the interaction term in the screening upper bound, e.g. 2.0 to
+          screen the pairs (approximate result); None solves every pair (exact result)
+    """
+
+    def __init__(self, engine, DATA, dis_value, cells=None, store=None,
+                 op_factor=1.025, imp_flex=1, all_disimp=1, coupling=None):
+
+        self.engine = engine
+        self.DATA = DATA
+        self.dis_value = dis_value
+        self.store = store
+        self.params = {'op_factor': op_factor, 'imp_flex': imp_flex, 'all_disimp': all_disimp}
+        self.coupling = coupling
+
+        if cells is None:
+            cells = [(r, s) for r in DATA.countries for s in DATA.sectors]
+        self.cells = list(cells)
+
+        self.estimator = LinearEstimator(DATA, engine.new_Xbase)
+
+    def _scenario(self, key, cells):
+
+        scenario = dict(self.params)
+        scenario['key'] = key
+        scenario['disr_dict_sup'] = {cell: 1 - self.dis_value for cell in cells}
+        return scenario
+
+    def singles(self):
+        """
+        Total rationing of every single shock, from the store or solved.
+        """
+        scenarios = [self._scenario(single_key(cell, self.dis_value), [cell]) for cell in self.cells]
+        totals, solved = _solve_missing(self.engine, self.store, scenarios)
+        return np.array([totals[single_key(cell, self.dis_value)] for cell in self.cells])
+
+    def interaction(self, pairs, batch=5000):
+        """
+        Extra rationing of the linear estimator for each pair over the sum of its parts.
+        """
+        est = self.estimator
+        loss = est.disruption_matrix([{cell: 1 - self.dis_value} for cell in self.cells])
+        single = est.estimate(loss, self.params['op_factor'], self.params['imp_flex'], self.params['all_disimp'])
+        shortage = single['shortage'].reshape(len(self.cells), est.m)
+        alone = single['rationing'].reshape(len(self.cells), est.m).sum(axis=1)
+
+        out = np.zeros(len(pairs))
+        for start in range(0, len(pairs), batch):
+            a, b = pairs[start:start + batch, 0], pairs[start:start + batch, 1]
+            rationing = est.rationing_from(shortage[a] + shortage[b], loss[a] + loss[b],
+                                           self.params['op_factor'], self.params['imp_flex'], self.params['all_disimp'])
+            out[start:start + batch] = np.maximum(0, rationing.sum(axis=1) - alone[a] - alone[b])
+        return out
+
+    def run(self, top_k=20, batch_size=None):
+        """
+        Find the top_k pairs with the highest total rationing. With pruning (coupling not None)
+        the result is screened by the heuristic upper bound and may miss pairs of the true
+        top_k; it is exact only with coupling=None.
+
+        Outputs
+            - DataFrame of the top_k pairs with their single and pair rationing and bounds
+            - dictionary with the number of pairs, the pairs evaluated (solved now or read from
+              the store), solved now and pruned, and whether the result is exact
+        """
+        single = np.nan_to_num(self.singles())
+
+        n = len(self.cells)
+        pairs = np.column_stack(np.triu_indices(n, k=1))
+
+        lower = np.maximum(single[pairs[:, 0]], single[pairs[:, 1]])
+        if self.coupling is None:
+            upper = np.full(len(pairs), np.inf)
+        else:
+            warnings.warn('Pairs are screened with a heuristic upper bound (coupling={}); pairs of the '
+                          'true top {} can be pruned, use coupling=None for the exact result'.format(self.coupling, top_k))
+            upper = single[pairs[:, 0]] + single[pairs[:, 1]] + self.coupling * self.interaction(pairs)
+
+        # Highest upper bound first, lower bound as tie breaker
+        order = np.lexsort((-lower, -upper))
+        batch_size = batch_size or max(top_k, 4 * max(1, self.engine.processes))
+
+        best = []
+        evaluated = 0
+        solved = 0
+        position = 0
+        while position < len(order):
+            threshold = best[0][0] if len(best) >= top_k else -np.inf
+            if upper[order[position]] < threshold:
+                break
+
+            batch = order[position:position + batch_size]
+            batch = batch[upper[batch] >= threshold]
+            position += batch_size
+
+            scenarios = []
+            for p in batch:
+                a, b = self.cells[pairs[p, 0]], self.cells[pairs[p, 1]]
+                scenarios.append(self._scenario(pair_key(a, b, self.dis_value), [a, b]))
+            totals, n = _solve_missing(self.engine, self.store, scenarios)
+            evaluated += len(batch)
+            solved += n
+
+            for p, scenario in zip(batch, scenarios):
+                value = totals[scenario['key']]
+                if np.isnan(value):
+                    continue
+                item = (value, int(p))
+                if len(best) < top_k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+
+        rows = []
+        for value, p in sorted(best, reverse=True):
+            a, b = self.cells[pairs[p, 0]], self.cells[pairs[p, 1]]
+            rows.append([a[0], a[1], b[0], b[1], single[pairs[p, 0]], single[pairs[p, 1]],
+                         value, lower[p], upper[p]])
+
+        top = pd.DataFrame(rows, columns=['R1', 'S1', 'R2', 'S2', 'single1', 'single2',
+                                          'rationing', 'lower_bound', 'upper_bound'])
+        stats = {'pairs': len(pairs), 'evaluated': evaluated, 'solved': solved,
+                 'pruned': len(pairs) - evaluated, 'exact': self.coupling is None}
+        top.attrs['exact'] = stats['exact']
+        return top, stats
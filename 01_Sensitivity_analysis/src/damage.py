@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorised depth-damage curves.
+
+The damage models relate flood inundation depth to the probability of functioning of an
+asset. All curves are loaded once into one compact interpolation table on a shared depth
+grid, so that a whole (assets x hazard scenarios) depth matrix is evaluated at once: the
+grid position of every depth is found with a single searchsorted, and every asset reads
+its own curve from the table by fancy indexing. There is no loop over assets, curves or
+return periods.
+
+Below the first depth of the grid the first value applies, above the last depth the last
+value, as with np.interp.
+"""
+import numpy as np
+import pandas as pd
+
+
+class DamageCurves(object):
+    """
+    Interpolation table of the damage models.
+
+    Parameters
+        - curves - DataFrame with the depth as index and one column per damage model,
+          e.g. the damage_curves of input_loader.hazard_inputs
+    """
+
+    def __init__(self, curves):
+
+        curves = curves.sort_index()
+        curves = curves.interpolate(method='index', limit_direction='both')
+
+        self.models = list(curves.columns)
+        self.position = {m: i for i, m in enumerate(self.models)}
+        self.depth = curves.index.to_numpy(dtype=float)
+        self.values = curves.to_numpy(dtype=float).T
+
+    @classmethod
+    def from_excel(cls, path):
+
+        return cls(pd.read_excel(path, index_col=[0]))
+
+    def model_index(self, models):
+        """
+        Position in the table of the damage model of every asset.
+        """
+        return np.array([self.position[m] for m in models], dtype=int)
+
+    def evaluate(self, depth, model_idx):
+        """
+        Probability of functioning.
+
+        Parameters
+            - depth - (A, H) array of inundation depth of A assets in H hazard scenarios
+            - model_idx - (A,) array of the damage model of every asset, see model_index()
+
+        Outputs
+            - (A, H) array of the probability of functioning
+        """
+        depth = np.atleast_2d(np.asarray(depth, dtype=float))
+        grid = self.depth
+
+        if len(grid) == 1:
+            return np.broadcast_to(self.values[model_idx, :1], depth.shape).copy()
+
+        clipped = np.clip(depth, grid[0], grid[-1])
+        upper = np.clip(np.searchsorted(grid, clipped, side='right'), 1, len(grid) - 1)
+        lower = upper - 1
+
+        fraction = (clipped - grid[lower]) / (grid[upper] - grid[lower])
+
+        rows = model_idx[:, None]
+        return self.values[rows, lower] + fraction * (self.values[rows, upper] - self.values[rows, lower])
+
+
+def capacity_loss(functioning, weight, groups):
+    """
+    Remaining share of capacity per group of assets (e.g. region-sector pair) in every scenario.
+
+    Parameters
+        - functioning - (A, H) probability of functioning
+        - weight - (A,) weight of every asset
+        - groups - (A,) labels of the group of every asset
+
+    Outputs
+        - list of the G group labels
+        - (G, H) array of the weighted mean probability of functioning
+    """
+    labels, codes = np.unique(np.asarray(groups), return_inverse=True)
+    codes = codes.reshape(-1)
+
+    functioning_sum = np.zeros((len(labels), functioning.shape[1]))
+    np.add.at(functioning_sum, codes, functioning * weight[:, None])
+    weight_sum = np.bincount(codes, weights=weight, minlength=len(labels))
+
+    remaining = np.ones_like(functioning_sum)
+    np.divide(functioning_sum, weight_sum[:, None], out=remaining, where=weight_sum[:, None] > 0)
+    return list(labels), remaining
@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+"""
+Regional (Benders) decomposition of the MRIA disaster stages.
+
+The demSup constraints of a region are linked to other regions in two ways: the sectors of
+other regions buy products from its markets (Use[R,P,Rb,S] Xdis[Rb,S], Rb != R), and the
+disaster imports disimp[Rb,R,P] move supply between the markets of a product. These coupling
+quantities become the variables of a master problem:
+
+    T[R,Rb,P]       product P of region R bought by the sectors of region Rb (trade links of the
+                    Use table only)
+    disimp[Rb,R,P]  disaster imports (links with disimplim > 0 only)
+
+Given their values, the model falls apart into one LP per region, over Xdis[r,S] and Ddis[r,P]:
+
+    market:  sum_S Xdis[r,S] (Sup[r,S,P] - Use[r,P,r,S]) + Ddis[r,P] + u[P]
+                 >= fd + ExpROW + Held - demlim + sum_Rb T[r,Rb,P] + sum_Rb disimp[r,Rb,P] - sum_Rb disimp[Rb,r,P]
+    purchases: sum_S Use[R,P,r,S] Xdis[r,S] <= T[R,r,P] + v[R,P]      for every link (R, r, P)
+
+where the elastic slacks u and v (with a large penalty) keep every regional LP feasible for
+any master point. Buying less than T from a market never breaks the monolithic demSup
+constraint, so the decomposition has the optimum of the monolithic model. The master
+minimises the sum of regional value functions, approximated from below by cuts built from
+the duals of the regional LPs, until the gap between the master bound and the best regional
+solution closes. A stage that reaches max_iter before its gap closes is not converged: the
+supply stage is then not solved, or the record gets the status 'not_converged'.
+
+Both MRIA stages are decomposed in turn: the minimise rationing stage, and the minimise
+supply stage (Xdis plus alpha_weight x disimp) with every Ddis bounded by its rationing
+optimum, as in mria_run. The regional LPs of an iteration are solved in parallel worker
+processes. Optimal LP solutions are not unique, so the decomposition reproduces the
+objectives of the monolithic model (see verify()), not necessarily every variable.
+"""
+import multiprocessing
+
+import numpy as np
+from pyomo.environ import (ConcreteModel, Constraint, ConstraintList, NonNegativeReals, Objective, Param,
+                           Set, Suffix, Var, minimize, value)
+from pyomo.opt import SolverFactory, TerminationCondition
+
+from model_data import model_data
+from run_mria import mria_run
+from scenario_engine import extract_result, values_to_array
+from solver_dispatch import BACKENDS, solve_model
+
+
+def disaster_arrays(DATA, new_Xbase, distance_dict, scenario, num_thres=10**-30):
+    """
+    Coefficients and bounds of the disaster stages as arrays, as built by the MRIA models.
+
+    Outputs
+        - dictionary with Sup (R, S, P), Use (R, P, Rb, S), const (R, P) = fd + ExpROW + Held - demlim
+          (the demand held at baseline is part of demSup but cannot be rationed, see model_data.py),
+          Xlim (R, S), Dub (R, P) and disimplim (Rb, R, P)
+    """
+    data = model_data(DATA, new_Xbase)
+
+    countries, sectors, products = DATA.countries, DATA.sectors, DATA.products
+
+    xbase, sup, use = data.xbase, data.sup, data.use
+    demand = data.fd + data.exprow
+
+    sup_disrupt = np.ones(xbase.shape)
+    disrupted = np.zeros(xbase.shape, dtype=bool)
+    for (R, S), v in scenario.get('disr_dict_sup', {}).items():
+        sup_disrupt[countries.index(R), sectors.index(S)] = v
+        disrupted[countries.index(R), sectors.index(S)] = True
+
+    op_factor = scenario.get('op_factor', 1)
+    op = values_to_array(op_factor, countries, sectors) if isinstance(op_factor, dict) else op_factor
+    xlim = xbase * sup_disrupt * np.where(disrupted, 1, op)
+
+    dem_disrupt = np.zeros(demand.shape)
+    for (R, P), v in scenario.get('disr_dict_dem', {}).items():
+        dem_disrupt[countries.index(R), products.index(P)] = 1 - v
+    demlim = demand * dem_disrupt
+
+    imp_flex = scenario.get('imp_flex', 0)
+    ip = values_to_array(imp_flex, countries, countries, products) if isinstance(imp_flex, dict) else imp_flex
+    distance = values_to_array(distance_dict, countries, countries)
+    # disimplim[Rb,R,P] = ip * sum_Sb Use[Rb,P,R,Sb] Xbase[R,Sb] * all_disimp * distance[Rb,R]
+    disimplim = ip * data.link * scenario.get('all_disimp', 1) * distance[:, :, None]
+    disimplim[np.arange(len(countries)), np.arange(len(countries))] = 0
+    disimplim[disimplim < num_thres] = 0
+
+    return {'Sup': sup, 'Use': use, 'const': demand + data.held - demlim, 'Xlim': xlim,
+            'Dub': np.maximum(0, demand - demlim), 'disimplim': disimplim}
+
+
+def coupling_links(arrays):
+    """
+    Index arrays of the master variables: trade links (R, Rb, P) with R != Rb and imports (Rb, R, P).
+    """
+    use = arrays['Use']
+    nR = use.shape[0]
+    flow = (use != 0).any(axis=3).transpose(0, 2, 1)
+    flow[np.arange(nR), np.arange(nR)] = False
+    return np.argwhere(flow), np.argwhere(arrays['disimplim'] > 0)
+
+
+"""
+Regional subproblems
+"""
+
+def build_subproblem(arrays, r, in_links, penalty):
+    """
+    LP of region r for given coupling values, see the module description.
+    """
+    sup, use = arrays['Sup'], arrays['Use']
+    nS, nP = sup.shape[1], sup.shape[2]
+
+    m = ConcreteModel()
+    m.S = Set(initialize=range(nS))
+    m.P = Set(initialize=range(nP))
+    m.K = Set(initialize=range(len(in_links)))
+
+    xlim, dub = arrays['Xlim'][r], arrays['Dub'][r]
+    m.Xdis = Var(m.S, bounds=lambda m, s: (0, xlim[s]))
+    m.Ddis = Var(m.P, bounds=lambda m, p: (0, dub[p]))
+    m.u = Var(m.P, within=NonNegativeReals)
+    m.v = Var(m.K, within=NonNegativeReals)
+
+    m.rhs = Param(m.P, mutable=True, initialize=0)
+    m.T = Param(m.K, mutable=True, initialize=0)
+
+    net = sup[r].T - use[r, :, r, :]
+    const = arrays['const'][r]
+
+    def market(m, p):
+        return (sum(net[p, s] * m.Xdis[s] for s in np.flatnonzero(net[p])) + m.Ddis[p] + m.u[p]
+                >= const[p] + m.rhs[p])
+
+    m.market = Constraint(m.P, rule=market)
+
+    def purchases(m, k):
+        R, P = in_links[k]
+        coef = use[R, P, r]
+        return -sum(coef[s] * m.Xdis[s] for s in np.flatnonzero(coef)) + m.v[k] >= -m.T[k]
+
+    m.purchases = Constraint(m.K, rule=purchases)
+
+    slack = penalty * (sum(m.u[p] for p in m.P) + sum(m.v[k] for k in m.K))
+    m.ration = Objective(expr=sum(m.Ddis[p] for p in m.P) + slack, sense=minimize)
+    m.supply = Objective(expr=sum(m.Xdis[s] for s in m.S) + slack, sense=minimize)
+    m.supply.deactivate()
+
+    m.dual = Suffix(direction=Suffix.IMPORT)
+    return m
+
+
+def _solve(model, solvername):
+    """
+    Solve an LP of the decomposition: the backends of solver_dispatch.py within their seat
+    limits, any other Pyomo solver (with duals) directly.
+    """
+    if solvername in BACKENDS:
+        return solve_model(model, solvername, tee=False)[0]
+    return SolverFactory(solvername).solve(model)
+
+
+_SUB = {}
+
+
+def _init_sub_worker(arrays, in_links, solvername, penalty):
+
+    _SUB['args'] = (arrays, in_links, solvername, penalty)
+    _SUB['models'] = {}
+
+
+def _solve_subproblem(task):
+    """
+    Solve the LP of a region at a master point and return its value, duals and solution.
+    """
+    stage, r, rhs, T, dub = task
+    arrays, in_links, solvername, penalty = _SUB['args']
+
+    if r not in _SUB['models']:
+        _SUB['models'][r] = build_subproblem(arrays, r, in_links[r], penalty)
+    m = _SUB['models'][r]
+
+    for p in m.P:
+        m.rhs[p] = rhs[p]
+        m.Ddis[p].setub(arrays['Dub'][r][p] if dub is None else dub[p])
+    for k in m.K:
+        m.T[k] = T[k]
+
+    objective = m.ration if stage == 'ration' else m.supply
+    m.ration.deactivate()
+    m.supply.deactivate()
+    objective.activate()
+
+    results = _solve(m, solvername)
+    if results.solver.termination_condition != TerminationCondition.optimal:
+        raise RuntimeError('regional subproblem {} ended with status {}'.format(r, results.solver.termination_condition))
+
+    return {'region': r, 'value': value(objective),
+            'y_market': np.array([m.dual.get(m.market[p], 0) for p in m.P]),
+            'y_purchases': np.array([m.dual.get(m.purchases[k], 0) for k in m.K]),
+            'Xdis': np.array([m.Xdis[s].value for s in m.S]),
+            'Ddis': np.array([m.Ddis[p].value for p in m.P]),
+            'slack': sum(m.u[p].value for p in m.P) + sum(m.v[k].value for k in m.K)}
+
+
+class RegionalDecomposition(object):
+    """
+    Parameters
+        - DATA - the **sut_basic** class object
+        - new_Xbase - corrected baseline (stage 1 of mria_run)
+        - distance_dict - distance dictionary of the disaster imports
+        - solvername - solver of the master and regional LPs (with duals, e.g. mosek)
+        - processes - number of worker processes for the regional LPs
+        - penalty - cost of the elastic slacks of the regional LPs
+        - tol - relative gap at which a stage stops
+        - max_iter - maximum number of master iterations per stage
+        - alpha_weight - weight of the disaster imports in the minimise supply objective
+        - num_thres - threshold on the disaster import limits
+    """
+
+    def __init__(self, DATA, new_Xbase, distance_dict, solvername, processes=1, penalty=10**4,
+                 tol=10**-6, max_iter=200, alpha_weight=1.2, num_thres=10**-30):
+
+        self.DATA = DATA
+        self.new_Xbase = new_Xbase
+        self.distance_dict = distance_dict
+        self.solvername = solvername
+        self.processes = processes
+        self.penalty = penalty
+        self.tol = tol
+        self.max_iter = max_iter
+        self.alpha_weight = alpha_weight
+        self.num_thres = num_thres
+
+    def _setup(self, scenario):
+
+        self.arrays = disaster_arrays(self.DATA, self.new_Xbase, self.distance_dict, scenario, self.num_thres)
+        self.flows, self.imports = coupling_links(self.arrays)
+
+        nR = len(self.DATA.countries)
+        self.in_links = [[] for r in range(nR)]
+        self.in_index = [[] for r in range(nR)]
+        for k, (R, Rb, P) in enumerate(self.flows):
+            self.in_links[Rb].append((R, P))
+            self.in_index[Rb].append(k)
+
+        # T[R,Rb,P] <= sum_S Use[R,P,Rb,S] Xlim[Rb,S]
+        use, xlim = self.arrays['Use'], self.arrays['Xlim']
+        self.T_ub = np.array([use[R, P, Rb] @ xlim[Rb] for R, Rb, P in self.flows])
+        # start from the baseline flows
+        xbase = values_to_array(self.new_Xbase, self.DATA.countries, self.DATA.sectors)
+        self.T_start = np.minimum(np.array([use[R, P, Rb] @ xbase[Rb] for R, Rb, P in self.flows]), self.T_ub)
+
+    def _rhs(self, T, dis):
+        """
+        Coupling part of the market constraints of all regions, (R, P).
+        """
+        nR, nP = self.arrays['const'].shape
+        rhs = np.zeros((nR, nP))
+        np.add.at(rhs, (self.flows[:, 0], self.flows[:, 2]), T)
+        np.add.at(rhs, (self.imports[:, 0], self.imports[:, 2]), dis)
+        np.subtract.at(rhs, (self.imports[:, 1], self.imports[:, 2]), dis)
+        return rhs
+
+    def _build_master(self, stage):
+
+        nR = len(self.DATA.countries)
+        master = ConcreteModel()
+        master.F = Set(initialize=range(len(self.flows)))
+        master.I = Set(initialize=range(len(self.imports)))
+        master.R = Set(initialize=range(nR))
+
+        master.T = Var(master.F, bounds=lambda m, k: (0, self.T_ub[k]))
+        limit = self.arrays['disimplim'][tuple(self.imports.T)] if len(self.imports) else np.zeros(0)
+        master.dis = Var(master.I, bounds=lambda m, j: (0, limit[j]))
+        master.theta = Var(master.R, within=NonNegativeReals)
+        master.cuts = ConstraintList()
+
+        cost = self.alpha_weight if stage == 'supply' else 0
+        master.objective = Objective(expr=sum(master.theta[r] for r in master.R)
+                                          + cost * sum(master.dis[j] for j in master.I), sense=minimize)
+
+        # master variables entering the market constraints of each region and product
+        self.terms = {}
+        for k, (R, Rb, P) in enumerate(self.flows):
+            self.terms.setdefault((R, P), []).append((1, master.T[k]))
+        for j, (Rb, R, P) in enumerate(self.imports):
+            self.terms.setdefault((Rb, P), []).append((1, master.dis[j]))
+            self.terms.setdefault((R, P), []).append((-1, master.dis[j]))
+        return master
+
+    def _add_cut(self, master, solution, rhs, T):
+
+        r = solution['region']
+        expr = solution['value']
+        for p, y in enumerate(solution['y_market']):
+            if abs(y) > 10**-12:
+                expr += y * (sum(sign * var for sign, var in self.terms.get((r, p), [])) - rhs[r, p])
+        for k, y in zip(self.in_index[r], solution['y_purchases']):
+            if abs(y) > 10**-12:
+                expr += -y * (master.T[k] - T[k])
+        master.cuts.add(master.theta[r] >= expr)
+
+    def _solve_regions(self, stage, T, dis, dub):
+
+        rhs = self._rhs(T, dis)
+        tasks = [(stage, r, rhs[r], T[self.in_index[r]], None if dub is None else dub[r])
+                 for r in range(len(self.DATA.countries))]
+
+        if self.pool is None:
+            solutions = [_solve_subproblem(task) for task in tasks]
+        else:
+            solutions = self.pool.map(_solve_subproblem, tasks)
+        return rhs, solutions
+
+    def solve_stage(self, stage, dub=None):
+        """
+        Benders iterations of one stage. Returns the best master point and its regional solutions.
+        """
+        master = self._build_master(stage)
+        cost = self.alpha_weight if stage == 'supply' else 0
+
+        T, dis = self.T_start.copy(), np.zeros(len(self.imports))
+        best = (np.inf, None)
+        lower = -np.inf
+
+        for iteration in range(1, self.max_iter + 1):
+            rhs, solutions = self._solve_regions(stage, T, dis, dub)
+
+            upper = sum(s['value'] for s in solutions) + cost * dis.sum()
+            if upper < best[0]:
+                best = (upper, (T.copy(), dis.copy(), solutions))
+
+            if best[0] - lower <= self.tol * max(1, abs(best[0])):
+                break
+
+            for solution in solutions:
+                self._add_cut(master, solution, rhs, T)
+
+            results = _solve(master, self.solvername)
+            if results.solver.termination_condition != TerminationCondition.optimal:
+                raise RuntimeError('master problem ended with status {}'.format(results.solver.termination_condition))
+            lower = value(master.objective)
+            # master variables without a cut yet keep their value of zero
+            T = np.array([master.T[k].value or 0.0 for k in master.F])
+            dis = np.array([master.dis[j].value or 0.0 for j in master.I])
+
+        self.iterations[stage] = iteration
+        self.gap[stage] = best[0] - lower
+        self.converged[stage] = self.gap[stage] <= self.tol * max(1, abs(best[0]))
+        return best
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        if getattr(self, 'pool', None) is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def solve(self, scenario):
+        """
+        Solve the minimise rationing and minimise supply stages of a scenario.
+
+        Outputs
+            - record on the full index sets (see scenario_engine.extract_result) with the number of
+              iterations, the final gap and whether they converged, of both stages. If the
+              rationing stage did not converge, the supply stage is not solved and the record
+              holds the rationing stage solution, with the status 'not_converged'.
+        """
+        self._setup(scenario)
+        self.iterations, self.gap, self.converged = {}, {}, {}
+
+        self.pool = None
+        if self.processes != 1:
+            self.pool = multiprocessing.Pool(self.processes, initializer=_init_sub_worker,
+                                             initargs=(self.arrays, self.in_links, self.solvername, self.penalty))
+        _init_sub_worker(self.arrays, self.in_links, self.solvername, self.penalty)
+
+        try:
+            """ Stage 1 - Objective: To minimise rationing """
+            ration, (T, dis, solutions) = self.solve_stage('ration')
+            supply = None
+
+            """ Stage 2 - Objective: To minimise supply at minimum rationing """
+            # the rationing optimum bounds Ddis only once the rationing stage has converged
+            if self.converged['ration']:
+                dub = np.array([np.maximum(0, s['Ddis']) for s in solutions])
+                supply, (T, dis, solutions) = self.solve_stage('supply', dub)
+        finally:
+            self.__exit__()
+
+        nR, nP = self.arrays['const'].shape
+        disimp = np.zeros((nR, nR, nP))
+        disimp[tuple(self.imports.T)] = dis
+        slack = sum(s['slack'] for s in solutions)
+        if slack > 10**-6 * max(1, ration if supply is None else supply):
+            status = 'infeasible'
+        elif not all(self.converged.values()) or supply is None:
+            status = 'not_converged'
+        else:
+            status = 'optimal'
+
+        return {'key': scenario.get('key'),
+                'status': status,
+                'num_thres': self.num_thres,
+                'objective': supply,
+                'rationing': ration,
+                'Xdis': np.array([s['Xdis'] for s in solutions]),
+                'Ddis': np.array([s['Ddis'] for s in solutions]),
+                'disimp': disimp,
+                'iterations': dict(self.iterations),
+                'gap': dict(self.gap),
+                'converged': dict(self.converged)}
+
+    def verify(self, scenario, record=None):
+        """
+        Solve the monolithic model and compare its objectives with the decomposition.
+        """
+        if record is None:
+            record = self.solve(scenario)
+
+        MRIA_RUN1, MRIA_RUN2, MRIA_RUN3, MRIA_RUN5 = mria_run(self.DATA, scenario.get('op_factor', 1),
+                                                              scenario.get('all_disimp', 1), scenario.get('imp_flex', 0),
+                                                              scenario.get('disr_dict_sup', {}),
+                                                              scenario.get('disr_dict_dem', {}),
+                                                              self.distance_dict, self.solvername,
+                                                              new_Xbase=self.new_Xbase, inverse=False)
+        full = extract_result(MRIA_RUN3, self.DATA)
+
+        rationing = full['Ddis'].sum()
+        # without a supply stage solution (not converged, or not optimal) there is no objective to compare
+        if record['objective'] is None or full['objective'] is None:
+            objective_diff = np.nan
+        else:
+            objective_diff = abs(record['objective'] - full['objective']) / max(abs(full['objective']), 10**-12)
+        return {'status': full['status'],
+                'status_decomposed': record['status'],
+                'rationing_full': rationing,
+                'rationing_decomposed': record['rationing'],
+                'rationing_rel_diff': abs(record['rationing'] - rationing) / max(abs(rationing), 10**-12),
+                'objective_full': full['objective'],
+                'objective_decomposed': record['objective'],
+                'objective_rel_diff': objective_diff}
\ No newline at end of file
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Expected annual loss (EAL) over an ensemble of flood return periods.
+
+Every event of the ensemble is a disruption with an annual exceedance probability p = 1 / T.
+All events are run through the scenario engine against one cached baseline, and the losses
+per region and sector / product are integrated over the exceedance probability with the
+trapezoidal rule
+
+    EAL = sum_i (p_i - p_i+1) * (L_i + L_i+1) / 2        (p_1 > p_2 > ... : frequent to rare)
+
+for the rationing (Ddis, per region and product) and the output loss (Xbase - Xdis, per
+region and sector). Events more frequent than the most frequent one in the ensemble are
+taken to cause no loss (protection standard); beyond the rarest event the loss can be kept
+constant down to p = 0 (tail=True).
+
+Events are solved from frequent to rare, in batches. When a batch changes the EAL, with its
+tail term if tail=True, by less than *rtol* of the (non-zero) EAL so far, the rarer events are
+not solved: their probability mass is too small to change the EAL.
+
+Events whose final stage is not optimal are recorded and left out of the integral (the
+trapezoids join the events on either side); with on_failure='raise' they stop the run instead.
+"""
+import numpy as np
+import pandas as pd
+
+from scenario_engine import ScenarioEngine, values_to_array
+
+
+def return_period_events(disruptions, disruptions_dem=None):
+    """
+    Event list of a dictionary {return period: disr_dict_sup}, e.g. the output of
+    input_loader.disruptions_from_assets with the return periods as keys.
+    """
+    disruptions_dem = disruptions_dem or {}
+    return [{'key': rp, 'probability': 1 / rp,
+             'disr_dict_sup': disruptions[rp], 'disr_dict_dem': disruptions_dem.get(rp, {})}
+            for rp in disruptions]
+
+
+def _trapezoid(p, losses):
+    """
+    Trapezoidal integral of stacked losses (events first) over exceedance probabilities p.
+    """
+    if len(p) < 2:
+        return np.zeros(losses.shape[1:])
+    width = (p[:-1] - p[1:]).reshape((-1,) + (1,) * (losses.ndim - 1))
+    return (width * (losses[:-1] + losses[1:]) / 2).sum(axis=0)
+
+
+class EALIntegrator(object):
+    """
+    Parameters
+        - engine - **ScenarioEngine** used for the event runs
+        - events - list of dictionaries with a 'probability' (annual exceedance probability) and
+          the disruption ('disr_dict_sup', 'disr_dict_dem'), see return_period_events
+        - op_factor, imp_flex, all_disimp - model parameters, the same for all events
+        - rtol - stop when a batch of rarer events changes the EAL by less than rtol (None: run all)
+        - batch_size - number of events solved at once; the number of processes by default
+        - tail - keep the loss of the rarest event constant down to p = 0
+        - on_failure - 'skip' to record events that are not solved to optimality and integrate
+          over the others, 'raise' to stop with a RuntimeError
+    """
+
+    def __init__(self, engine, events, op_factor=1, imp_flex=0, all_disimp=1,
+                 rtol=10**-3, batch_size=None, tail=False, on_failure='skip'):
+
+        self.engine = engine
+        self.events = sorted(events, key=lambda e: -e['probability'])
+        self.params = {'op_factor': op_factor, 'imp_flex': imp_flex, 'all_disimp': all_disimp}
+        self.rtol = rtol
+        self.batch_size = batch_size or max(1, engine.processes)
+        self.tail = tail
+        self.on_failure = on_failure
+
+        if on_failure not in ('skip', 'raise'):
+            raise ValueError("on_failure must be 'skip' or 'raise', not {}".format(on_failure))
+
+        DATA = engine.DATA
+        self.Xbase = values_to_array(engine.new_Xbase, DATA.countries, DATA.sectors)
+
+    def _scenario(self, n, event):
+
+        scenario = dict(self.params)
+        scenario['key'] = n
+        scenario['disr_dict_sup'] = event.get('disr_dict_sup', {})
+        scenario['disr_dict_dem'] = event.get('disr_dict_dem', {})
+        return scenario
+
+    def run(self):
+        """
+        Solve the events and integrate the losses.
+
+        Outputs
+            - dictionary with the EAL arrays 'rationing' (R, P) and 'output_loss' (R, S), the
+              exceedance probabilities 'probability' of the integrated events and their 'status',
+              and the events left out ('failed': list of dictionaries with probability and status)
+        """
+        probability, rationing, output_loss, status, failed = [], [], [], [], []
+        eal = 0.0
+
+        for start in range(0, len(self.events), self.batch_size):
+            batch = [self._scenario(n, e) for n, e in enumerate(self.events[start:start + self.batch_size], start)]
+            records = sorted(self.engine.imap(batch), key=lambda r: r['key'])
+
+            for record in records:
+                if record['status'] != 'optimal':
+                    if self.on_failure == 'raise':
+                        raise RuntimeError('event with exceedance probability {} ended with status {}'.format(
+                            self.events[record['key']]['probability'], record['status']))
+                    failed.append({'probability': self.events[record['key']]['probability'],
+                                   'status': record['status']})
+                    continue
+                probability.append(self.events[record['key']]['probability'])
+                rationing.append(record['Ddis'])
+                output_loss.append(np.maximum(self.Xbase - record['Xdis'], 0))
+                status.append(record['status'])
+
+            if not probability:
+                continue
+
+            # the tail term moves with the rarest event, so it is part of the convergence test
+            previous = eal
+            p = np.array(probability)
+            eal = _trapezoid(p, np.array(rationing)).sum() + _trapezoid(p, np.array(output_loss)).sum()
+            if self.tail:
+                eal += p[-1] * (rationing[-1].sum() + output_loss[-1].sum())
+
+            if self.rtol is not None and eal > 0 and start > 0 and abs(eal - previous) <= self.rtol * eal:
+                break
+
+        p = np.array(probability)
+        DATA = self.engine.DATA
+        rationing = np.array(rationing).reshape(-1, len(DATA.countries), len(DATA.products))
+        output_loss = np.array(output_loss).reshape(-1, len(DATA.countries), len(DATA.sectors))
+        result = {'probability': p, 'status': status, 'failed': failed,
+                  'rationing': _trapezoid(p, rationing),
+                  'output_loss': _trapezoid(p, output_loss)}
+
+        if self.tail and len(p):
+            result['rationing'] = result['rationing'] + p[-1] * rationing[-1]
+            result['output_loss'] = result['output_loss'] + p[-1] * output_loss[-1]
+
+        return result
+
+
+def expected_annual_loss(DATA, distance_dict, solvername, events, op_factor=1, imp_flex=0, all_disimp=1,
+                         processes=1, new_Xbase=None, rtol=10**-3, batch_size=None, tail=False, on_failure='skip',
+                         **options):
+    """
+    EAL of rationing and output loss per region, over an ensemble of events, see **EALIntegrator**.
+
+    Outputs
+        - DataFrame of the EAL of rationing per region and product
+        - DataFrame of the EAL of output loss per region and sector
+        - DataFrame of the solved events with their exceedance probability, status and whether
+          they are part of the integral
+    """
+    engine = ScenarioEngine(DATA, distance_dict, solvername, new_Xbase=new_Xbase, processes=processes, **options)
+
+    with engine:
+        result = EALIntegrator(engine, events, op_factor, imp_flex, all_disimp, rtol, batch_size, tail,
+                               on_failure).run()
+
+    rationing = pd.DataFrame(result['rationing'], index=DATA.countries, columns=DATA.products)
+    output_loss = pd.DataFrame(result['output_loss'], index=DATA.countries, columns=DATA.sectors)
+    solved = pd.DataFrame({'probability': list(result['probability']) + [e['probability'] for e in result['failed']],
+                           'termination': result['status'] + [e['status'] for e in result['failed']],
+                           'integrated': [True] * len(result['status']) + [False] * len(result['failed'])})
+    solved = solved.sort_values('probability', ascending=False)
+
+    return rationing, output_loss, solved
\ No newline at end of file
@@ -14,11 +14,18 @@ This function loads all the required inputs required for the macroeconomic impac
 
 #### Importing required pacakages
 
-from table import sut_basic
+from table import sut_basic, tensor_dir
 import geopandas as gpd
+import numpy as np
 import os
 import pandas as pd
+import rasterio
 import rioxarray as rio
+from rasterio.transform import rowcol
+from rasterio.windows import Window
+from pyproj import CRS, Transformer
+from spatial_join import asset_table
+from damage import DamageCurves, capacity_loss
 
 def inputs_for_analysis(input_path):
 
@@ -30,13 +37,168 @@ def inputs_for_analysis(input_path):
 
 
 
-def mria_inputs(input_path):
+def hazard_inputs(input_path, exposure_files, damage_file='damage_models.xlsx', sectors_file='sectors.xlsx'):
+
+    """
+    Exposure and vulnerability inputs of the hazard pipeline.
+
+        - exposure_files: dictionary {layer name: .shp file} of substations, sector shapes and industrial sites
+        - damage_file: depth in the first column, one column per damage model with the probability of functioning
+        - sectors_file: columns 'sector' and 'damage_model'
+    """
+
+    exposure = {name: gpd.read_file(os.path.join(input_path, file)) for name, file in exposure_files.items()}
+    damage_curves = pd.read_excel(os.path.join(input_path, damage_file), index_col=[0]).sort_index()
+    sector_models = pd.read_excel(os.path.join(input_path, sectors_file)).set_index('sector')['damage_model'].to_dict()
+
+    return exposure, damage_curves, sector_models
+
+
+def sample_raster(raster_path, xs, ys, band=1):
+
+    """
+    Sample a raster at point coordinates (in the raster CRS) without reading the full raster.
+
+    The points are grouped by the internal block (tile or strip) of the raster that contains them,
+    and only those blocks are read, one window at a time. Points outside the raster and nodata
+    cells get a value of zero (no inundation).
+    """
+
+    values = np.zeros(len(xs))
+    if len(xs) == 0:
+        return values
+
+    with rasterio.open(raster_path) as src:
+        rows, cols = rowcol(src.transform, np.asarray(xs), np.asarray(ys))
+        rows, cols = np.asarray(rows), np.asarray(cols)
+
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        block_h, block_w = src.block_shapes[band - 1]
+
+        points = np.flatnonzero(inside)
+        blocks, which = np.unique(np.stack([rows[points] // block_h, cols[points] // block_w], axis=1),
+                                  axis=0, return_inverse=True)
+        which = which.reshape(-1)
+
+        for b, (block_row, block_col) in enumerate(blocks):
+            row0, col0 = block_row * block_h, block_col * block_w
+            window = Window(col0, row0, min(block_w, src.width - col0), min(block_h, src.height - row0))
+            data = src.read(band, window=window, masked=True)
+
+            idx = points[which == b]
+            sampled = data[rows[idx] - row0, cols[idx] - col0]
+            values[idx] = np.ma.filled(sampled.astype(float), 0)
+
+    values[~np.isfinite(values)] = 0
+    return np.clip(values, 0, None)
+
+
+def disruptions_from_assets(raster_paths, asset_tables, damage_curves, sector_models):
+
+    """
+    Disruption dictionaries (disr_dict_sup) of several flood maps (e.g. one per return period) at once.
+
+    The inundation depth of every asset is sampled in every map into one (assets x maps) depth matrix,
+    converted to a probability of functioning with the damage model of its sector in a single vectorised
+    evaluation (see damage.py), and averaged (weighted) per NUTS2 region and sector. For every map, only
+    region-sector pairs that lose capacity are returned, with their remaining share of capacity, as
+    expected by the MRIA models.
+
+        - raster_paths: dictionary {scenario (e.g. return period): flood map}
+        - asset_tables: list of tables with columns sector, weight, NUTS_ID, x, y (see spatial_join.py)
+        - damage_curves: DataFrame of the damage models (see hazard_inputs) or a damage.DamageCurves
+    """
+
+    if not isinstance(damage_curves, DamageCurves):
+        damage_curves = DamageCurves(damage_curves)
+
+    names = list(raster_paths)
+    crs = {}
+    for name in names:
+        with rasterio.open(raster_paths[name]) as src:
+            crs[name] = src.crs
+
+    depth, models, weight, groups = [], [], [], []
+    for assets in asset_tables:
+        assets = assets[assets['sector'].isin(list(sector_models))]
+        source = CRS.from_user_input(assets.attrs['crs'])
+
+        columns = []
+        for name in names:
+            transformer = Transformer.from_crs(source, crs[name], always_xy=True)
+            xs, ys = transformer.transform(assets['x'].to_numpy(), assets['y'].to_numpy())
+            columns.append(sample_raster(raster_paths[name], xs, ys))
+
+        depth.append(np.column_stack(columns) if columns else np.zeros((len(assets), 0)))
+        models.append(damage_curves.model_index(assets['sector'].map(sector_models)))
+        weight.append(assets['weight'].to_numpy(dtype=float))
+        groups += list(zip(assets['NUTS_ID'], assets['sector']))
+
+    functioning = damage_curves.evaluate(np.vstack(depth), np.concatenate(models))
+
+    codes, pairs = pd.factorize(pd.MultiIndex.from_tuples(groups))
+    labels, remaining = capacity_loss(functioning, np.concatenate(weight), codes)
+    keys = [pairs[code] for code in labels]
+
+    return {name: {key: value for key, value in zip(keys, remaining[:, h]) if value < 1}
+            for h, name in enumerate(names)}
+
+
+def disruption_from_assets(raster_path, asset_tables, damage_curves, sector_models):
+
+    """
+    Disruption dictionary (disr_dict_sup) of a flood map for assets already assigned to regions,
+    see disruptions_from_assets.
+    """
+
+    return disruptions_from_assets({0: raster_path}, asset_tables, damage_curves, sector_models)[0]
+
+
+def flood_disruption(raster_path, exposure, nl_nuts, damage_curves, sector_models,
+                     sector_column='sector', weight_column=None, lookup=None):
+
+    """
+    Disruption dictionary (disr_dict_sup) of a flood map, or a dictionary of them when raster_path is a
+    dictionary {scenario: flood map} (see disruptions_from_assets).
+
+        - exposure: dictionary {layer name: GeoDataFrame with a sector column} (see hazard_inputs), or
+          {layer name: .shp file} when a spatial_join.AssetLookup is passed as lookup, in which case the
+          region assignment of each layer is read from its cache
+    """
+
+    if lookup is not None:
+        tables = [lookup.table(file, sector_column, weight_column) for file in exposure.values()]
+    else:
+        tables = [asset_table(assets, nl_nuts, sector_column, weight_column) for assets in exposure.values()]
+
+    if isinstance(raster_path, dict):
+        return disruptions_from_assets(raster_path, tables, damage_curves, sector_models)
+    return disruption_from_assets(raster_path, tables, damage_curves, sector_models)
+
+
+def mria_inputs(input_path, tensor_path=None):
+
+    """
+    SUT table of the MRIA models and its regions. With *tensor_path*, the table is opened
+    from its tensor export in that directory (see table.py), which is created by the first
+    job that does not find it; the table then has the arrays only, memory mapped read-only.
+    """
 
     # datapath to the inputs folder
     data_path = input_path
 
     # file path to SUT tables
     filepath = os.path.join(data_path,'MRIO', 'mria_nl_sut.xlsx')
+
+    if tensor_path is not None:
+        directory = tensor_dir(tensor_path, 'nl_sut', filepath)
+        if not os.path.isdir(directory):
+            DATA = sut_basic('nl_sut', filepath, None)
+            DATA.load_all_data()
+            directory = DATA.export_tensors(tensor_path)
+        DATA = sut_basic.from_tensors(directory)
+        return DATA, list(DATA.countries)
+
     mria = pd.read_excel(filepath, sheet_name = 'SUP', header = [0,1], index_col = [0,1])
     regions_ineu = ((mria.index.get_level_values(0)).unique()).tolist()
 
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Linear (Leontief / Ghosh) impact estimator to screen disruption scenarios before the MRIA LP.
+
+The estimator is built from the same **sut_basic** tables as the MRIA model. Products are
+allocated to the sectors that supply them by market shares (industry technology), giving an
+inter-industry flow matrix Z over all region-sector pairs, with
+
+    A = Z / Xbase (columns)  -> Leontief, backward propagation of lost demand for inputs
+    B = Z / Xbase (rows)     -> Ghosh, forward propagation of lost supply to the users
+
+A disruption vector d (share of capacity lost per region-sector pair) gives the direct
+output loss d * Xbase, which is propagated for many scenarios at once by solving the
+(I - B)' and (I - A) systems with a matrix of right hand sides. The loss of product supply
+is passed to final demand and exports by their share in total use, net of the spare
+capacity (op_factor) and disaster imports (imp_flex) the MRIA model can draw on, which
+gives a first-order proxy of rationing.
+
+The results are a ranking and sanity check, not a substitute for the MRIA equilibrium.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _safe_divide(a, b):
+
+    out = np.zeros(np.broadcast(a, b).shape)
+    np.divide(a, b, out=out, where=(b != 0))
+    return out
+
+
+class LinearEstimator(object):
+    """
+    Vectorised first-order impact estimator on the region-sector (n = R*S) and
+    region-product (m = R*P) index sets of a **sut_basic** table.
+    """
+
+    def __init__(self, Table, xbase_dict=None):
+
+        if not hasattr(Table, 'Use_arr'):
+            Table.prep_arrays()
+
+        self.countries = list(Table.countries)
+        self.sectors = list(Table.sectors)
+        self.products = list(Table.products)
+        nR, nS, nP = len(self.countries), len(self.sectors), len(self.products)
+        self.n, self.m = nR * nS, nR * nP
+
+        use = Table.Use_arr
+        sup = Table.Sup_arr
+
+        # Output per region-sector pair, either from the table or from the base model
+        if xbase_dict is None:
+            xbase = sup.sum(axis=(0, 3)).T
+        else:
+            xbase = np.array([[xbase_dict[r, s] for s in self.sectors] for r in self.countries], dtype=float)
+        self.x = xbase.reshape(self.n)
+
+        # Product supply of each region-sector pair, (R, S, P), block diagonal over regions
+        supply = sup.sum(axis=2)
+        V = np.zeros((nR, nS, nR, nP))
+        V[np.arange(nR), :, np.arange(nR), :] = supply
+        V = V.reshape(self.n, self.m)
+
+        # Intermediate use of products by region-sector pairs, and final demand plus exports
+        U = use[:, :, :, :nS].reshape(self.m, self.n)
+        final = use[:, :, :, nS:].sum(axis=(2, 3)).reshape(self.m) + Table.ExpROW_arr.reshape(self.m)
+
+        q = V.sum(axis=0)
+        shares = _safe_divide(V, q[None, :])
+        Z = shares @ U
+
+        self.final = final
+        self.final_share = _safe_divide(final, U.sum(axis=1) + final)
+        self.Vcoef = _safe_divide(V, self.x[:, None])
+        self.A = _safe_divide(Z, self.x[None, :])
+        self.B = _safe_divide(Z, self.x[:, None])
+
+        # Disaster import capacity per region-product for imp_flex = 1: use of P from other regions by the sectors of R
+        flows = use[:, :, :, :nS].sum(axis=3)
+        flows[np.arange(nR), :, np.arange(nR)] = 0
+        self.import_capacity = flows.sum(axis=0).T.reshape(self.m)
+
+        self.I = np.eye(self.n)
+
+    def disruption_matrix(self, scenarios):
+        """
+        Share of capacity lost per region-sector pair for a list of scenarios.
+
+        Parameters
+            - scenarios - list of disr_dict_sup dictionaries {(R, S): remaining share of capacity}
+
+        Outputs
+            - (K, n) array
+        """
+        position = {(r, s): i * len(self.sectors) + j
+                    for i, r in enumerate(self.countries) for j, s in enumerate(self.sectors)}
+
+        loss = np.zeros((len(scenarios), self.n))
+        for k, disr_dict_sup in enumerate(scenarios):
+            for key, remaining in disr_dict_sup.items():
+                if key in position:
+                    loss[k, position[key]] = 1 - remaining
+        return loss
+
+    def single_shocks(self, dis_value):
+        """
+        Disruption matrix of all single region-sector shocks of size dis_value, in
+        (region, sector) order, as used in the criticality analysis.
+        """
+        return np.eye(self.n) * dis_value
+
+    def estimate(self, loss, op_factor=1, imp_flex=0, all_disimp=1):
+        """
+        Propagate a batch of disruptions.
+
+        Parameters
+            - loss - (K, n) array of capacity shares lost, see disruption_matrix()
+            - op_factor - allowed overproduction of the undisrupted sectors
+            - imp_flex, all_disimp - disaster import flexibility, as in the MRIA model
+
+        Outputs
+            - dictionary of arrays
+                direct (K, R, S): direct output loss
+                forward (K, R, S): direct plus downstream (Ghosh) output loss
+                backward (K, R, S): upstream (Leontief) output loss from lost demand for inputs
+                shortage (K, R, P): loss of product supply
+                rationing (K, R, P): rationing proxy of final demand and exports
+        """
+        loss = np.atleast_2d(loss)
+        K = loss.shape[0]
+        shape_rs = (K, len(self.countries), len(self.sectors))
+
+        direct = loss * self.x[None, :]
+
+        # x_fwd' = direct' (I - B)^-1 and x_back = (I - A)^-1 A direct, for all scenarios at once
+        forward = np.linalg.solve((self.I - self.B).T, direct.T).T
+        backward = np.linalg.solve(self.I - self.A, self.A @ direct.T).T
+
+        shortage = forward @ self.Vcoef
+        rationing = self.rationing_from(shortage, loss, op_factor, imp_flex, all_disimp)
+
+        shape_rp = (K, len(self.countries), len(self.products))
+        return {'direct': direct.reshape(shape_rs),
+                'forward': forward.reshape(shape_rs),
+                'backward': backward.reshape(shape_rs),
+                'shortage': shortage.reshape(shape_rp),
+                'rationing': rationing.reshape(shape_rp)}
+
+    def rationing_from(self, shortage, loss, op_factor=1, imp_flex=0, all_disimp=1):
+        """
+        Rationing proxy (K, m) from the loss of product supply (K, m) and the capacity shares lost (K, n).
+
+        The shortage is passed on to final demand and exports by their share in total use, net of
+        the spare capacity of the undisrupted share of producers and of the disaster imports.
+        Since the shortage is linear in the disruption, the shortage of combined disruptions
+        is the sum of the shortages of its parts.
+        """
+        spare = (np.clip(1 - loss, 0, 1) * self.x[None, :] * max(op_factor - 1, 0)) @ self.Vcoef
+        spare += imp_flex * all_disimp * self.import_capacity[None, :]
+
+        return np.clip(shortage * self.final_share[None, :] - spare, 0, self.final[None, :])
+
+    def screen(self, loss, metric='rationing', top_k=None, threshold=None, **kwargs):
+        """
+        Flag the scenarios to pass on to the full MRIA pipeline.
+
+        Parameters
+            - loss - (K, n) array of capacity shares lost
+            - metric - key of estimate() whose total is used as score
+            - top_k - flag the top_k scenarios with the highest score
+            - threshold - flag all scenarios with a score of at least threshold
+            - kwargs - passed on to estimate()
+
+        Outputs
+            - indices of the flagged scenarios (highest score first) and the scores of all scenarios
+        """
+        scores = self.estimate(loss, **kwargs)[metric].sum(axis=(1, 2))
+        order = np.argsort(-scores, kind='stable')
+
+        if threshold is not None:
+            order = order[scores[order] >= threshold]
+        if top_k is not None:
+            order = order[:top_k]
+
+        return order, scores
+
+    def compare(self, loss, MRIA_RUN, **kwargs):
+        """
+        Compare the estimate of a single scenario with a solved MRIA disaster model.
+
+        Outputs
+            - DataFrame per region and product with the estimated and the LP rationing, and per region and
+              sector with the estimated and the LP output loss
+        """
+        est = self.estimate(loss, **kwargs)
+
+        rat_index = pd.MultiIndex.from_product([self.countries, self.products])
+        rat_lp = MRIA_RUN.Ddis.get_values()
+        rationing = pd.DataFrame({'estimate': est['rationing'][0].reshape(-1),
+                                  'mria': [rat_lp[k] for k in rat_index]}, index=rat_index)
+
+        out_index = pd.MultiIndex.from_product([self.countries, self.sectors])
+        x_lp = MRIA_RUN.Xdis.get_values()
+        output = pd.DataFrame({'estimate': est['forward'][0].reshape(-1),
+                               'mria': [MRIA_RUN.Xbase[k] - x_lp[k] for k in out_index]}, index=out_index)
+
+        return rationing, output
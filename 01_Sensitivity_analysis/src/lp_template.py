@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent LP template for scenario sweeps.
+
+Over a criticality or disruption sweep the minimise rationing / minimise supply LPs keep the
+same constraint matrix; a scenario only changes
+
+    - the upper bounds of Xdis (Xlim: baseline output x disruption x overproduction)
+    - the upper bounds of Ddis and the demand limits (demlim) of demSup, for demand shocks
+    - the upper bounds of disimp (disimplim: imp_flex x link x all_disimp, zero below num_thres)
+
+The template builds the lexicographic stage model (mria_new_SUT_lexicographic.py) once, on the
+undisrupted baseline, and hands it to a persistent solver instance. Each scenario then only
+recomputes the bounds from stored baseline values and passes the ones that changed to the
+solver; the rationing and supply objectives are switched, not rebuilt. No Pyomo component is
+generated and no problem file is written per scenario.
+
+The persistent interface is used with mosek, and holds a mosek seat as long as the template
+lives (close() gives it back; the template is also a context manager); with gams, or when no mosek seat is free, the bounds are patched
+in the same way, but every solve goes through the solver dispatch (solver_dispatch.py) and the
+model file is written at every solve. Scaling is not applied (a scaled copy of
+the model would have to be built for every solve).
+"""
+from pyomo.environ import Objective, Param, minimize, value
+from pyomo.opt import SolverFactory, TerminationCondition
+
+from mria_new_SUT_lexicographic import MRIA_SUT as MRIAlex
+from presolve import SUTPresolve
+from solver_dispatch import BACKENDS, acquire_seat, solve_model, timed_solve
+
+
+NUM_THRES = [10**-30,10**-12, 10**-11, 10**-10, 10**-9, 10**-8 , 10**-7, 10**-6 , 0.0001, 0.001, 0.01 , 0.1, 1]
+
+
+class MRIA_SUT(MRIAlex):
+    """
+    Lexicographic stage model with mutable demand limits, so that demSup can be updated for
+    demand shocks.
+    """
+
+    def create_dem_limits(self):
+
+        model = self.m
+
+        def dem_init_lim(model, R, P):
+            return((self.fd[R, P] + self.ExpROW[R, P])* self.dem_disrupt[R, P])
+
+        model.demlim = Param(model.R, model.P, initialize= dem_init_lim, mutable=True,
+                            doc='Total Production baseline')
+
+        self.demlim = model.demlim
+
+
+class LPTemplate(object):
+    """
+    Parameters
+        - DATA - the **sut_basic** class object
+        - new_Xbase - corrected baseline (stage 1 of mria_run)
+        - distance_dict - distance dictionary of the disaster imports
+        - solvername - solver to use
+        - presolve - build the template on the presolved table (see presolve.py)
+        - alpha_weight - weight of the disaster imports in the minimise supply objective
+    """
+
+    def __init__(self, DATA, new_Xbase, distance_dict, solvername, presolve=False, alpha_weight=1.2):
+
+        self.PRESOLVE = None
+        if presolve:
+            self.PRESOLVE = SUTPresolve(DATA)
+            DATA = self.PRESOLVE.reduce()
+            distance_dict = self.PRESOLVE.restrict(distance_dict, 'RR')
+            new_Xbase = self.PRESOLVE.restrict(new_Xbase, 'RS')
+
+        self.solvername = solvername
+
+        # Undisrupted model: op_factor, imp_flex and all_disimp of 1 and no threshold, so that
+        # disimplim holds the import link of every trade link and product
+        MRIA_RUN = MRIA_SUT(DATA.name, DATA.countries, DATA.sectors, DATA.products)
+        MRIA_RUN.create_sets()
+        MRIA_RUN.create_alias()
+        MRIA_RUN.baseline_data(DATA, new_Xbase)
+        MRIA_RUN.create_disaster_data({}, {}, 1, 1, 1, distance_dict, 0)
+        if self.PRESOLVE is not None:
+            # only structurally empty variables have equal bounds in the undisrupted model
+            self.PRESOLVE.fix_empty(MRIA_RUN)
+
+        MRIA_RUN.solver = None
+        MRIA_RUN.create_balance()
+
+        model = MRIA_RUN.m
+        model.ration = Objective(expr=MRIA_RUN.ration_objective(), sense=minimize)
+        model.supply = Objective(expr=MRIA_RUN.supply_objective(alpha_weight), sense=minimize)
+        model.supply.deactivate()
+        self.MRIA_RUN = MRIA_RUN
+
+        self.xbase = {idx: value(MRIA_RUN.Xbase[idx]) for idx in model.Xdis if not model.Xdis[idx].fixed}
+        self.demand = {idx: value(MRIA_RUN.fd[idx] + MRIA_RUN.ExpROW[idx]) for idx in model.Ddis}
+        self.link = {idx: value(MRIA_RUN.disimplim[idx]) for idx in model.disimp if not model.disimp[idx].fixed}
+
+        if solvername not in BACKENDS:
+            raise ValueError('Unknown solver: {}'.format(solvername))
+
+        # the persistent instance holds a mosek seat for the life of the template; without a
+        # free seat every solve goes through the dispatch (and its fallback) instead
+        self.seat = acquire_seat('mosek') if solvername == 'mosek' else None
+        if self.seat is not None:
+            self.solver = SolverFactory('mosek_persistent')
+            self.solver.set_instance(model)
+            self.persistent = True
+            self.backend = 'mosek'
+        else:
+            self.solver = None
+            self.persistent = False
+            self.backend = None
+
+        MRIA_RUN.solver = self.solver if self.persistent else None
+
+    def _set_ub(self, var, ub):
+
+        if var.fixed or var.ub == ub:
+            return 0
+        var.setub(ub)
+        if self.persistent:
+            self.solver.update_var(var)
+        return 1
+
+    def patch(self, scenario, num_thres):
+        """
+        Set the bounds and demand limits of a scenario. Returns the number of changed entries.
+        """
+        MRIA_RUN = self.MRIA_RUN
+        model = MRIA_RUN.m
+
+        disr_dict_sup = scenario.get('disr_dict_sup', {})
+        disr_dict_dem = scenario.get('disr_dict_dem', {})
+        if self.PRESOLVE is not None:
+            disr_dict_sup = self.PRESOLVE.restrict(disr_dict_sup, 'RS')
+            disr_dict_dem = self.PRESOLVE.restrict(disr_dict_dem, 'RP')
+        op_factor = scenario.get('op_factor', 1)
+        imp_flex = scenario.get('imp_flex', 0)
+        all_disimp = scenario.get('all_disimp', 1)
+
+        changed = 0
+
+        # Xlim
+        for idx, xbase in self.xbase.items():
+            if idx in disr_dict_sup:
+                ub = xbase * disr_dict_sup[idx]
+            else:
+                ub = xbase * (op_factor[idx] if isinstance(op_factor, dict) else op_factor)
+            changed += self._set_ub(model.Xdis[idx], ub)
+
+        # demlim and the Ddis bounds
+        for idx, demand in self.demand.items():
+            demlim = demand * (1 - disr_dict_dem[idx]) if idx in disr_dict_dem else 0
+            if value(MRIA_RUN.demlim[idx]) != demlim:
+                MRIA_RUN.demlim[idx] = demlim
+                if self.persistent:
+                    self.solver.remove_constraint(model.demSup[idx])
+                    self.solver.add_constraint(model.demSup[idx])
+                changed += 1
+            changed += self._set_ub(model.Ddis[idx], max(0, demand - demlim))
+
+        # disimplim
+        for idx, link in self.link.items():
+            ip = imp_flex[idx] if isinstance(imp_flex, dict) else imp_flex
+            ub = ip * link * all_disimp
+            changed += self._set_ub(model.disimp[idx], ub if ub >= num_thres else 0)
+
+        return changed
+
+    def _solve(self, options=None):
+
+        if self.persistent:
+            results = timed_solve(self.solver, self.backend, options = options)
+        else:
+            results, self.backend = solve_model(self.MRIA_RUN.m, self.solvername, options = options, tee = False)
+        self.MRIA_RUN.backend = self.backend
+        return results
+
+    def close(self):
+        """
+        Drop the persistent solver instance and give its seat back.
+        """
+        self.solver = None
+        self.MRIA_RUN.solver = None
+        if self.seat is not None:
+            self.seat.release()
+            self.seat = None
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.close()
+
+    def _set_objective(self, name):
+
+        model = self.MRIA_RUN.m
+        for objective in (model.ration, model.supply):
+            objective.deactivate()
+        getattr(model, name).activate()
+        if self.persistent:
+            self.solver.set_objective(getattr(model, name))
+
+    def solve(self, scenario, thresholds=NUM_THRES, options=None):
+        """
+        Solve the minimise rationing and minimise supply stages of a scenario on the template,
+        retrying with larger num_thres values as mria_run does. *options* are passed to the
+        solver in both stages.
+
+        Outputs
+            - the template's **MRIA_SUT** object, holding the solution of the scenario
+        """
+        MRIA_RUN = self.MRIA_RUN
+        model = MRIA_RUN.m
+
+        for num_thres in thresholds:
+            self.patch(scenario, num_thres)
+            MRIA_RUN.num_thres = num_thres
+
+            """ Stage 1 - Objective: To minimise rationing """
+            self._set_objective('ration')
+            results = self._solve(options)
+
+            MRIA_RUN.ration_termination_condition = results.solver.termination_condition
+            MRIA_RUN.ration_backend = self.backend
+            MRIA_RUN.solver_status = results.solver.status
+            MRIA_RUN.termination_condition = results.solver.termination_condition
+            if MRIA_RUN.ration_termination_condition != TerminationCondition.optimal:
+                continue
+            MRIA_RUN.ration_obj_value = value(model.ration)
+
+            """ Stage 2 - Objective: To minimise supply at minimum rationing """
+            MRIA_RUN.keep_rationing('cells')
+            self._set_objective('supply')
+            results = self._solve(dict({'dparam.intpnt_tol_path' : 0.1}, **(options or {})))
+
+            MRIA_RUN.solver_status = results.solver.status
+            MRIA_RUN.termination_condition = results.solver.termination_condition
+            if MRIA_RUN.termination_condition == TerminationCondition.optimal:
+                break
+
+        MRIA_RUN.obj_value = value(model.supply, exception=False)
+        return MRIA_RUN
\ No newline at end of file
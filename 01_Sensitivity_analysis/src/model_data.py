@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Array data layer of the MRIA stage models.
+
+The stage models used to hold the absolute tables (UseAbs: R x P x R x (S + FD), SupAbs:
+R x S x R x P) and the coefficients derived from them (Use: R x P x R x S, Sup: R x S x P) as
+Pyomo Params, i.e. one Python object per index, in each of the stage models of a run. Here the
+coefficients are computed once from the dense table arrays of **sut_basic** (prep_arrays)
+and handed to the models as arrays:
+
+    - xbase (R, S)          baseline output, from the table or a corrected baseline
+    - use (R, P, Rb, S)     Use[R,P,Rb,S] = UseAbs[R,P,Rb,S] / Xbase[Rb,S]
+    - sup (R, S, P)         Sup[R,S,P] = sum_Rb SupAbs[R,S,Rb,P] / Xbase[R,S]
+    - fd, exprow (R, P)     final demand and exports to the rest of the world
+    - link (Rb, R, P)       sum_Sb Use[Rb,P,R,Sb] * Xbase[R,Sb], the trade link of disimplim
+
+The nonzero coefficients of use and sup are kept in compressed rows (SparseRows) per product
+row (R, P), from which the demSup rows are built (see sparse_terms.py). Only the baseline
+values of size R x S and R x P remain Pyomo Params.
+
+The data of a table and baseline is cached on the table, so that the stage models of one run
+(and the models of the num_thres retries) share one copy.
+"""
+import numpy as np
+
+
+def _safe_divide(a, b):
+
+    out = np.zeros(np.broadcast(a, b).shape)
+    np.divide(a, b, out=out, where=(b != 0))
+    return out
+
+
+def values_to_array(values, *index_lists):
+    """
+    Dense array of a {index tuple: value} dictionary, ordered by the given index lists.
+    Missing and None values are set to zero.
+    """
+    shape = tuple(len(i) for i in index_lists)
+    positions = [{k: n for n, k in enumerate(i)} for i in index_lists]
+
+    arr = np.zeros(shape)
+    for key, v in values.items():
+        if v is None:
+            continue
+        try:
+            arr[tuple(p[k] for p, k in zip(positions, key))] = v
+        except KeyError:
+            continue
+    return arr
+
+
+class SparseRows(object):
+    """
+    Nonzero entries of a dense (rows x columns) array in compressed rows.
+
+    Parameters
+        - array - two dimensional array
+        - row_keys - index tuple of every row
+        - col_keys - index of every column
+    """
+
+    def __init__(self, array, row_keys, col_keys):
+
+        rows, cols = np.nonzero(array)
+        self.ptr = np.searchsorted(rows, np.arange(array.shape[0] + 1))
+        self.col = cols
+        self.val = array[rows, cols]
+        self.row_pos = {k: n for n, k in enumerate(row_keys)}
+        self.col_keys = list(col_keys)
+
+    def terms(self, key):
+        """
+        (column key, coefficient) pairs of the nonzero entries of a row.
+        """
+        n = self.row_pos[key]
+        lo, hi = self.ptr[n], self.ptr[n + 1]
+        return zip([self.col_keys[c] for c in self.col[lo:hi]], self.val[lo:hi].tolist())
+
+    @property
+    def nnz(self):
+        return len(self.val)
+
+
+class ModelData(object):
+    """
+    Parameters
+        - Table - the **sut_basic** class object
+        - xbase_dict - baseline output {(R, S): value}; if **None**, the baseline output of the
+          table (sum_Rb,P SupAbs[Rb,S,R,P]) as in the base model
+    """
+
+    def __init__(self, Table, xbase_dict=None):
+
+        if not hasattr(Table, 'Use_arr'):
+            Table.prep_arrays()
+
+        self.countries = list(Table.countries)
+        self.sectors = list(Table.sectors)
+        self.products = list(Table.products)
+        nR, nS, nP = len(self.countries), len(self.sectors), len(self.products)
+
+        self.r = {k: n for n, k in enumerate(self.countries)}
+        self.s = {k: n for n, k in enumerate(self.sectors)}
+        self.p = {k: n for n, k in enumerate(self.products)}
+
+        if xbase_dict is None:
+            self.xbase = Table.Sup_arr.sum(axis=(0, 3)).T
+        else:
+            self.xbase = values_to_array(xbase_dict, self.countries, self.sectors)
+
+        self.use = _safe_divide(Table.Use_arr[..., :nS], self.xbase[None, None])
+        self.sup = _safe_divide(Table.Sup_arr.sum(axis=2), self.xbase[:, :, None])
+        self.fd = Table.Use_arr[..., nS:].sum(axis=(2, 3))
+        self.exprow = np.array(Table.ExpROW_arr, dtype=float)
+        # demand held at baseline, outside the rationable demand (tables of neighbourhood.py)
+        self.held = np.array(getattr(Table, 'Held_arr', np.zeros((nR, nP))), dtype=float)
+        self.link = np.einsum('bprs,rs->brp', self.use, self.xbase)
+
+        rows = [(R, P) for R in self.countries for P in self.products]
+        self.use_rows = SparseRows(self.use.reshape(nR * nP, nR * nS), rows,
+                                   [(R, S) for R in self.countries for S in self.sectors])
+        self.sup_rows = SparseRows(self.sup.transpose(0, 2, 1).reshape(nR * nP, nS), rows, self.sectors)
+
+    def value(self, name, *index):
+        """
+        Entry of one of the arrays by index keys, e.g. value('fd', R, P).
+        """
+        positions = {'xbase': (self.r, self.s), 'fd': (self.r, self.p), 'exprow': (self.r, self.p), 'held': (self.r, self.p),
+                     'sup': (self.r, self.s, self.p), 'link': (self.r, self.r, self.p)}[name]
+        return float(getattr(self, name)[tuple(pos[k] for pos, k in zip(positions, index))])
+
+    def market(self):
+        """
+        Baseline size of every product market (R, P): supply + final demand + exports + held demand.
+        """
+        return (self.sup * self.xbase[:, :, None]).sum(axis=1) + self.fd + self.exprow + self.held
+
+
+def model_data(Table, xbase_dict=None, keep=2):
+    """
+    **ModelData** of a table and baseline, cached on the table for the last *keep* baselines
+    used (by default the table baseline of the base and inverse models and the corrected
+    baseline of the disaster stages). The cache is keyed on the baseline and table array
+    objects, so copies of a table with other arrays (presolve.restrict_table) do not reuse it.
+    """
+    if not hasattr(Table, 'Use_arr'):
+        Table.prep_arrays()
+
+    key = (xbase_dict, Table.Use_arr, Table.Sup_arr, Table.ExpROW_arr, getattr(Table, 'Held_arr', None))
+    cache = [(k, d) for k, d in getattr(Table, '_model_data', [])
+             if all(a is b for a, b in zip(k[1:], key[1:]))]
+    for k, data in cache:
+        if k[0] is xbase_dict:
+            return data
+
+    data = ModelData(Table, xbase_dict)
+    Table._model_data = (cache + [(key, data)])[-keep:]
+    return data
\ No newline at end of file
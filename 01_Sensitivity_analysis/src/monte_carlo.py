@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo uncertainty analysis of overproduction capacity (op_factor) and trade
+flexibility (imp_flex).
+
+Both parameters are drawn per region-sector pair and per trade link and product, around
+nominal values that can be a single number (as in the sensitivity grid) or the sector and
+link specific fields of overproduction.xlsx / trade_flexibility.xlsx. Draws are correlated
+through a one-factor Gaussian model: the overproduction headroom of a sector moves together
+across regions, and the flexibility of a product moves together across links,
+
+    z = sqrt(rho) * common + sqrt(1 - rho) * idiosyncratic
+
+and the nominal values are multiplied by mean-preserving lognormal factors exp(sigma z - sigma^2 / 2).
+
+Samples are generated and solved batch by batch through the scenario engine, and only
+running summary statistics of the results are kept (StreamingStats), so the number of
+draws is not limited by memory or by per-run output files.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from scenario_engine import ScenarioEngine
+
+
+class StreamingStats(object):
+    """
+    Running mean, standard deviation, minimum and maximum (Welford) and quantiles of an array
+    valued result. Quantiles are computed from a uniform reservoir sample of at most
+    *reservoir* results, which is exact as long as fewer results have been added.
+    """
+
+    def __init__(self, shape, reservoir=1000, seed=None):
+
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+        self.reservoir = np.zeros((reservoir,) + tuple(shape))
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, value):
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        np.minimum(self.min, value, out=self.min)
+        np.maximum(self.max, value, out=self.max)
+
+        size = self.reservoir.shape[0]
+        if self.count <= size:
+            self.reservoir[self.count - 1] = value
+        else:
+            slot = self.rng.integers(0, self.count)
+            if slot < size:
+                self.reservoir[slot] = value
+
+    @property
+    def std(self):
+
+        if self.count < 2:
+            return np.zeros_like(self.mean)
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    def quantile(self, q):
+
+        n = min(self.count, self.reservoir.shape[0])
+        return np.quantile(self.reservoir[:n], q, axis=0)
+
+
+def _field(nominal, keys):
+
+    if isinstance(nominal, dict):
+        return np.array([nominal[k] for k in keys], dtype=float)
+    return np.full(len(keys), float(nominal))
+
+
+class CorrelatedSampler(object):
+    """
+    Draws correlated op_factor and imp_flex dictionaries.
+
+    Parameters
+        - regions, sectors, products - index lists of the model
+        - op_nominal - nominal op_factor, a value or a dictionary per (R, S)
+        - if_nominal - nominal imp_flex, a value or a dictionary per (Rb, R, P)
+        - op_sigma, if_sigma - lognormal spread of the overproduction headroom (op_factor - 1) and of imp_flex
+        - op_rho, if_rho - correlation of a sector across regions and of a product across links
+        - if_max - upper limit of the sampled imp_flex
+    """
+
+    def __init__(self, regions, sectors, products, op_nominal, if_nominal,
+                 op_sigma=0.5, if_sigma=0.5, op_rho=0.5, if_rho=0.5, if_max=1, seed=None):
+
+        self.op_keys = list(itertools.product(regions, sectors))
+        self.if_keys = list(itertools.product(regions, regions, products))
+
+        self.op_head = _field(op_nominal, self.op_keys) - 1
+        self.if_nom = _field(if_nominal, self.if_keys)
+
+        # position of the common factor of every entry
+        self.op_group = np.array([sectors.index(s) for r, s in self.op_keys])
+        self.if_group = np.array([products.index(p) for rb, r, p in self.if_keys])
+        self.n_sectors, self.n_products = len(sectors), len(products)
+
+        self.op_sigma, self.if_sigma = op_sigma, if_sigma
+        self.op_rho, self.if_rho = op_rho, if_rho
+        self.if_max = if_max
+        self.rng = np.random.default_rng(seed)
+
+    def _factors(self, n, groups, n_groups, rho, sigma):
+
+        common = self.rng.standard_normal((n, n_groups))[:, groups]
+        own = self.rng.standard_normal((n, len(groups)))
+        z = np.sqrt(rho) * common + np.sqrt(1 - rho) * own
+        return np.exp(sigma * z - sigma ** 2 / 2)
+
+    def draw(self, n):
+        """
+        Draw n samples, as arrays (n, R*S) of op_factor and (n, R*R*P) of imp_flex.
+        """
+        op = 1 + self.op_head[None, :] * self._factors(n, self.op_group, self.n_sectors, self.op_rho, self.op_sigma)
+        ip = self.if_nom[None, :] * self._factors(n, self.if_group, self.n_products, self.if_rho, self.if_sigma)
+        return op, np.clip(ip, 0, self.if_max)
+
+    def scenarios(self, n, first_key=0, **fixed):
+        """
+        Draw n samples as scenario dictionaries for the scenario engine. Keyword arguments
+        (e.g. disr_dict_sup) are added to every scenario.
+        """
+        op, ip = self.draw(n)
+        for i in range(n):
+            scenario = dict(fixed)
+            scenario['key'] = first_key + i
+            scenario['op_factor'] = dict(zip(self.op_keys, op[i]))
+            scenario['imp_flex'] = dict(zip(self.if_keys, ip[i]))
+            yield scenario
+
+
+def run_monte_carlo(DATA, distance_dict, solvername, disr_dict_sup, n_draws, op_nominal, if_nominal,
+                    disr_dict_dem=None, batch_size=50, processes=1, reservoir=1000, seed=None,
+                    quantiles=(0.05, 0.5, 0.95), new_Xbase=None, sampler_options=None, **options):
+    """
+    Run n_draws Monte Carlo samples of op_factor and imp_flex for one disruption.
+
+    Parameters
+        - DATA, distance_dict, solvername - as for mria_run
+        - disr_dict_sup, disr_dict_dem - the disruption
+        - n_draws - number of samples
+        - op_nominal, if_nominal - nominal values, see CorrelatedSampler
+        - batch_size - number of samples drawn and sent to the workers at once
+        - processes - number of worker processes
+        - reservoir - number of results kept for the quantiles
+        - sampler_options - spreads and correlations, see CorrelatedSampler
+        - options - passed on to the scenario engine
+
+    Outputs
+        - DataFrame of rationing statistics per region and product
+        - DataFrame of total rationing and final stage status per draw
+    """
+    engine = ScenarioEngine(DATA, distance_dict, solvername, new_Xbase=new_Xbase, processes=processes, **options)
+    sampler = CorrelatedSampler(DATA.countries, DATA.sectors, DATA.products, op_nominal, if_nominal,
+                                seed=seed, **(sampler_options or {}))
+
+    stats = StreamingStats((len(DATA.countries), len(DATA.products)), reservoir, seed)
+    totals = []
+
+    with engine:
+        for start in range(0, n_draws, batch_size):
+            batch = sampler.scenarios(min(batch_size, n_draws - start), first_key=start,
+                                      disr_dict_sup=disr_dict_sup, disr_dict_dem=disr_dict_dem or {})
+
+            for record in engine.imap(batch):
+                if record['status'] != 'optimal':
+                    totals.append([record['key'], record['status'], np.nan])
+                    continue
+                stats.add(record['Ddis'])
+                totals.append([record['key'], record['status'], record['Ddis'].sum()])
+
+    index = pd.MultiIndex.from_product([DATA.countries, DATA.products], names=['region', 'product'])
+    summary = pd.DataFrame({'mean': stats.mean.reshape(-1),
+                            'std': stats.std.reshape(-1),
+                            'min': stats.min.reshape(-1),
+                            'max': stats.max.reshape(-1)}, index=index)
+    for q in quantiles:
+        summary[f'q{q}'] = stats.quantile(q).reshape(-1)
+
+    draws = pd.DataFrame(totals, columns=['draw', 'termination', 'rationing']).sort_values('draw')
+    return summary, draws
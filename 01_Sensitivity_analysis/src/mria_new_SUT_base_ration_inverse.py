@@ -18,7 +18,11 @@ import numpy as np
 import pandas as pd
 from pyomo.environ import (ConcreteModel, Constraint, Objective, Param, Set,
                            SetOf, Var, minimize, maximize, Expression)
-from pyomo.opt import SolverFactory
+
+from model_data import model_data
+from scaling import set_scaling_factors
+from solver_dispatch import solve_model
+from sparse_terms import nonzero_sup, nonzero_use, sup_sum, use_sum
 
 
 
@@ -71,62 +75,23 @@ class MRIA_SUT(object):
         self.m.Sb   = SetOf(self.m.S)  # an alias of sector S
 
 
-    def create_UseAbs(self,REG_USE):
-
-        model = self.m
-
-        def usetable_init(model,R,P,Rb,col):
-            return REG_USE[R,P,Rb,col]
-        
-        model.UseAbs = Param(model.R,model.P,model.Rb,model.col,initialize=usetable_init,doc='Absolute use table')
-
-        self.UseAbs = model.UseAbs
-
-    def create_SupAbs(self,REG_SUP):
-        model = self.m
-
-        def suptable_init(model,R,S,Rb,P):
-            return REG_SUP[R,S,Rb,P]
-        
-        model.SupAbs = Param(model.R,model.S,model.Rb,model.P,initialize=suptable_init,doc='Absolute sup table')
-
-        self.SupAbs = model.SupAbs
+    def create_data(self, Table, xbase_dict=None):
+        """
+        Array data of the table and baseline (see model_data.py). The absolute and derived use
+        and supply tables are not created as Params.
+        """
+        self.data = model_data(Table, xbase_dict)
 
         '''create Xbase'''
     def create_Xbase(self):
         model = self.m
 
         def xbase_init(model,R,S):
-            return sum(self.SupAbs[Rb,S,R,P] for Rb in model.Rb for P in model.P)
+            return self.data.value('xbase', R, S)
         model.Xbase = Param(model.R,model.S,initialize=xbase_init)
         self.Xbase = model.Xbase
     
 
-    def create_Sup(self):
-        model = self.m
-        def sup_init(model,R,S,P):
-
-            if self.Xbase[R,S] == 0:
-                return 0
-            else:
-                return sum(self.SupAbs[R,S,Rb,P] for Rb in model.Rb)/self.Xbase[R,S]
-         
-        model.Sup = Param(model.R,model.S,model.P,initialize=sup_init)
-        self.Sup = model.Sup  
-
-
-    def create_Use(self):
-        model = self.m
-        def use_init(model,Rb,P,R,S):
-            
-            if self.Xbase[R,S] == 0:
-                return 0
-            else:
-                return self.UseAbs[Rb,P,R,S]/self.Xbase[R,S]
-         
-        model.Use = Param(model.Rb,model.P,model.R,model.S,initialize=use_init)
-        self.Use = model.Use  
-
     def create_X(self):
         """
         Creation of the total production **X** variable.
@@ -152,23 +117,23 @@ class MRIA_SUT(object):
 
         self.X = model.X
 
-    def create_fd(self,REG_USE):
+    def create_fd(self):
         
         model = self.m
         
         def findem_init(model,R,P):
-            return sum(REG_USE[R,P,Rb,fdemand] for Rb in model.Rb for fdemand in model.fdemand)
+            return self.data.value('fd', R, P)
         
         model.fd = Param(model.R,model.P,initialize=findem_init)
         
         self.fd = model.fd
     
-    def create_ExpImp(self,ExpROW_in):
+    def create_ExpImp(self):
 
         model = self.m
         # Specify Export ROW
         def ExpROW_ini(m,R,P):
-            return (ExpROW_in[R,P,'Exports'])
+            return self.data.value('exprow', R, P)
         
         model.ExpROW = Param(model.R, model.P, initialize=ExpROW_ini, doc='Exports to the rest of the world')               
  
@@ -190,23 +155,21 @@ class MRIA_SUT(object):
     """ Create baseline dataset to use in model """
     def baseline_data(self,Table, rat_dict):
    
-        self.create_UseAbs(Table.Use)
-        self.create_SupAbs(Table.Sup)
+        self.create_data(Table)
         self.create_Xbase()
-        self.create_Sup()
-        self.create_Use()
         self.create_X()
-        self.create_fd(Table.Use)
-        self.create_ExpImp(Table.ExpROW)
+        self.create_fd()
+        self.create_ExpImp()
         self.create_ratdemand(rat_dict)
         
-    def run_basemodel(self, solvername):
+    def run_basemodel(self, solvername, scaling=False):
         """
         Run the baseline model of the MRIA model. This should return the baseline situation (i.e. no changes between input matrix and output matrix).
         
         Parameters
             - *self* - **MRIA_IO** class object
             - solver - Specify the solver to be used with Pyomo. The Default value is set to **None**. If set to **None**, the ipopt solver will be used
+            - scaling - Row and column scale the model by baseline magnitudes before solving (see scaling.py)
 
         Outputs
             - returns the output of an optimized **MRIA_IO** class and the **MRIA** model
@@ -214,10 +177,13 @@ class MRIA_SUT(object):
         """
         model = self.m
 
+        # Nonzero coefficients of the supply and use tables per product row
+        use_terms = nonzero_use(self)
+        sup_terms = nonzero_sup(self)
+
         # Demand for a product
         def demand_expr(model,R,P):
-            return  (sum(self.Use[R, P, Rb, Sb]*(self.X[Rb, Sb]) for Rb in model.Rb
-                        for Sb in model.Sb) + self.ratdem[R,P]
+            return  (use_sum(use_terms, self.X, R, P) + self.ratdem[R,P]
                     )
         
         model.product_demand = Expression(model.R, model.P, rule=demand_expr)
@@ -227,7 +193,7 @@ class MRIA_SUT(object):
         # Supply of a product
         
         def supply_expr(model,R,P):
-            return (sum(self.X[R, Sb]* self.Sup[R,Sb,P] for Sb in model.Sb))
+            return (sup_sum(sup_terms, self.X, R, P))
 
         model.product_supply = Expression(model.R, model.P, rule=supply_expr)
         self.product_supply = model.product_supply
@@ -259,15 +225,12 @@ class MRIA_SUT(object):
         model.objective = Objective(rule=objective_base, sense=minimize,
                                     doc='Define objective function')
 
-        # Solving with mosek
-        if solvername == 'mosek':
-            solver = SolverFactory('mosek')
-            results = solver.solve(model, tee=True)
-            results.write()
+        if scaling:
+            set_scaling_factors(self)
 
+        # Solving within the seat limits of the licensed solvers (see solver_dispatch.py)
+        results, self.backend = solve_model(model, solvername, scaling)
+        results.write()
 
-        if solvername == 'gams':
-            opt = SolverFactory('gams')
-            io_options = {'solver': 'conopt', 'add_options':['GAMS_MODEL.OptFile = 1;'] } 
-            results = opt.solve(model, keepfiles = True, tee= True,  io_options = io_options, tmpdir = 'C:/Users/sva100/GAMStemp')
-            results.write()
\ No newline at end of file
+        self.solver_status = results.solver.status
+        self.termination_condition = results.solver.termination_condition
\ No newline at end of file
@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+"""MRIA Model
+
+Purpose
+-------
+
+The Multiregional Impact Assessment (MRIA) Model allows for estimating a new post-disaster economic situation in equilibrium, given a set of disruptions.
+
+This version solves the minimise rationing and the minimise supply stages lexicographically on a single model:
+the rationing optimum is added as a constraint, the objective is swapped and the solve continues from the current point.
+
+References
+----------
+
+1) Koks, E. E., & Thissen, M. (2016). A multiregional impact assessment model for disaster analysis. Economic Systems Research, 28(4), 429-449.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from pyomo.environ import (ConcreteModel, Constraint, Objective, Param, Set,
+                           SetOf, Var, minimize, maximize, Expression, value)
+from pyomo.opt import SolverFactory, TerminationCondition
+
+from model_data import model_data
+from scaling import set_scaling_factors
+from solver_dispatch import acquire_seat, solve_model, timed_solve
+from sparse_terms import nonzero_sup, nonzero_use, sup_sum, use_sum
+
+
+
+class MRIA_SUT(object):
+    """
+    This is the class object 'MRIA' which is used to set up the modelling framework.
+    
+    We define the type of model, sets, set up the core variables and specify the
+    constraints and objectives for different model setups.
+    """
+    
+    def __init__(self, name, list_countries,list_sectors,list_products):
+ 
+        """
+        Creation of a Concrete Model, specify the countries and sectors
+        to include.
+        """
+        self.name = name
+        self.m = ConcreteModel()
+        self.countries = list_countries
+        self.total_countries = len(list_countries)
+        self.sectors = list_sectors
+        self.products = list_products
+    
+    def create_sets(self,FD_SET=['FinalD'],VA_SET=['VA']):
+
+        """
+        Creation of the various sets. First step in future-proofing by allowing
+        for own specification of set inputs
+        """
+       
+        self.m.S = Set(initialize=self.sectors, doc='sectors')
+        self.m.P = Set(initialize=self.products, doc='sectors')
+        self.m.row = Set(initialize=self.products, doc='products')
+        self.m.col = Set(initialize=self.sectors+['FinalD'], doc='sectors and final demand')
+        
+        self.m.rROW = Set(initialize=self.countries,ordered=True, doc='regions including export')
+        self.m.R = Set(initialize=self.countries,ordered=True, doc='regions')
+
+        self.m.fdemand = Set(initialize=FD_SET, doc='Final Demand')
+
+        self.m.VA = Set(initialize=VA_SET, doc='value added')
+
+    def create_alias(self):
+        """
+        Set aliases
+        """
+        self.m.Rb   = SetOf(self.m.R)  # an alias of region R
+        self.m.r   = SetOf(self.m.R)  # an alias of region R
+        self.m.Sb   = SetOf(self.m.S)  # an alias of sector S
+
+
+    def create_data(self, Table, xbase_dict=None):
+        """
+        Array data of the table and baseline (see model_data.py). The absolute and derived use
+        and supply tables are not created as Params.
+        """
+        self.data = model_data(Table, xbase_dict)
+
+        '''create Xbase'''
+    def create_Xbase(self):
+        model = self.m
+
+        def xbase_init(model, R, S):
+            return self.data.value('xbase', R, S)
+
+        model.Xbase = Param(model.R,model.S,initialize=xbase_init)
+        self.Xbase = model.Xbase
+    
+
+    def create_fd(self):
+        
+        model = self.m
+        
+        def findem_init(model,R,P):
+            return self.data.value('fd', R, P)
+        
+        model.fd = Param(model.R,model.P,initialize=findem_init)
+        
+        self.fd = model.fd
+    
+    def create_ExpImp(self):
+
+        model = self.m
+        # Specify Export ROW
+        def ExpROW_ini(m,R,P):
+            return self.data.value('exprow', R, P)
+        
+        model.ExpROW = Param(model.R, model.P, initialize=ExpROW_ini, doc='Exports to the rest of the world')               
+ 
+        self.ExpROW = model.ExpROW
+
+        # Demand fixed at baseline, which cannot be rationed (purchases of sectors outside a submodel, see neighbourhood.py)
+        def Held_ini(m,R,P):
+            return self.data.value('held', R, P)
+
+        model.Held = Param(model.R, model.P, initialize=Held_ini, doc='Demand held at baseline')
+
+        self.Held = model.Held
+
+    """
+    Set up baseline model
+    """
+ 
+    """ Create baseline dataset to use in model """
+    def baseline_data(self,Table, xbase_dict):
+   
+        self.create_data(Table, xbase_dict)
+        self.create_Xbase()
+        self.create_fd()
+        self.create_ExpImp()
+
+
+    def create_sup_disrupt(self, disr_dict_sup):
+
+        model = self.m
+
+        def shock_init_sup(model, R, S):
+            if (R, S) in list(disr_dict_sup.keys()):
+                return disr_dict_sup[R, S]
+            else:
+                return 1
+            
+        model.sup_disrupt = Param(model.R, model.S, initialize=shock_init_sup,
+                            doc='Total Production baseline')
+        
+        # Supply after disruption
+        self.sup_disrupt = model.sup_disrupt
+    
+    def create_dem_disrupt(self, disr_dict_dem):
+
+        model = self.m
+
+        def shock_init_dem(model, R, P):
+            if (R, P) in list(disr_dict_dem.keys()):
+                return (1-disr_dict_dem[R, P])
+            else:
+                return 0
+            
+        model.dem_disrupt = Param(model.R, model.P, initialize=shock_init_dem,
+                            doc='Total Production baseline')
+        
+        self.dem_disrupt = model.dem_disrupt
+    
+    def create_X_limits(self, op_factor, disr_dict_sup):
+
+        model = self.m
+
+        def x_init_lim(model, R, S):
+            if (R, S) in list(disr_dict_sup.keys()):
+                return(self.Xbase[R, S] * self.sup_disrupt[R, S])
+            
+            else:
+                # op_factor is either one value or a dictionary per region and sector
+                op = op_factor[R, S] if isinstance(op_factor, dict) else op_factor
+                return(self.Xbase[R, S] * self.sup_disrupt[R, S]*op)
+            
+        model.Xlim = Param(model.R, model.S, initialize= x_init_lim,
+                            doc='Total Production baseline')
+        
+        self.Xlim = model.Xlim
+    
+    def create_dem_limits(self):
+
+        model = self.m
+
+        def dem_init_lim(model, R, P):
+            return((self.fd[R, P] + self.ExpROW[R, P])* self.dem_disrupt[R, P])
+            
+        model.demlim = Param(model.R, model.P, initialize= dem_init_lim,
+                            doc='Total Production baseline')
+        
+        self.demlim = model.demlim
+
+    def create_Xdis(self):
+        """
+        Creation of the total production **X** variable.
+        
+        Parameters
+            - *self* - **MRIA_IO** class object
+
+            - Xbase - Total Production **X** parameter from the **MRIA** class object
+
+        """
+
+        model = self.m
+
+        # Keeping it bounded to disaster inputs
+        def X_bounds_dis(model, R, S):
+            
+            return (0.0, (self.Xlim[R,S]))
+        
+        def x_init_dis(model, R, S):
+            return(( self.Xbase[R, S] * self.sup_disrupt[R,S] ))
+        
+        model.Xdis = Var(model.R, model.S, bounds=X_bounds_dis,
+                    initialize=x_init_dis, doc='Total Production')
+
+
+        self.Xdis = model.Xdis
+    
+    def create_Ddis(self):
+        """
+        Creation of the total production **X** variable.
+        
+        Parameters
+            - *self* - **MRIA_IO** class object
+
+            - Xbase - Total Production **X** parameter from the **MRIA** class object
+
+        """
+
+        model = self.m
+
+        # Keeping it bounded to disaster inputs
+
+        def D_bounds_dis(model, R, P):
+            
+            # the max condition was addeed to prevent lower bound . upper bound error. Some sectors have very low neagtive demand values.
+            # some sectors had these values way less than 10^-13. Conopt fixed theses variables and issued warnings. To avoid any potential issues
+            # the minimum tolerance in upper limit was set to 10^-12
+
+            return (0, max(0, self.fd[R,P] + self.ExpROW[R,P] - self.demlim[R,P] ))   
+        
+        model.Ddis = Var(model.R, model.P, bounds=D_bounds_dis,
+                      initialize= 0 , doc='Total Production')
+
+        self.Ddis = model.Ddis
+        
+    def create_disimp_limits(self, all_disimp, imp_flex, distance_dict, num_thres):
+
+
+        model = self.m
+
+        def dis_imp_lim(model, Rb, R, P):
+            # We assume disaster imports can happen only between regions. Disaster imports within same region equals zero
+
+            if R == Rb:
+                return 0
+
+            else:
+
+                # imp_flex is either one value or a dictionary per trade link and product
+                ip = imp_flex[Rb, R, P] if isinstance(imp_flex, dict) else imp_flex
+
+                if ip * self.data.value('link', Rb, R, P) *all_disimp * distance_dict[Rb,R] >= num_thres:
+                    return ip * self.data.value('link', Rb, R, P) *all_disimp * distance_dict[Rb,R]
+                
+                else:
+
+                    return 0
+                    # The multiplication by Use matrix coeff ensure that there is alreay a trade link between the regions
+                    # We assume it is not easy to create new trade channels right after the disaster
+                    # The disimplim(Rb,R,P) equals the sum of inital use of Rb,P by all the sectors in R. 
+
+            
+                #return imp_flex * sum(self.Use[Rb,P,R,Sb] * self.Xbase[R,Sb] for Sb in model.Sb) *all_disimp * distance_dict[Rb,R]
+                #return max(10**-4 , imp_flex * sum(self.Use[Rb,P,R,Sb] * self.Xbase[R,Sb] for Sb in model.Sb) *all_disimp * distance_dict[Rb,R])
+            
+        model.disimplim = Param(model.Rb, model.R, model.P, initialize= dis_imp_lim,
+                            doc='Total Production baseline')
+        
+        self.disimplim = model.disimplim
+        self.num_thres = num_thres
+
+    def create_dis_imports(self):
+        """
+        Creation of the total production **X** variable.
+        
+        Parameters
+            - *self* - **MRIA_IO** class object
+
+            - Xbase - Total Production **X** parameter from the **MRIA** class object
+
+        """
+
+        model = self.m
+
+        
+        def dis_imp_bounds(model, Rb, R, P):
+            # some sectors had these values way less than 10^-13. Conopt fixed theses variables and issued warnings. To avoid any potential issues
+            # the minimum tolerance in upper limit was set to 10^-12
+
+            #return (0, max(10**-12, self.disimplim[Rb,R,P]))
+            return (0, self.disimplim[Rb,R,P])
+
+        model.disimp = Var(model.Rb, model.R, model.P, initialize = 0, bounds = dis_imp_bounds, doc='Trade')
+        self.disimp = model.disimp
+    
+        
+
+    def create_disaster_data(self, disr_dict_sup, disr_dict_dem, op_factor, all_disimp, imp_flex, distance_dict, num_thres):
+        """
+        Function to set up all the baseline variables for the MRIA model.
+        
+        Parameters
+            - *self* - **MRIA_IO** class object
+            - Table - the **io_basic** class object
+            - disr_dict_sup - dictionary containing the reduction in production capacity
+            - disr_dict_fd - dictionary containing the disruptions in final demand
+    
+        Outputs
+            - all required parameters and variables for the **MRIA_IO** class and the **MRIA** model
+
+        """
+
+        self.create_sup_disrupt(disr_dict_sup)
+        self.create_dem_disrupt(disr_dict_dem)
+        self.create_X_limits(op_factor, disr_dict_sup)
+        self.create_dem_limits()
+        self.create_Xdis()
+        self.create_Ddis()
+        self.create_disimp_limits(all_disimp, imp_flex, distance_dict, num_thres)
+        self.create_dis_imports()
+
+
+    def solve_stage(self, solvername, scaling=False, options=None):
+        """
+        Solve the model with its currently active objective.
+
+        With mosek (and no scaling) a persistent solver instance is kept on the object, so that the second stage
+        only passes the modified bounds, constraint and objective to the solver instead of writing the model again.
+        """
+        model = self.m
+
+        if scaling:
+            set_scaling_factors(self)
+
+        # Solving with a persistent mosek instance, which holds a mosek seat until release_solver()
+        if solvername == 'mosek' and not scaling and (self.solver is not None or self.take_seat()):
+            if self.solver is None:
+                self.solver = SolverFactory('mosek_persistent')
+                self.solver.set_instance(model)
+            results = timed_solve(self.solver, 'mosek', options = options, tee=True)
+            self.backend = 'mosek'
+
+        # Solving within the seat limits of the licensed solvers (see solver_dispatch.py)
+        else:
+            results, self.backend = solve_model(model, solvername, scaling, options)
+        results.write()
+
+        return results
+
+    def take_seat(self):
+        """
+        Take a mosek seat for the persistent solver instance. Returns False if none became free.
+        """
+        self.seat = acquire_seat('mosek')
+        return self.seat is not None
+
+    def release_solver(self):
+        """
+        Drop the persistent solver instance and give its seat back.
+        """
+        self.solver = None
+        if getattr(self, 'seat', None) is not None:
+            self.seat.release()
+            self.seat = None
+
+    def create_balance(self):
+        """
+        Creation of the product supply and demand expressions and the **demSup** constraint.
+        """
+        model = self.m
+
+        # Nonzero coefficients of the supply and use tables per product row
+        use_terms = nonzero_use(self)
+        sup_terms = nonzero_sup(self)
+
+        # Supply of a product
+        
+        def supply_expr(model,R,P):
+            return (sup_sum(sup_terms, self.Xdis, R, P) + sum(self.disimp[Rb,R,P] for Rb in model.Rb))
+
+        model.product_supply = Expression(model.R, model.P, rule=supply_expr)
+        self.product_supply = model.product_supply
+
+        # Demand for a product
+
+        def demand_expr(model,R,P):
+            return  (use_sum(use_terms, self.Xdis, R, P) + self.fd[R,P] 
+                    + self.ExpROW[R, P] 
+                    + self.Held[R, P]
+                    - self.demlim[R,P]
+                    - self.Ddis[R,P]
+                    + sum(self.disimp[R,Rb,P] for Rb in model.Rb)
+                    )
+        
+        model.product_demand = Expression(model.R, model.P, rule=demand_expr)
+        self.product_demand = model.product_demand
+
+        def demSup(model, R, P):
+            return (
+
+                    # Supply of a product
+                    self.product_supply[R,P]
+
+                    # greater than or equal to
+
+                    >=
+
+                    # Demand for a product
+                    self.product_demand[R,P]
+            )
+
+        model.demSup = Constraint(model.R, model.P, rule=demSup, doc='Satisfy demand')
+
+    def ration_objective(self):
+        """
+        Total rationing, the objective of the first stage.
+        """
+        model = self.m
+        return sum(self.Ddis[R, P] for R in model.R for P in model.P)
+
+    def supply_objective(self, alpha_weight=1.2):
+        """
+        Total output and weighted disaster imports, the objective of the second stage.
+        """
+        model = self.m
+        return sum(self.Xdis[R, S] for R in model.R for S in model.S)  + sum(self.disimp[Rb, R, P]*alpha_weight  for Rb in model.R for R in model.R for P in model.P)
+
+    def keep_rationing(self, fix_rationing='cells'):
+        """
+        Keep the rationing optimum of the first stage in the second stage.
+
+        Parameters
+            - fix_rationing - 'cells' bounds each Ddis[R,P] by its first stage value (same as the separate minimise supply model),
+                'total' adds a single constraint sum(Ddis) <= first stage objective
+        """
+        model = self.m
+
+        if fix_rationing == 'cells':
+            for index in model.Ddis:
+                self.Ddis[index].setub(max(0, self.Ddis[index].value))
+                if self.solver is not None:
+                    self.solver.update_var(self.Ddis[index])
+
+        elif fix_rationing == 'total':
+            model.ration_limit = Constraint(expr = self.ration_objective() <= self.ration_obj_value,
+                                            doc='Keep the minimum rationing')
+            if self.solver is not None:
+                self.solver.add_constraint(model.ration_limit)
+
+        else:
+            raise ValueError('Unknown fix_rationing option: {}'.format(fix_rationing))
+
+    def run_impactmodel(self, solvername, scaling=False, alpha_weight=1.2, fix_rationing='cells'):
+        """
+        Run the minimise rationing and minimise supply stages of the MRIA model on the same model.
+        
+        Parameters
+            - *self* - **MRIA_IO** class object
+            - solver - Specify the solver to be used with Pyomo. The Default value is set to **None**. If set to **None**, the ipopt solver will be used
+            - scaling - Row and column scale the model by baseline magnitudes before solving (see scaling.py)
+            - alpha_weight - weight of the disaster imports in the minimise supply objective
+            - fix_rationing - how the rationing optimum is kept in the second stage, see keep_rationing()
+
+        Outputs
+            - returns the output of an optimized **MRIA_IO** class and the **MRIA** model
+
+        """
+        model = self.m
+        self.solver = None
+        self.seat = None
+
+        self.create_balance()
+
+
+        """ Stage 1 - Objective: To minimise rationing """
+
+        model.objective = Objective(expr=self.ration_objective(), sense=minimize,
+                                    doc='Define objective function')
+
+        results = self.solve_stage(solvername, scaling)
+
+        self.ration_termination_condition = results.solver.termination_condition
+        self.ration_obj_value = value(model.objective, exception=False)
+        self.ration_backend = self.backend
+
+        if self.ration_termination_condition != TerminationCondition.optimal:
+            self.solver_status = results.solver.status
+            self.termination_condition = self.ration_termination_condition
+            self.obj_value = self.ration_obj_value
+            self.release_solver()
+            return
+
+
+        """ Stage 2 - Objective: To minimise supply (i.e., sum of outputs and imports) at minimum rationing """
+
+        self.keep_rationing(fix_rationing)
+
+        model.del_component(model.objective)
+        model.objective = Objective(expr=self.supply_objective(alpha_weight), sense=minimize,
+                                    doc='Define objective function')
+        if self.solver is not None:
+            self.solver.set_objective(model.objective)
+
+        results = self.solve_stage(solvername, scaling, options = {'dparam.intpnt_tol_path' : 0.1})
+
+        self.solver_status = results.solver.status
+        self.termination_condition = results.solver.termination_condition
+        self.obj_value = value(model.objective, exception=False)
+        self.release_solver()
\ No newline at end of file
@@ -18,7 +18,11 @@ import numpy as np
 import pandas as pd
 from pyomo.environ import (ConcreteModel, Constraint, Objective, Param, Set,
                            SetOf, Var, minimize, maximize, Expression)
-from pyomo.opt import SolverFactory
+
+from model_data import model_data
+from scaling import set_scaling_factors
+from solver_dispatch import solve_model
+from sparse_terms import nonzero_sup, nonzero_use, sup_sum, use_sum
 
 
 
@@ -71,88 +75,54 @@ class MRIA_SUT(object):
         self.m.Sb   = SetOf(self.m.S)  # an alias of sector S
 
 
-    def create_UseAbs(self,REG_USE):
-
-        model = self.m
-
-        def usetable_init(model,R,P,Rb,col):
-            return REG_USE[R,P,Rb,col]
-        
-        model.UseAbs = Param(model.R,model.P,model.Rb,model.col,initialize=usetable_init,doc='Absolute use table')
-
-        self.UseAbs = model.UseAbs
-
-    def create_SupAbs(self,REG_SUP):
-        model = self.m
-
-        def suptable_init(model,R,S,Rb,P):
-            return REG_SUP[R,S,Rb,P]
-        
-        model.SupAbs = Param(model.R,model.S,model.Rb,model.P,initialize=suptable_init,doc='Absolute sup table')
-
-        self.SupAbs = model.SupAbs
+    def create_data(self, Table, xbase_dict=None):
+        """
+        Array data of the table and baseline (see model_data.py). The absolute and derived use
+        and supply tables are not created as Params.
+        """
+        self.data = model_data(Table, xbase_dict)
 
         '''create Xbase'''
-    def create_Xbase(self, xbase_dict):
+    def create_Xbase(self):
         model = self.m
 
         def xbase_init(model, R, S):
-                return xbase_dict[R, S]
+            return self.data.value('xbase', R, S)
 
         model.Xbase = Param(model.R,model.S,initialize=xbase_init)
         self.Xbase = model.Xbase
     
 
-    def create_Sup(self):
-        model = self.m
-        def sup_init(model,R,S,P):
-
-            if self.Xbase[R,S] == 0:
-                return 0
-            
-            else:
-                return sum(self.SupAbs[R,S,Rb,P] for Rb in model.Rb)/self.Xbase[R,S]
-         
-        model.Sup = Param(model.R,model.S,model.P,initialize=sup_init)
-        self.Sup = model.Sup  
-
-
-    def create_Use(self):
-        model = self.m
-        def use_init(model,Rb,P,R,S):
-
-            if self.Xbase[R,S] == 0:
-                return 0
-            
-            else:
-                return self.UseAbs[Rb,P,R,S]/self.Xbase[R,S]
-         
-        model.Use = Param(model.Rb,model.P,model.R,model.S,initialize=use_init)
-        self.Use = model.Use  
-
-
-    def create_fd(self,REG_USE):
+    def create_fd(self):
         
         model = self.m
         
         def findem_init(model,R,P):
-            return sum(REG_USE[R,P,Rb,fdemand] for Rb in model.Rb for fdemand in model.fdemand)
+            return self.data.value('fd', R, P)
         
         model.fd = Param(model.R,model.P,initialize=findem_init)
         
         self.fd = model.fd
     
-    def create_ExpImp(self,ExpROW_in):
+    def create_ExpImp(self):
 
         model = self.m
         # Specify Export ROW
         def ExpROW_ini(m,R,P):
-            return (ExpROW_in[R,P,'Exports'])
+            return self.data.value('exprow', R, P)
         
         model.ExpROW = Param(model.R, model.P, initialize=ExpROW_ini, doc='Exports to the rest of the world')               
  
         self.ExpROW = model.ExpROW
 
+        # Demand fixed at baseline, which cannot be rationed (purchases of sectors outside a submodel, see neighbourhood.py)
+        def Held_ini(m,R,P):
+            return self.data.value('held', R, P)
+
+        model.Held = Param(model.R, model.P, initialize=Held_ini, doc='Demand held at baseline')
+
+        self.Held = model.Held
+
     """
     Set up baseline model
     """
@@ -160,13 +130,10 @@ class MRIA_SUT(object):
     """ Create baseline dataset to use in model """
     def baseline_data(self,Table, xbase_dict):
    
-        self.create_UseAbs(Table.Use)
-        self.create_SupAbs(Table.Sup)
-        self.create_Xbase(xbase_dict)
-        self.create_Sup()
-        self.create_Use()
-        self.create_fd(Table.Use)
-        self.create_ExpImp(Table.ExpROW)
+        self.create_data(Table, xbase_dict)
+        self.create_Xbase()
+        self.create_fd()
+        self.create_ExpImp()
 
 
     def create_sup_disrupt(self, disr_dict_sup):
@@ -209,7 +176,9 @@ class MRIA_SUT(object):
                 return(self.Xbase[R, S] * self.sup_disrupt[R, S])
             
             else:
-                return(self.Xbase[R, S] * self.sup_disrupt[R, S]*op_factor)
+                # op_factor is either one value or a dictionary per region and sector
+                op = op_factor[R, S] if isinstance(op_factor, dict) else op_factor
+                return(self.Xbase[R, S] * self.sup_disrupt[R, S]*op)
             
         model.Xlim = Param(model.R, model.S, initialize= x_init_lim,
                             doc='Total Production baseline')
@@ -296,8 +265,11 @@ class MRIA_SUT(object):
 
             else:
 
-                if imp_flex * sum(self.Use[Rb,P,R,Sb] * self.Xbase[R,Sb] for Sb in model.Sb) *all_disimp * distance_dict[Rb,R] >= num_thres:
-                    return imp_flex * sum(self.Use[Rb,P,R,Sb] * self.Xbase[R,Sb] for Sb in model.Sb) *all_disimp * distance_dict[Rb,R]
+                # imp_flex is either one value or a dictionary per trade link and product
+                ip = imp_flex[Rb, R, P] if isinstance(imp_flex, dict) else imp_flex
+
+                if ip * self.data.value('link', Rb, R, P) *all_disimp * distance_dict[Rb,R] >= num_thres:
+                    return ip * self.data.value('link', Rb, R, P) *all_disimp * distance_dict[Rb,R]
                 
                 else:
 
@@ -365,13 +337,14 @@ class MRIA_SUT(object):
         self.create_disimp_limits(all_disimp, imp_flex, distance_dict, num_thres)
         self.create_dis_imports()
 
-    def run_impactmodel(self, solvername):
+    def run_impactmodel(self, solvername, scaling=False):
         """
         Run the baseline model of the MRIA model. This should return the baseline situation (i.e. no changes between input matrix and output matrix).
         
         Parameters
             - *self* - **MRIA_IO** class object
             - solver - Specify the solver to be used with Pyomo. The Default value is set to **None**. If set to **None**, the ipopt solver will be used
+            - scaling - Row and column scale the model by baseline magnitudes before solving (see scaling.py)
 
         Outputs
             - returns the output of an optimized **MRIA_IO** class and the **MRIA** model
@@ -379,10 +352,14 @@ class MRIA_SUT(object):
         """
         model = self.m
 
+        # Nonzero coefficients of the supply and use tables per product row
+        use_terms = nonzero_use(self)
+        sup_terms = nonzero_sup(self)
+
         # Supply of a product
         
         def supply_expr(model,R,P):
-            return (sum(self.Xdis[R, Sb]* self.Sup[R,Sb,P] for Sb in model.Sb) + sum(self.disimp[Rb,R,P] for Rb in model.Rb))
+            return (sup_sum(sup_terms, self.Xdis, R, P) + sum(self.disimp[Rb,R,P] for Rb in model.Rb))
 
         model.product_supply = Expression(model.R, model.P, rule=supply_expr)
         self.product_supply = model.product_supply
@@ -390,9 +367,9 @@ class MRIA_SUT(object):
         # Demand for a product
 
         def demand_expr(model,R,P):
-            return  (sum(self.Use[R, P, Rb, Sb]*self.Xdis[Rb, Sb] for Rb in model.Rb
-                        for Sb in model.Sb) + self.fd[R,P] 
+            return  (use_sum(use_terms, self.Xdis, R, P) + self.fd[R,P] 
                     + self.ExpROW[R, P] 
+                    + self.Held[R, P]
                     - self.demlim[R,P]
                     - self.Ddis[R,P]
                     + sum(self.disimp[R,Rb,P] for Rb in model.Rb)
@@ -424,15 +401,13 @@ class MRIA_SUT(object):
         model.objective = Objective(rule=objective_base, sense=minimize,
                                     doc='Define objective function')
 
-        # Solving with mosek
-        if solvername == 'mosek':
-            solver = SolverFactory('mosek')
-            results = solver.solve(model, tee=True)
-            results.write()
-
-        if solvername == 'gams':
-            opt = SolverFactory('gams')
-            io_options = {'solver': 'conopt', 'add_options':['GAMS_MODEL.OptFile = 1;'] } 
-            results = opt.solve(model, keepfiles = True, tee= True,  io_options = io_options, tmpdir = 'C:/Users/sva100/GAMStemp')
-            results.write()
+        if scaling:
+            set_scaling_factors(self)
+
+        # Solving within the seat limits of the licensed solvers (see solver_dispatch.py)
+        results, self.backend = solve_model(model, solvername, scaling)
+        results.write()
+
+        self.solver_status = results.solver.status
+        self.termination_condition = results.solver.termination_condition
 
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Impact-neighbourhood submodels for localised disruptions.
+
+A shock to a few region-sector pairs reaches the rest of the economy through markets: a pair
+that loses output supplies less to its product markets (R, P), the sectors that buy from
+those markets (Use[R,P,Rb,S] != 0) are limited in turn and supply less to their own markets,
+and a market can draw disaster imports from the markets of the same product in the regions
+it is linked to (disimplim). Starting from the disrupted pairs, this graph of markets is
+searched up to *depth* hops, and the model is built only on the regions of the markets that
+are reached.
+
+Everything outside the neighbourhood is held at its baseline:
+
+    - the final demand of outside regions from inside markets is added to the exports to the
+      rest of the world (ExpROW) of those markets, and can be rationed as in the full model
+    - the purchases of outside sectors from inside markets are held demand (Held_arr): fixed
+      at baseline and never rationed, as their Use x Xdis terms in the full model
+    - the supply of inside sectors to outside regions stays in their supply coefficients
+    - inside sectors keep buying from outside markets, which are not constrained
+
+Outside results are the baseline (Xdis = Xbase, no rationing). With verify=True the full
+model is solved as well and the differences are reported; a deeper neighbourhood is needed
+when they are not small.
+"""
+import numpy as np
+
+from presolve import full_values, restrict_table
+from run_mria import mria_run
+from scenario_engine import extract_result, values_to_array
+
+
+def restrict_dict(values, countries, positions=(0,)):
+    """
+    Keep the entries of a dictionary whose region positions are all in *countries*.
+    """
+    if not isinstance(values, dict):
+        return values
+    cs = set(countries)
+    return {k: v for k, v in values.items() if all(k[p] in cs for p in positions)}
+
+
+class Neighbourhood(object):
+    """
+    Parameters
+        - DATA - the **sut_basic** class object
+        - new_Xbase - corrected baseline (stage 1 of mria_run)
+        - distance_dict - distance dictionary of the disaster imports
+        - solvername - solver to use
+        - depth - number of market to market hops searched from the disrupted pairs
+        - options - passed on to mria_run (presolve, scaling, lexicographic)
+    """
+
+    def __init__(self, DATA, new_Xbase, distance_dict, solvername, depth=2, **options):
+
+        self.DATA = DATA
+        self.new_Xbase = new_Xbase
+        self.distance_dict = distance_dict
+        self.solvername = solvername
+        self.depth = depth
+        self.options = options
+
+        if not hasattr(DATA, 'Use_arr'):
+            DATA.prep_arrays()
+
+        nS = len(DATA.sectors)
+        self.xbase = values_to_array(new_Xbase, DATA.countries, DATA.sectors)
+        self.use = DATA.Use_arr[..., :nS] * (self.xbase != 0)[None, None]
+        self.final = DATA.Use_arr[..., nS:].sum(axis=3)
+        self.supplies = DATA.Sup_arr.sum(axis=2) != 0
+        self.distance = values_to_array(distance_dict, DATA.countries, DATA.countries)
+
+    def markets(self, scenario):
+        """
+        Boolean (R, P) array of the markets reached by the disruption of a scenario.
+        """
+        DATA = self.DATA
+        rpos = {r: n for n, r in enumerate(DATA.countries)}
+        spos = {s: n for n, s in enumerate(DATA.sectors)}
+        ppos = {p: n for n, p in enumerate(DATA.products)}
+
+        reached = np.zeros((len(DATA.countries), len(DATA.products)), dtype=bool)
+        for R, S in scenario.get('disr_dict_sup', {}):
+            reached[rpos[R]] |= self.supplies[rpos[R], spos[S]]
+        for R, P in scenario.get('disr_dict_dem', {}):
+            reached[rpos[R], ppos[P]] = True
+
+        buys = self.use != 0
+        # link[Rb, R, P]: sectors in R use product P of Rb, so R can import P from Rb
+        link = (self.use.sum(axis=3) != 0).transpose(0, 2, 1) & (self.distance != 0)[..., None]
+        if not scenario.get('all_disimp', 1) or np.all(np.asarray(scenario.get('imp_flex', 0)) == 0):
+            link[:] = False
+
+        frontier = reached.copy()
+        for level in range(self.depth):
+            # sectors buying from the frontier, and the markets they supply
+            cells = np.einsum('rp,rpbs->bs', frontier, buys) != 0
+            new = np.einsum('bs,bsp->bp', cells, self.supplies) != 0
+            # markets of the same product the frontier can import from
+            new |= np.einsum('rp,brp->bp', frontier, link) != 0
+
+            frontier = new & ~reached
+            reached |= new
+            if not frontier.any():
+                break
+
+        return reached
+
+    def regions(self, scenario):
+        """
+        Regions of the neighbourhood of a scenario, in the order of DATA.
+        """
+        reached = self.markets(scenario).any(axis=1)
+        return [r for r, inside in zip(self.DATA.countries, reached) if inside]
+
+    def table(self, regions):
+        """
+        Table restricted to *regions*, with the flows to outside regions held at baseline.
+        """
+        DATA = self.DATA
+        inside = np.array([r in set(regions) for r in DATA.countries])
+        sub = restrict_table(DATA, regions, DATA.sectors, DATA.products)
+
+        # Final demand of outside regions becomes exports, purchases of outside sectors held demand
+        final = self.final[:, :, ~inside].sum(axis=2)
+        held = self.use[:, :, ~inside].sum(axis=(2, 3))
+        # Supply to outside regions is moved to the own region (only the sum over regions is used)
+        moved = DATA.Sup_arr[:, :, ~inside].sum(axis=2)
+
+        # the dictionaries of prep_data, if the table has them (not on tensor exports)
+        if hasattr(sub, 'ExpROW'):
+            sub.ExpROW = dict(sub.ExpROW)
+            sub.Sup = dict(sub.Sup)
+            for i, R in enumerate(DATA.countries):
+                if not inside[i]:
+                    continue
+                for k, P in enumerate(DATA.products):
+                    if final[i, k] != 0:
+                        sub.ExpROW[R, P, 'Exports'] = sub.ExpROW.get((R, P, 'Exports'), 0) + final[i, k]
+                    for j, S in enumerate(DATA.sectors):
+                        if moved[i, j, k] != 0:
+                            sub.Sup[R, S, R, P] = sub.Sup.get((R, S, R, P), 0) + moved[i, j, k]
+
+        # the arrays the stage models are built from (model_data.py)
+        sub.ExpROW_arr = sub.ExpROW_arr + final[inside]
+        sub.Held_arr = held[inside]
+        sub.Sup_arr = sub.Sup_arr.copy()
+        for n, i in enumerate(np.flatnonzero(inside)):
+            sub.Sup_arr[n, :, n, :] += moved[i]
+        return sub
+
+    def run(self, scenario, verify=False):
+        """
+        Solve a scenario on its neighbourhood and return a record on the full index sets (see
+        scenario_engine.extract_result), with the regions of the neighbourhood.
+        """
+        DATA = self.DATA
+        regions = self.regions(scenario)
+        sub = self.table(regions)
+
+        op_factor = restrict_dict(scenario.get('op_factor', 1), regions)
+        imp_flex = restrict_dict(scenario.get('imp_flex', 0), regions, (0, 1))
+
+        MRIA_RUN1, MRIA_RUN2, MRIA_RUN3, MRIA_RUN5 = mria_run(sub, op_factor, scenario.get('all_disimp', 1), imp_flex,
+                                                              restrict_dict(scenario.get('disr_dict_sup', {}), regions),
+                                                              restrict_dict(scenario.get('disr_dict_dem', {}), regions),
+                                                              restrict_dict(self.distance_dict, regions, (0, 1)),
+                                                              self.solvername,
+                                                              new_Xbase=restrict_dict(self.new_Xbase, regions),
+                                                              inverse=False, **self.options)
+
+        inside = np.array([r in set(regions) for r in DATA.countries])
+        record = {'key': scenario.get('key'),
+                  'status': str(MRIA_RUN3.termination_condition),
+                  'num_thres': MRIA_RUN3.num_thres,
+                  'objective': MRIA_RUN3.obj_value,
+                  'backend': getattr(MRIA_RUN3, 'backend', None),
+                  'ration_backend': getattr(MRIA_RUN2, 'ration_backend', getattr(MRIA_RUN2, 'backend', None)),
+                  'regions': regions,
+                  'Xdis': values_to_array(full_values(MRIA_RUN3, 'Xdis'), DATA.countries, DATA.sectors),
+                  'Ddis': values_to_array(full_values(MRIA_RUN3, 'Ddis'), DATA.countries, DATA.products)}
+        record['Xdis'][~inside] = self.xbase[~inside]
+
+        if verify:
+            record['verify'] = self.verify(scenario, record)
+
+        return record
+
+    def verify(self, scenario, record):
+        """
+        Solve the full model and compare it with a neighbourhood record.
+        """
+        MRIA_RUN1, MRIA_RUN2, MRIA_RUN3, MRIA_RUN5 = mria_run(self.DATA, scenario.get('op_factor', 1),
+                                                              scenario.get('all_disimp', 1), scenario.get('imp_flex', 0),
+                                                              scenario.get('disr_dict_sup', {}),
+                                                              scenario.get('disr_dict_dem', {}),
+                                                              self.distance_dict, self.solvername,
+                                                              new_Xbase=self.new_Xbase, inverse=False, **self.options)
+        full = extract_result(MRIA_RUN3, self.DATA)
+
+        rationing = full['Ddis'].sum()
+        return {'status': full['status'],
+                'rationing_full': rationing,
+                'rationing_sub': record['Ddis'].sum(),
+                'rationing_rel_diff': abs(record['Ddis'].sum() - rationing) / max(abs(rationing), 10**-12),
+                'Ddis_max_diff': np.abs(record['Ddis'] - full['Ddis']).max(),
+                'Xdis_max_diff': np.abs(record['Xdis'] - full['Xdis']).max()}
\ No newline at end of file
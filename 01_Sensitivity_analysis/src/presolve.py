@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Presolve of the supply and use tables before the MRIA models are built.
+
+Structurally empty parts of the SUT (sectors without output in every region, products
+without any supply or demand, regions without any activity) are removed from the index
+sets, so that none of the stage models creates variables, bounds or constraint terms for
+them. Results of the reduced models are mapped back to the full shape with zeros.
+
+Within the remaining sets, variables whose bounds collapse to a single point (e.g. the
+output of a region-sector pair with Xbase = 0, or disaster imports below num_thres) are
+fixed, which removes them from the LP handed to the solver.
+"""
+import copy
+import itertools
+
+import numpy as np
+from pyomo.environ import Var
+
+
+def restrict_table(Table, countries, sectors, products):
+    """
+    Return a shallow copy of a **sut_basic** object that only covers the given regions,
+    sectors and products.
+    """
+    cs, ss, ps = set(countries), set(sectors), set(products)
+    cols = ss | set(Table.FD_cat)
+
+    reduced = copy.copy(Table)
+    reduced.countries = [r for r in Table.countries if r in cs]
+    reduced.total_countries = len(reduced.countries)
+    reduced.sectors = [s for s in Table.sectors if s in ss]
+    reduced.products = [p for p in Table.products if p in ps]
+
+    # tables opened from a tensor export (table.py) have the arrays only
+    if hasattr(Table, 'Use'):
+        reduced.Use = {k: v for k, v in Table.Use.items() if k[0] in cs and k[1] in ps and k[2] in cs and k[3] in cols}
+        reduced.Sup = {k: v for k, v in Table.Sup.items() if k[0] in cs and k[1] in ss and k[2] in cs and k[3] in ps}
+        reduced.ValueA = {k: v for k, v in Table.ValueA.items() if k[0] in cs and k[1] in ss}
+        reduced.ImpROW = {k: v for k, v in Table.ImpROW.items() if k[0] in cs and k[1] in ps}
+        reduced.ExpROW = {k: v for k, v in Table.ExpROW.items() if k[0] in cs and k[1] in ps}
+
+    if hasattr(Table, 'Use_arr'):
+        r = [n for n, c in enumerate(Table.countries) if c in cs]
+        s = [n for n, c in enumerate(Table.sectors) if c in ss]
+        p = [n for n, c in enumerate(Table.products) if c in ps]
+        fd = [len(Table.sectors) + n for n in range(len(Table.FD_cat))]
+        reduced.Use_arr = Table.Use_arr[np.ix_(r, p, r, s + fd)]
+        reduced.Sup_arr = Table.Sup_arr[np.ix_(r, s, r, p)]
+        reduced.ExpROW_arr = Table.ExpROW_arr[np.ix_(r, p)]
+        if getattr(Table, 'Held_arr', None) is not None:
+            reduced.Held_arr = Table.Held_arr[np.ix_(r, p)]
+    # the reduced arrays are in memory, not mapped from the export
+    reduced.tensor_dir = None
+    reduced._model_data = []
+
+    return reduced
+
+
+class SUTPresolve(object):
+    """
+    Detects the active index sets of a **sut_basic** table and maps values between the
+    reduced and the full index sets.
+    """
+
+    def __init__(self, Table):
+
+        self.Table = Table
+        self.countries = list(Table.countries)
+        self.sectors = list(Table.sectors)
+        self.products = list(Table.products)
+
+        self.detect()
+
+    def detect(self):
+        """
+        Find the active regions, sectors and products.
+
+            - a region-sector pair is active if it has output (Xbase != 0)
+            - a sector is active if it is active in at least one region
+            - a product is active if it is supplied or demanded (intermediate, final or exports) anywhere
+            - a region is active if it has an active sector, demands a product or supplies final demand
+        """
+        if not hasattr(self.Table, 'Use_arr'):
+            self.Table.prep_arrays()
+
+        use = self.Table.Use_arr != 0
+        sup = self.Table.Sup_arr != 0
+        exp = self.Table.ExpROW_arr != 0
+        if getattr(self.Table, 'Held_arr', None) is not None:
+            exp = exp | (self.Table.Held_arr != 0)
+
+        # Xbase[R,S] sums SupAbs[Rb,S,R,P] over Rb and P
+        cell = sup.any(axis=(0, 3)).T
+
+        sector = cell.any(axis=0)
+        product = sup.any(axis=(0, 1, 2)) | use.any(axis=(0, 2, 3)) | exp.any(axis=0)
+        region = cell.any(axis=1) | use.any(axis=(1, 2, 3)) | use[:, :, :, -1].any(axis=(0, 1)) | exp.any(axis=1)
+
+        self.active_cells = cell
+        self.active_countries = [r for r, a in zip(self.countries, region) if a]
+        self.active_sectors = [s for s, a in zip(self.sectors, sector) if a]
+        self.active_products = [p for p, a in zip(self.products, product) if a]
+
+        self.removed = {'countries': len(self.countries) - len(self.active_countries),
+                        'sectors': len(self.sectors) - len(self.active_sectors),
+                        'products': len(self.products) - len(self.active_products)}
+
+    def reduce(self):
+        """
+        Return the table restricted to the active index sets
+        """
+        return restrict_table(self.Table, self.active_countries, self.active_sectors, self.active_products)
+
+    def _full_index(self, kind):
+
+        sets = {'R': self.countries, 'S': self.sectors, 'P': self.products}
+        return itertools.product(*[sets[k] for k in kind])
+
+    def _active_sets(self, kind):
+
+        sets = {'R': set(self.active_countries), 'S': set(self.active_sectors), 'P': set(self.active_products)}
+        return [sets[k] for k in kind]
+
+    def restrict(self, values, kind):
+        """
+        Drop the entries of a dictionary that fall outside the active index sets.
+
+        Parameters
+            - values - dictionary keyed by tuples
+            - kind - string with the set of each key position, e.g. 'RS', 'RP', 'RR' or 'RRP'
+        """
+        sets = self._active_sets(kind)
+        return {k: v for k, v in values.items() if all(i in s for i, s in zip(k, sets))}
+
+    def expand(self, values, kind, fill=0.0):
+        """
+        Map a dictionary of reduced model values (e.g. the output of get_values()) back to the
+        full index sets. Entries removed by the presolve are set to *fill*.
+        """
+        return {k: values.get(k, fill) for k in self._full_index(kind)}
+
+    def fix_empty(self, MRIA_RUN):
+        """
+        Fix the variables of a built (but not yet solved) stage model that cannot move:
+        variables with equal lower and upper bounds, and the unbounded total production of
+        region-sector pairs without baseline output.
+        """
+        model = MRIA_RUN.m
+        fixed = 0
+
+        for var in model.component_objects(Var, active=True):
+            for index in var:
+                v = var[index]
+                if v.fixed:
+                    continue
+                if v.lb is not None and v.ub is not None and v.lb == v.ub:
+                    v.fix(v.lb)
+                    fixed += 1
+                elif var.local_name == 'X' and MRIA_RUN.Xbase[index] == 0:
+                    v.fix(0)
+                    fixed += 1
+
+        MRIA_RUN.presolve = self
+        MRIA_RUN.fixed_vars = fixed
+        return fixed
+
+
+def full_values(MRIA_RUN, component, fill=0.0):
+    """
+    Values of a variable of a stage model on the full index sets, whether or not the model
+    was built on a presolved table.
+
+    Parameters
+        - MRIA_RUN - solved **MRIA_SUT** class object
+        - component - name of the variable, e.g. 'Xdis', 'Ddis' or 'disimp'
+    """
+    var = getattr(MRIA_RUN, component)
+    values = var.get_values()
+
+    PRESOLVE = getattr(MRIA_RUN, 'presolve', None)
+    if PRESOLVE is None:
+        return values
+
+    kinds = {'X': 'RS', 'Xdis': 'RS', 'Ddis': 'RP', 'disimp': 'RRP'}
+    return PRESOLVE.expand(values, kinds[component], fill)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-period recovery simulation.
+
+The MRIA pipeline gives one post-disaster equilibrium for the capacity left in sup_disrupt.
+Here the lost capacity of every disrupted region-sector pair recovers over time along a
+sector specific curve, and an equilibrium is solved for every period (e.g. 52 weeks):
+
+    capacity(t) = 1 - (1 - capacity(0)) * (1 - f_s(t))
+
+with f_s the recovered share of sector s, from 0 at the disaster to 1 at full recovery.
+
+All periods are solved on one persistent LP template (lp_template.py): from one period to
+the next only the Xdis bounds of the recovering pairs change, so the solver keeps its model
+and starts from the solution of the previous period. This needs a simplex optimizer (the
+previous basis is reused; the interior point method starts cold), which is the default with
+mosek. Periods whose capacity did not change are not solved again, and once all capacity is
+back the remaining periods take the solution of the last one.
+
+The trajectory is kept as arrays (periods x regions x sectors / products) and can be written
+to a **ResultStore**.
+"""
+import numpy as np
+
+from lp_template import LPTemplate
+from scenario_engine import extract_result
+
+
+"""
+Default options with mosek: the simplex optimizer warm starts from the basis of the previous period
+"""
+
+SIMPLEX = {'iparam.optimizer': 'optimizertype.free_simplex'}
+
+# option that selects the optimizer, per backend
+OPTIMIZER_OPTION = {'mosek': 'iparam.optimizer', 'highs': 'solver'}
+
+
+def recovered_share(shape, t, duration):
+    """
+    Recovered share of the lost capacity after t periods.
+
+    Parameters
+        - shape - 'linear' (constant pace), 'exponential' (95% recovered after duration),
+          or 'step' (all capacity back after duration)
+        - duration - number of periods until (almost) full recovery
+    """
+    if duration <= 0:
+        return 1.0
+    if shape == 'linear':
+        return min(1.0, t / duration)
+    if shape == 'exponential':
+        return 1 - np.exp(-3 * t / duration)
+    if shape == 'step':
+        return 1.0 if t >= duration else 0.0
+    raise ValueError('Unknown recovery shape: {}'.format(shape))
+
+
+def capacity_path(disr_dict_sup, recovery, n_periods, default=('linear', 12)):
+    """
+    Remaining capacity of the disrupted pairs in every period.
+
+    Parameters
+        - disr_dict_sup - remaining capacity at the disaster {(R, S): capacity}
+        - recovery - dictionary {sector: (shape, duration)}; sectors not in it use *default*
+
+    Outputs
+        - list of disr_dict_sup dictionaries, one per period (period 0 is the disaster)
+    """
+    path = []
+    for t in range(n_periods):
+        period = {}
+        for (R, S), capacity in disr_dict_sup.items():
+            shape, duration = recovery.get(S, default)
+            period[R, S] = 1 - (1 - capacity) * (1 - recovered_share(shape, t, duration))
+        path.append(period)
+    return path
+
+
+def recovery_trajectory(template, DATA, disr_dict_sup, recovery, n_periods=52, period_days=7,
+                        disr_dict_dem=None, op_factor=1, imp_flex=0, all_disimp=1,
+                        default=('linear', 12), options=None, tol=10**-9):
+    """
+    Solve the equilibria of a recovery.
+
+    Parameters
+        - template - **LPTemplate** of the table
+        - DATA - the **sut_basic** class object
+        - disr_dict_sup - remaining capacity at the disaster
+        - recovery, default - recovery curves per sector, see capacity_path
+        - n_periods - number of periods
+        - period_days - length of a period, to convert the (annual) rationing to each period
+        - disr_dict_dem, op_factor, imp_flex, all_disimp - as for mria_run, constant over the recovery
+        - options - solver options; SIMPLEX by default with mosek, so that the basis is reused
+          between periods
+        - tol - capacity below 1 - tol counts as not recovered
+
+    Outputs
+        - dictionary of arrays: 'capacity' (T, R, S), 'Xdis' (T, R, S), 'Ddis' (T, R, P),
+          'rationing' (T,) rationing within each period, 'solved' (T,) periods that were solved,
+          and the lists 'status', 'backend' and 'optimizer' of the final stage of every period
+    """
+    if options is None and template.solvername == 'mosek':
+        options = SIMPLEX
+
+    path = capacity_path(disr_dict_sup, recovery, n_periods, default)
+    position_R = {R: n for n, R in enumerate(DATA.countries)}
+    position_S = {S: n for n, S in enumerate(DATA.sectors)}
+
+    capacity = np.ones((n_periods, len(DATA.countries), len(DATA.sectors)))
+    Xdis = np.zeros((n_periods, len(DATA.countries), len(DATA.sectors)))
+    Ddis = np.zeros((n_periods, len(DATA.countries), len(DATA.products)))
+    solved = np.zeros(n_periods, dtype=bool)
+    status, backend, optimizer = [], [], []
+
+    record = None
+    previous = None
+    for t, period in enumerate(path):
+        for (R, S), value in period.items():
+            capacity[t, position_R[R], position_S[S]] = value
+
+        # only the pairs that have not recovered yet are disrupted
+        disrupted = {key: value for key, value in period.items() if value < 1 - tol}
+
+        if record is None or disrupted != previous:
+            scenario = {'disr_dict_sup': disrupted, 'disr_dict_dem': disr_dict_dem or {},
+                        'op_factor': op_factor, 'imp_flex': imp_flex, 'all_disimp': all_disimp}
+            record = extract_result(template.solve(scenario, options=options), DATA)
+            # options are only passed to the backend requested, not to a fallback
+            option = OPTIMIZER_OPTION.get(record['backend'])
+            record['optimizer'] = (options or {}).get(option, 'default') if record['backend'] == template.solvername else 'default'
+            solved[t] = True
+            previous = disrupted
+
+        Xdis[t] = record['Xdis']
+        Ddis[t] = record['Ddis']
+        status.append(record['status'])
+        backend.append(record['backend'])
+        optimizer.append(record['optimizer'])
+
+    return {'capacity': capacity, 'Xdis': Xdis, 'Ddis': Ddis,
+            'rationing': Ddis.sum(axis=(1, 2)) * period_days / 365,
+            'solved': solved, 'status': status, 'backend': backend, 'optimizer': optimizer}
+
+
+def run_recovery(DATA, new_Xbase, distance_dict, solvername, disr_dict_sup, recovery,
+                 store=None, key=None, presolve=False, **kwargs):
+    """
+    Build a template and solve one recovery trajectory, see recovery_trajectory. The trajectory
+    is added to *store* (a **ResultStore**) under *key* if given. The template, and the mosek
+    seat it holds, is closed at the end.
+    """
+    with LPTemplate(DATA, new_Xbase, distance_dict, solvername, presolve=presolve) as template:
+        trajectory = recovery_trajectory(template, DATA, disr_dict_sup, recovery, **kwargs)
+
+    if store is not None:
+        record = {name: (values.astype(np.float32) if values.dtype == float else values)
+                  for name, values in trajectory.items() if isinstance(values, np.ndarray)}
+        for name in ('status', 'backend', 'optimizer'):
+            record[name] = [str(s) for s in trajectory[name]]
+        store.put(key, record)
+
+    return trajectory
\ No newline at end of file
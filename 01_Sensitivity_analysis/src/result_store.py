@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Result store for scenario records.
+
+Every record of the scenario engine (arrays plus status, num_thres and objective) is kept as
+one compressed .npz file in a directory, named by a hash of its scenario key. Files are
+written to a temporary name and moved in place, so several processes (or machines sharing
+the directory) can add results to the same store, and a record is either complete or absent.
+
+Keys are tuples of strings and numbers, e.g. ('single', 'NL33', 'C20', 0.1).
+"""
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+
+def _to_key(value):
+
+    if isinstance(value, list):
+        return tuple(_to_key(v) for v in value)
+    return value
+
+
+class ResultStore(object):
+    """
+    Directory of scenario records.
+
+    Parameters
+        - path - directory of the store, created if it does not exist
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+
+        digest = hashlib.sha1(json.dumps(key, default=str).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.npz')
+
+    def __contains__(self, key):
+
+        return os.path.exists(self._file(key))
+
+    def put(self, key, record):
+        """
+        Store a record. Array entries are saved as arrays, all others as JSON metadata.
+        """
+        arrays = {k: v for k, v in record.items() if isinstance(v, np.ndarray)}
+        meta = {k: v for k, v in record.items() if not isinstance(v, np.ndarray)}
+        meta['key'] = key
+
+        target = self._file(key)
+        tmp = os.path.join(self.path, '.{}.tmp.npz'.format(uuid.uuid4().hex))
+        np.savez_compressed(tmp, __meta__=np.array(json.dumps(meta, default=str)), **arrays)
+        os.replace(tmp, target)
+
+    def get(self, key, default=None):
+        """
+        Return the stored record of a key, or *default*.
+        """
+        target = self._file(key)
+        if not os.path.exists(target):
+            return default
+        return self._load(target)
+
+    def _load(self, target):
+
+        with np.load(target) as data:
+            record = json.loads(str(data['__meta__']))
+            record['key'] = _to_key(record['key'])
+            for name in data.files:
+                if name != '__meta__':
+                    record[name] = data[name]
+        return record
+
+    def keys(self):
+
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith('.npz') and not name.startswith('.'):
+                with np.load(os.path.join(self.path, name)) as data:
+                    yield _to_key(json.loads(str(data['__meta__']))['key'])
+
+    def records(self):
+
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith('.npz') and not name.startswith('.'):
+                yield self._load(os.path.join(self.path, name))
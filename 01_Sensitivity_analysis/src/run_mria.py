@@ -4,24 +4,70 @@ from mria_new_SUT_base import MRIA_SUT as MRIAnew
 from mria_new_SUT_min_ration import MRIA_SUT as MRIAration
 from mria_new_SUT_min_X import MRIA_SUT as MRIAminx
 from mria_new_SUT_base_ration_inverse import MRIA_SUT as MRIAratdemand
+from mria_new_SUT_lexicographic import MRIA_SUT as MRIAlex
+from presolve import SUTPresolve
 
-def mria_run(DATA, op_factor, all_disimp, imp_flex, disr_dict_sup, disr_dict_dem, distance_dict, solvername):
-
+def mria_baseline(DATA, solvername, PRESOLVE=None, scaling=False):
 
     """ RUN MRIA base model - Objective: To correct minor inaccuracies in the model """
     MRIA_RUN1 = MRIAnew(DATA.name, DATA.countries, DATA.sectors, DATA.products)
     MRIA_RUN1.create_sets()
     MRIA_RUN1.create_alias()
     MRIA_RUN1.baseline_data(DATA)
+    if PRESOLVE is not None:
+        PRESOLVE.fix_empty(MRIA_RUN1)
 
-    MRIA_RUN1.run_basemodel(solvername)
+    MRIA_RUN1.run_basemodel(solvername, scaling)
     new_Xbase = MRIA_RUN1.X.get_values()
+
+    return MRIA_RUN1, new_Xbase
+
+def mria_run(DATA, op_factor, all_disimp, imp_flex, disr_dict_sup, disr_dict_dem, distance_dict, solvername, presolve=False, scaling=False, lexicographic=False, new_Xbase=None, inverse=True):
+
+    """ Presolve - Objective: To build the models only on the structurally non-empty sectors, products and regions """
+    PRESOLVE = None
+    if presolve:
+        PRESOLVE = SUTPresolve(DATA)
+        DATA = PRESOLVE.reduce()
+        disr_dict_sup = PRESOLVE.restrict(disr_dict_sup, 'RS')
+        disr_dict_dem = PRESOLVE.restrict(disr_dict_dem, 'RP')
+        distance_dict = PRESOLVE.restrict(distance_dict, 'RR')
+        if new_Xbase is not None:
+            new_Xbase = PRESOLVE.restrict(new_Xbase, 'RS')
+
+
+    # RUN MRIA base model - skipped when the corrected baseline of an earlier run is passed as new_Xbase
+    if new_Xbase is None:
+        MRIA_RUN1, new_Xbase = mria_baseline(DATA, solvername, PRESOLVE, scaling)
+    else:
+        MRIA_RUN1 = None
+
     num_thres = [10**-30,10**-12, 10**-11, 10**-10, 10**-9, 10**-8 , 10**-7, 10**-6 , 0.0001, 0.001, 0.01 , 0.1, 1]
 
     solution = 'infeasible'
     itr = 0
 
     while solution != 'optimal' and itr < len(num_thres):
+
+        if lexicographic:
+
+            """ RUN MRIA lexicographic model - Objective: To minimise rationing, then supply, on a single model """
+            # MRIA_RUN2 and MRIA_RUN3 refer to the same model, which holds the minimise supply solution
+            MRIA_RUN2 = MRIAlex(DATA.name, DATA.countries, DATA.sectors, DATA.products)
+            MRIA_RUN2.create_sets()
+            MRIA_RUN2.create_alias()
+            MRIA_RUN2.baseline_data(DATA, new_Xbase)
+            MRIA_RUN2.create_disaster_data(disr_dict_sup, disr_dict_dem, op_factor, all_disimp, imp_flex, distance_dict, num_thres[itr])
+            if PRESOLVE is not None:
+                PRESOLVE.fix_empty(MRIA_RUN2)
+            MRIA_RUN2.run_impactmodel(solvername, scaling)
+
+            MRIA_RUN3 = MRIA_RUN2
+            new_rat = MRIA_RUN3.Ddis.get_values()
+
+            solution = MRIA_RUN3.termination_condition
+            itr += 1
+            continue
         
         """ RUN MRIA ration model - Objective: To minimise rationing """
         MRIA_RUN2 = MRIAration(DATA.name, DATA.countries, DATA.sectors, DATA.products)
@@ -29,9 +75,21 @@ def mria_run(DATA, op_factor, all_disimp, imp_flex, disr_dict_sup, disr_dict_dem
         MRIA_RUN2.create_alias()
         MRIA_RUN2.baseline_data(DATA, new_Xbase)
         MRIA_RUN2.create_disaster_data(disr_dict_sup, disr_dict_dem, op_factor, all_disimp,imp_flex, distance_dict, num_thres[itr])
-        MRIA_RUN2.run_impactmodel(solvername)
+        if PRESOLVE is not None:
+            PRESOLVE.fix_empty(MRIA_RUN2)
+        MRIA_RUN2.run_impactmodel(solvername, scaling)
 
         new_rat = MRIA_RUN2.Ddis.get_values()
+
+        # Without an optimal rationing there is nothing to pass on (a solver may not have loaded a solution)
+        if MRIA_RUN2.termination_condition != 'optimal':
+            MRIA_RUN3 = MRIA_RUN2
+            MRIA_RUN3.num_thres = num_thres[itr]
+            MRIA_RUN3.obj_value = None
+            solution = MRIA_RUN3.termination_condition
+            itr += 1
+            continue
+
         new_Xin = MRIA_RUN2.Xdis.get_values()
         new_imp = MRIA_RUN2.disimp.get_values()
 
@@ -41,20 +99,24 @@ def mria_run(DATA, op_factor, all_disimp, imp_flex, disr_dict_sup, disr_dict_dem
         MRIA_RUN3.create_alias()
         MRIA_RUN3.baseline_data(DATA, new_Xbase)
         MRIA_RUN3.create_disaster_data(disr_dict_sup, disr_dict_dem, op_factor, all_disimp, imp_flex, distance_dict, new_rat, new_Xin, new_imp, num_thres[itr])
-        MRIA_RUN3.run_impactmodel(solvername)
+        if PRESOLVE is not None:
+            PRESOLVE.fix_empty(MRIA_RUN3)
+        MRIA_RUN3.run_impactmodel(solvername, scaling)
 
         solution = MRIA_RUN3.termination_condition
         itr += 1
 
 
     # MRIA RUN to determine X to satisfy rationing
+    if not inverse:
+        return MRIA_RUN1, MRIA_RUN2, MRIA_RUN3, None
+
     MRIA_RUN5 = MRIAratdemand(DATA.name, DATA.countries, DATA.sectors, DATA.products)
     MRIA_RUN5.create_sets()
     MRIA_RUN5.create_alias()
     MRIA_RUN5.baseline_data(DATA, new_rat)
-    MRIA_RUN5.run_basemodel(solvername)
+    if PRESOLVE is not None:
+        PRESOLVE.fix_empty(MRIA_RUN5)
+    MRIA_RUN5.run_basemodel(solvername, scaling)
     
     return MRIA_RUN1, MRIA_RUN2, MRIA_RUN3, MRIA_RUN5
-
-
-
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Numerical scaling of the MRIA stage models.
+
+The supply-demand balance (demSup) mixes sectors with outputs many orders of magnitude
+apart, which is what makes the interior point solves stall and fail the num_thres ladder.
+Before solving, every variable is column-scaled by the baseline magnitude of the quantity
+it represents and every demSup row is row-scaled by the baseline size of its product
+market, so that the scaled variables and coefficients are of order one:
+
+    - X[R,S], Xdis[R,S]      by 1 / Xbase[R,S]
+    - Ddis[R,P]              by 1 / market[R,P]
+    - disimp[Rb,R,P]         by 1 / market[R,P]
+    - demSup[R,P]            by 1 / market[R,P]
+
+with market[R,P] = sum_S Sup[R,S,P] * Xbase[R,S] + fd[R,P] + ExpROW[R,P].
+
+The scaled model is created with Pyomo's core.scale_model transformation and its
+solution is propagated back to the original (unscaled) model after the solve.
+"""
+from pyomo.environ import Suffix, TransformationFactory, Var
+from pyomo.opt import TerminationCondition
+
+
+def _factor(magnitude, floor):
+
+    magnitude = abs(magnitude)
+    if magnitude <= floor:
+        return 1.0
+    return 1.0 / magnitude
+
+
+def set_scaling_factors(MRIA_RUN, floor=10**-9):
+    """
+    Attach the scaling_factor suffix to a built stage model.
+
+    Parameters
+        - MRIA_RUN - **MRIA_SUT** class object after the constraints have been created
+        - floor - magnitudes at or below this value are left unscaled
+    """
+    model = MRIA_RUN.m
+
+    if model.component('scaling_factor') is not None:
+        model.del_component('scaling_factor')
+    model.scaling_factor = Suffix(direction=Suffix.EXPORT)
+
+    data = MRIA_RUN.data
+    sizes = data.market()
+    market = {}
+    for R in model.R:
+        for P in model.P:
+            market[R, P] = sizes[data.r[R], data.p[P]]
+
+    for var in model.component_objects(Var, active=True):
+        name = var.local_name
+        for index in var:
+            if name in ('X', 'Xdis'):
+                model.scaling_factor[var[index]] = _factor(MRIA_RUN.Xbase[index], floor)
+            elif name == 'Ddis':
+                model.scaling_factor[var[index]] = _factor(market[index], floor)
+            elif name == 'disimp':
+                Rb, R, P = index
+                model.scaling_factor[var[index]] = _factor(market[R, P], floor)
+
+    for index in model.demSup:
+        model.scaling_factor[model.demSup[index]] = _factor(market[index], floor)
+
+
+def scaled_solve(model, solver, scaling, **kwargs):
+    """
+    Solve a model, optionally through its scaled counterpart.
+
+    Parameters
+        - model - Pyomo model, with a scaling_factor suffix if *scaling* is True
+        - solver - Pyomo solver object
+        - scaling - solve the scaled model and unscale the solution
+        - kwargs - passed on to solver.solve()
+
+    With load_solutions=False (solvers that raise when they cannot load a solution, e.g. appsi
+    HiGHS on an infeasible model) the solution is loaded here, and only if it is optimal; the
+    results are returned with their termination condition either way.
+
+    Outputs
+        - the solver results object
+    """
+    target = model
+    if scaling:
+        transformation = TransformationFactory('core.scale_model')
+        target = transformation.create_using(model)
+
+    results = solver.solve(target, **kwargs)
+    termination = results.solver.termination_condition
+
+    loaded = kwargs.get('load_solutions', True)
+    if not loaded and termination == TerminationCondition.optimal:
+        target.solutions.load_from(results)
+        loaded = True
+
+    if scaling and loaded and termination in (TerminationCondition.optimal,
+                                              TerminationCondition.locallyOptimal,
+                                              TerminationCondition.feasible):
+        transformation.propagate_solution(target, model)
+
+    return results
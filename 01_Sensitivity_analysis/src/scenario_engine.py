@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Scenario engine to run many disruption scenarios through the MRIA pipeline.
+
+The corrected baseline (stage 1) does not depend on the disruption, so it is solved once and
+shared by all scenarios. Each scenario then runs the minimise rationing / minimise supply
+stages with its own disruption and parameters, and only a compact record of arrays is kept:
+
+    - status, num_thres and objective of the final stage, and the solver backends that solved
+      the minimise rationing and the final stage (see solver_dispatch.py)
+    - Xdis (R, S) and Ddis (R, P) on the full index sets, in DATA order
+    - disimp (R, R, P) if requested
+
+Scenarios are dictionaries with a 'key' and any of 'disr_dict_sup', 'disr_dict_dem',
+'op_factor', 'imp_flex' and 'all_disimp' (op_factor and imp_flex can be a single value or a
+dictionary per region-sector pair / trade link, see the MRIA models).
+
+With batch_size > 1, scenarios are solved batch_size at a time as one block-diagonal model
+(see batch_solve.py); scenarios that fail in a batch are run on their own through mria_run.
+With template=True, every worker builds the stage model once and only patches its bounds for
+each scenario (see lp_template.py).
+
+The stage models of a scenario are torn down as soon as its record is extracted (teardown), so
+that no Pyomo model outlives its scenario; stream() yields the records of a sweep one by one,
+with their metrics, and keeps the memory of long sweeps flat.
+"""
+import gc
+import itertools
+import multiprocessing
+import traceback
+
+from batch_solve import BlockBatch
+from lp_template import LPTemplate
+from model_data import values_to_array
+from presolve import full_values
+from run_mria import mria_baseline, mria_run
+
+
+def extract_result(MRIA_RUN, DATA, disimp=False):
+    """
+    Compact record of a solved disaster stage model.
+    """
+    record = {'status': str(MRIA_RUN.termination_condition),
+              'num_thres': MRIA_RUN.num_thres,
+              'objective': MRIA_RUN.obj_value,
+              'backend': getattr(MRIA_RUN, 'backend', None),
+              'ration_backend': getattr(MRIA_RUN, 'ration_backend', getattr(MRIA_RUN, 'backend', None)),
+              'Xdis': values_to_array(full_values(MRIA_RUN, 'Xdis'), DATA.countries, DATA.sectors),
+              'Ddis': values_to_array(full_values(MRIA_RUN, 'Ddis'), DATA.countries, DATA.products)}
+
+    if disimp:
+        record['disimp'] = values_to_array(full_values(MRIA_RUN, 'disimp'), DATA.countries, DATA.countries, DATA.products)
+
+    return record
+
+
+def record_metrics(record, xbase):
+    """
+    Scalar metrics of a record: total rationing, and the output loss against the baseline
+    (R, S array) in absolute terms and as a share of total output.
+    """
+    loss = float((xbase - record['Xdis']).sum())
+    return {'rationing': float(record['Ddis'].sum()),
+            'output_loss': loss,
+            'output_loss_share': loss / max(float(xbase.sum()), 10**-12)}
+
+
+def teardown(*MRIA_RUNS):
+    """
+    Release stage models once their records are extracted. All components of each model are
+    deleted and the references of the stage object (model, solver handle, data) are dropped,
+    which breaks the reference cycles between the components, their rules and the stage object,
+    so that the memory is freed at once and not at some later cyclic garbage collection.
+    """
+    for MRIA_RUN in MRIA_RUNS:
+        if MRIA_RUN is None:
+            continue
+        model = getattr(MRIA_RUN, 'm', None)
+        if model is not None:
+            for name in [c.local_name for c in model.component_objects(descend_into=False)]:
+                model.del_component(name)
+        MRIA_RUN.__dict__.clear()
+
+
+def run_scenario(DATA, new_Xbase, distance_dict, solvername, scenario, options):
+    """
+    Run a single scenario against a cached baseline and return its record.
+    """
+    options = dict(options)
+    disimp = options.pop('disimp', False)
+
+    MRIA_RUN1, MRIA_RUN2, MRIA_RUN3, MRIA_RUN5 = mria_run(DATA,
+                                                          scenario.get('op_factor', 1),
+                                                          scenario.get('all_disimp', 1),
+                                                          scenario.get('imp_flex', 0),
+                                                          scenario.get('disr_dict_sup', {}),
+                                                          scenario.get('disr_dict_dem', {}),
+                                                          distance_dict, solvername,
+                                                          new_Xbase=new_Xbase, inverse=False, **options)
+
+    try:
+        record = extract_result(MRIA_RUN3, DATA, disimp)
+        record['key'] = scenario.get('key')
+        if MRIA_RUN2 is not MRIA_RUN3:
+            record['ration_backend'] = MRIA_RUN2.backend
+    finally:
+        teardown(MRIA_RUN1, MRIA_RUN2, MRIA_RUN3, MRIA_RUN5)
+    return record
+
+
+"""
+Worker processes keep the table and the baseline from their initializer, so that only the
+scenario itself is sent with each task.
+"""
+
+_WORKER = {}
+
+
+def _init_worker(DATA, new_Xbase, distance_dict, solvername, options):
+
+    _WORKER['args'] = (DATA, new_Xbase, distance_dict, solvername)
+    _WORKER['options'] = options
+    _WORKER['batch'] = None
+    _WORKER['template'] = None
+
+
+def _run_task(scenario):
+
+    DATA, new_Xbase, distance_dict, solvername = _WORKER['args']
+    try:
+        return run_scenario(DATA, new_Xbase, distance_dict, solvername, scenario, _WORKER['options'])
+    except Exception:
+        return {'key': scenario.get('key'), 'status': 'error', 'error': traceback.format_exc()}
+
+
+def run_batch(DATA, new_Xbase, distance_dict, solvername, batch, scenarios, options):
+    """
+    Run a list of scenarios as one block-diagonal model and return their records.
+    """
+    options = dict(options)
+    disimp = options.pop('disimp', False)
+
+    records = []
+    for scenario, MRIA_RUN in batch.solve(scenarios):
+        if MRIA_RUN is None:
+            records.append(run_scenario(DATA, new_Xbase, distance_dict, solvername, scenario,
+                                        dict(options, disimp=disimp)))
+            continue
+        try:
+            record = extract_result(MRIA_RUN, DATA, disimp)
+            record['key'] = scenario.get('key')
+        finally:
+            teardown(MRIA_RUN)
+        records.append(record)
+    return records
+
+
+def _run_batch_task(scenarios):
+
+    DATA, new_Xbase, distance_dict, solvername = _WORKER['args']
+    options = _WORKER['options']
+    try:
+        if _WORKER['batch'] is None:
+            _WORKER['batch'] = BlockBatch(DATA, new_Xbase, distance_dict, solvername,
+                                          presolve=options.get('presolve', False),
+                                          scaling=options.get('scaling', False))
+        return run_batch(DATA, new_Xbase, distance_dict, solvername, _WORKER['batch'], scenarios, options)
+    except Exception:
+        error = traceback.format_exc()
+        return [{'key': scenario.get('key'), 'status': 'error', 'error': error} for scenario in scenarios]
+
+
+def _run_template_task(scenario):
+
+    DATA, new_Xbase, distance_dict, solvername = _WORKER['args']
+    options = _WORKER['options']
+    try:
+        if _WORKER['template'] is None:
+            _WORKER['template'] = LPTemplate(DATA, new_Xbase, distance_dict, solvername,
+                                             presolve=options.get('presolve', False))
+        record = extract_result(_WORKER['template'].solve(scenario), DATA, options.get('disimp', False))
+        record['key'] = scenario.get('key')
+        return record
+    except Exception:
+        return {'key': scenario.get('key'), 'status': 'error', 'error': traceback.format_exc()}
+
+
+def _chunks(scenarios, size):
+
+    scenarios = iter(scenarios)
+    while True:
+        chunk = list(itertools.islice(scenarios, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ScenarioEngine(object):
+    """
+    Runs scenarios against one cached baseline, in this process or in a pool of workers.
+
+    Parameters
+        - DATA - the **sut_basic** class object
+        - distance_dict - distance dictionary of the disaster imports
+        - solvername - solver to use
+        - new_Xbase - corrected baseline; solved here if None
+        - processes - number of worker processes (1 runs in this process)
+        - batch_size - number of scenarios solved together as one block-diagonal model
+        - template - solve every scenario on a persistent model of the worker by patching its bounds
+        - maxtasksperchild - number of tasks after which a worker process is replaced (None keeps them)
+        - options - passed on to mria_run (presolve, scaling, lexicographic) and disimp=True
+          to keep the disaster imports in the records
+    """
+
+    def __init__(self, DATA, distance_dict, solvername, new_Xbase=None, processes=1, batch_size=1, template=False,
+                 maxtasksperchild=None, **options):
+
+        self.DATA = DATA
+        self.distance_dict = distance_dict
+        self.solvername = solvername
+        self.processes = processes
+        self.batch_size = batch_size
+        self.template = template
+        self.maxtasksperchild = maxtasksperchild
+        self.options = options
+
+        if new_Xbase is None:
+            MRIA_RUN1, new_Xbase = mria_baseline(DATA, solvername, scaling=options.get('scaling', False))
+            del MRIA_RUN1
+        self.new_Xbase = new_Xbase
+        self.pool = None
+
+    def __enter__(self):
+        """
+        Keep one pool of workers open for all calls of imap() within the with block.
+        """
+        if self.processes != 1:
+            self.pool = self._pool()
+        return self
+
+    def __exit__(self, *exc):
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _initargs(self):
+
+        return (self.DATA, self.new_Xbase, self.distance_dict, self.solvername, self.options)
+
+    def _pool(self):
+
+        return multiprocessing.Pool(self.processes, initializer=_init_worker, initargs=self._initargs(),
+                                    maxtasksperchild=self.maxtasksperchild)
+
+    def run(self, scenario):
+        """
+        Run a single scenario in this process.
+        """
+        return run_scenario(self.DATA, self.new_Xbase, self.distance_dict, self.solvername, scenario, self.options)
+
+    def imap(self, scenarios, chunksize=1):
+        """
+        Generator of scenario records, in order of completion. Failed scenarios give a record with
+        status 'error' and the traceback instead of stopping the sweep.
+        """
+        if self.template:
+            task = _run_template_task
+        elif self.batch_size > 1:
+            task, scenarios = _run_batch_task, _chunks(scenarios, self.batch_size)
+        else:
+            task = _run_task
+        batched = task is _run_batch_task
+
+        if self.processes == 1:
+            # keep the worker state (and its batch or template model) between calls
+            if _WORKER.get('owner') != id(self):
+                _init_worker(*self._initargs())
+                _WORKER['owner'] = id(self)
+            results = map(task, scenarios)
+
+        elif self.pool is not None:
+            results = self.pool.imap_unordered(task, scenarios, chunksize)
+
+        else:
+            with self._pool() as pool:
+                for result in pool.imap_unordered(task, scenarios, chunksize):
+                    for record in (result if batched else [result]):
+                        yield record
+            return
+
+        for result in results:
+            for record in (result if batched else [result]):
+                yield record
+
+    def stream(self, scenarios, chunksize=1, store=None, collect_every=1):
+        """
+        Generator of one compact record per scenario (see imap), with the metrics of
+        record_metrics added to the records solved to optimality. The stage models of a scenario
+        are torn down as soon as its record is extracted, and a garbage collection runs every
+        *collect_every* records, so that the memory of a long sweep stays flat. Records are also
+        added to *store* (a **ResultStore**) under their key if given; every scenario then needs
+        a key, and records of scenarios that failed with an error are not stored, so that they
+        are run again.
+        """
+        xbase = values_to_array(self.new_Xbase, self.DATA.countries, self.DATA.sectors)
+
+        for n, record in enumerate(self.imap(scenarios, chunksize), 1):
+            # non-optimal records have zero-filled Xdis and Ddis
+            if record.get('status') == 'optimal':
+                record.update(record_metrics(record, xbase))
+            if store is not None:
+                if record['key'] is None:
+                    raise ValueError('Scenarios need a key to be stored')
+                if record.get('status') != 'error':
+                    store.put(record['key'], record)
+            yield record
+
+            if collect_every and n % collect_every == 0:
+                gc.collect()
+
+    def run_all(self, scenarios, chunksize=1):
+        """
+        Dictionary {key: record} of all scenarios.
+        """
+        return {record['key']: record for record in self.imap(scenarios, chunksize)}
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Solver dispatch with seat limits for licensed backends.
+
+MOSEK and GAMS licenses have a limited number of seats. When a parallel sweep starts more
+solves than there are seats, the solves beyond the limit fail with license errors. Every stage
+model therefore solves through this module, which
+
+    - holds a seat of the licensed backend for the duration of a solve; seats are lock files
+      (one per seat) in a directory shared by all processes, locked with the file locks of
+      the operating system, so a seat is given back even when a process dies
+    - waits up to *wait* seconds for a free seat (None waits as long as it takes), and then
+      solves with the open-source *fallback* backend (HiGHS) instead; without a fallback the
+      solve waits for a seat
+    - solves with the fallback as well when the licensed backend fails with an error
+      (e.g. a license checked out by others)
+    - returns the backend that produced the result, which the stage models keep (backend, and
+      ration_backend for the minimise rationing solve of the lexicographic stage)
+    - raises on unknown solver names
+    - counts the solves, their wall time and (where the solver interface exposes them) their
+      iterations in *stats*, e.g. for benchmark.py
+
+The default dispatch (default_dispatch) is configured from the environment when it is first
+used, not on import:
+
+    MRIA_SOLVER_SEATS       seats per backend, e.g. 'mosek=4,gams=2' (backends not listed are unlimited)
+    MRIA_LICENSE_DIR        directory of the seat files (default: mria_seats in the temp directory);
+                            to count seats over several machines it must be on shared storage
+                            with working file locks
+    MRIA_SOLVER_FALLBACK    fallback backend (default 'highs', empty for none)
+    MRIA_SEAT_WAIT          seconds to wait for a seat before falling back (default 0)
+
+or with configure().
+"""
+import os
+import tempfile
+import time
+import warnings
+
+from pyomo.opt import SolverFactory
+
+from scaling import scaled_solve
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+"""
+Backends: Pyomo solver name, whether seats are limited by a license, and whether solver options
+are passed on (options are specific to a backend and only passed when it is the one requested).
+"""
+
+BACKENDS = {
+    'mosek': {'factory': 'mosek', 'licensed': True, 'options': True},
+    'gams': {'factory': 'gams', 'licensed': True, 'options': False,
+             'kwargs': {'keepfiles': True,
+                        'io_options': {'solver': 'conopt', 'add_options':['GAMS_MODEL.OptFile = 1;']},
+                        'tmpdir': 'C:/Users/sva100/GAMStemp'}},
+    # the solution is loaded by scaled_solve, so that a non-optimal solve returns its status instead of raising
+    'highs': {'factory': 'appsi_highs', 'licensed': False, 'options': True, 'kwargs': {'load_solutions': False}},
+}
+
+
+def _try_lock(handle):
+
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(handle):
+
+    if fcntl is not None:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    else:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class Seat(object):
+    """
+    A seat of a backend, held until release() (also usable as a context manager). Seats of
+    backends without a limit hold no file.
+    """
+
+    def __init__(self, backend, handle=None):
+
+        self.backend = backend
+        self.handle = handle
+
+    def release(self):
+
+        if self.handle is not None:
+            _unlock(self.handle)
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc):
+
+        self.release()
+
+
+class SolverDispatch(object):
+    """
+    Parameters
+        - seats - dictionary {backend: maximum number of concurrent solves}
+        - lock_dir - directory of the seat files
+        - fallback - backend used when no seat is free, or None
+        - wait - seconds to wait for a seat before falling back (None waits without limit)
+        - poll - seconds between attempts to get a seat
+        - options - dictionary {backend: solver options} added to the options of every solve
+          with that backend
+    """
+
+    def __init__(self, seats=None, lock_dir=None, fallback='highs', wait=0, poll=1, options=None):
+
+        self.seats = dict(seats or {})
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'mria_seats')
+        self.fallback = fallback or None
+        self.wait = wait
+        self.poll = poll
+        self.options = dict(options or {})
+        self.stats = {'solves': 0, 'solve_time': 0.0, 'iterations': 0, 'unknown_iterations': 0}
+
+        if self.fallback is not None and self.fallback not in BACKENDS:
+            raise ValueError('Unknown fallback solver: {}'.format(self.fallback))
+        os.makedirs(self.lock_dir, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls):
+
+        seats = {}
+        for item in os.environ.get('MRIA_SOLVER_SEATS', '').split(','):
+            if item.strip():
+                backend, n = item.split('=')
+                seats[backend.strip()] = int(n)
+        wait = os.environ.get('MRIA_SEAT_WAIT', '0')
+        return cls(seats, os.environ.get('MRIA_LICENSE_DIR'), os.environ.get('MRIA_SOLVER_FALLBACK', 'highs'),
+                   None if wait.lower() == 'none' else float(wait))
+
+    def acquire(self, backend, wait=0):
+        """
+        Take a seat of a backend, waiting up to *wait* seconds (None without limit).
+
+        Outputs
+            - **Seat**, or None if no seat became free in time
+        """
+        n = self.seats.get(backend)
+        if n is None:
+            return Seat(backend)
+
+        deadline = None if wait is None else time.monotonic() + wait
+        while True:
+            for k in range(n):
+                handle = open(os.path.join(self.lock_dir, '{}.{}.lock'.format(backend, k)), 'a+')
+                if _try_lock(handle):
+                    return Seat(backend, handle)
+                handle.close()
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll)
+
+    def checkout(self, solvername):
+        """
+        Seat for a solve with *solvername*: of that backend if one is free within the waiting
+        time, otherwise of the fallback backend (or of that backend once one is free, if
+        there is no fallback).
+        """
+        if solvername not in BACKENDS:
+            raise ValueError('Unknown solver: {}'.format(solvername))
+
+        seat = self.acquire(solvername, self.wait)
+        if seat is None:
+            if self.fallback is None or self.fallback == solvername:
+                seat = self.acquire(solvername, None)
+            else:
+                seat = self.acquire(self.fallback, None)
+        return seat
+
+    def _solve(self, model, backend, solvername, scaling, options, tee):
+
+        spec = BACKENDS[backend]
+        kwargs = dict(spec.get('kwargs', {}))
+        if spec['options']:
+            options = dict(options or {}) if backend == solvername else {}
+            options.update(self.options.get(backend, {}))
+            if options:
+                kwargs['options'] = options
+
+        solver = SolverFactory(spec['factory'])
+        start = time.perf_counter()
+        results = scaled_solve(model, solver, scaling, tee=tee, **kwargs)
+        self.count(solver, start)
+        return results
+
+    def count(self, solver, start):
+        """
+        Add a solve that started at *start* (time.perf_counter) to the statistics.
+        """
+        self.stats['solve_time'] += time.perf_counter() - start
+        self.stats['solves'] += 1
+        n = iterations(solver)
+        if n is None:
+            self.stats['unknown_iterations'] += 1
+        else:
+            self.stats['iterations'] += n
+
+    def solve(self, model, solvername, scaling=False, options=None, tee=True):
+        """
+        Solve a model (see scaling.scaled_solve) within the seat limits.
+
+        Outputs
+            - the solver results object and the backend that produced it
+        """
+        with self.checkout(solvername) as seat:
+            backend = seat.backend
+            try:
+                return self._solve(model, backend, solvername, scaling, options, tee), backend
+            except Exception as error:
+                if not BACKENDS[backend]['licensed'] or self.fallback is None or self.fallback == backend:
+                    raise
+                warnings.warn('{} failed ({}), solving with {}'.format(backend, error, self.fallback))
+
+        with self.acquire(self.fallback, None) as seat:
+            return self._solve(model, self.fallback, solvername, scaling, options, tee), self.fallback
+
+
+def iterations(solver):
+    """
+    Iterations of the last solve of a Pyomo solver object, for the interfaces that keep the
+    native solver model (mosek direct and persistent, appsi HiGHS); None for the others.
+    """
+    native = getattr(solver, '_solver_model', None)
+    try:
+        if hasattr(native, 'getInfo'):
+            info = native.getInfo()
+            return info.simplex_iteration_count + info.ipm_iteration_count + info.crossover_iteration_count
+        if hasattr(native, 'getintinf'):
+            import mosek
+            return sum(native.getintinf(item) for item in (mosek.iinfitem.intpnt_iter,
+                                                           mosek.iinfitem.sim_primal_iter,
+                                                           mosek.iinfitem.sim_dual_iter))
+    except Exception:
+        pass
+    return None
+
+
+def available_backends():
+    """
+    Backends whose solver is installed (and licensed) on this machine.
+    """
+    return [backend for backend, spec in BACKENDS.items()
+            if SolverFactory(spec['factory']).available(exception_flag=False)]
+
+
+DISPATCH = None
+
+
+def default_dispatch():
+    """
+    The default dispatch, configured from the environment on first use.
+    """
+    global DISPATCH
+    if DISPATCH is None:
+        DISPATCH = SolverDispatch.from_environment()
+    return DISPATCH
+
+
+def configure(**kwargs):
+    """
+    Replace the default dispatch, see **SolverDispatch** for the arguments.
+    """
+    global DISPATCH
+    DISPATCH = SolverDispatch(**kwargs)
+    return DISPATCH
+
+
+def solve_model(model, solvername, scaling=False, options=None, tee=True):
+    """
+    Solve a model with the default dispatch, see SolverDispatch.solve.
+    """
+    return default_dispatch().solve(model, solvername, scaling, options, tee)
+
+
+def acquire_seat(backend):
+    """
+    Seat of a backend from the default dispatch for a solver instance that is kept over several
+    solves (persistent solvers), or None if no seat became free within the waiting time.
+    """
+    dispatch = default_dispatch()
+    return dispatch.acquire(backend, dispatch.wait)
+
+
+def timed_solve(solver, backend='mosek', **kwargs):
+    """
+    Solve with a solver object of *backend* held outside the dispatch (persistent solvers),
+    with the options of the default dispatch for that backend added, as for every other solve,
+    and counted in its statistics.
+    """
+    dispatch = default_dispatch()
+    options = dict(kwargs.pop('options', None) or {})
+    options.update(dispatch.options.get(backend, {}))
+    if options:
+        kwargs['options'] = options
+
+    start = time.perf_counter()
+    results = solver.solve(**kwargs)
+    dispatch.count(solver, start)
+    return results
\ No newline at end of file
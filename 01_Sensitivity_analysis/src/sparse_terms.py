@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Nonzero coefficient lists for the product supply and demand expressions.
+
+The supply and use tables are sparse, but a demSup row summed Use[R,P,Rb,Sb] * X[Rb,Sb] over
+all R*S pairs, zero coefficients included. The nonzero coefficients of every region-product
+row are kept in compressed rows by the model data (model_data.py), and each row is built with
+quicksum from its own terms, so that building the constraints scales with the number of
+nonzeros.
+"""
+from pyomo.environ import quicksum
+
+
+def nonzero_use(MRIA_RUN):
+    """
+    Nonzero Use coefficients of a model per demand row, as **SparseRows** with column keys (Rb, Sb).
+    """
+    return MRIA_RUN.data.use_rows
+
+
+def nonzero_sup(MRIA_RUN):
+    """
+    Nonzero Sup coefficients of a model per supply row, as **SparseRows** with column keys Sb.
+    """
+    return MRIA_RUN.data.sup_rows
+
+
+def use_sum(terms, X, R, P):
+    """
+    sum_Rb,Sb Use[R,P,Rb,Sb] * X[Rb,Sb] over the nonzero terms.
+    """
+    return quicksum((coef * X[key] for key, coef in terms.terms((R, P))))
+
+
+def sup_sum(terms, X, R, P):
+    """
+    sum_Sb X[R,Sb] * Sup[R,Sb,P] over the nonzero terms.
+    """
+    return quicksum((coef * X[R, Sb] for Sb, coef in terms.terms((R, P))))
\ No newline at end of file
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Assignment of assets (industrial sites, substations, sector shapes) to NUTS2 regions.
+
+Point-in-polygon tests are done with the spatial index (STRtree) of the NUTS2 boundaries, for
+all assets in one bulk query. The result is reduced to a plain table per asset layer
+
+    asset, sector, weight, NUTS_ID, x, y (representative point, in the CRS of nl_nuts.shp)
+
+which is cached as Parquet, keyed by the hashes of the asset and the NUTS2 files. Repeated
+scenario runs read the table and never touch the geometries again; hazard sampling only
+needs the coordinates.
+"""
+import hashlib
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+
+CACHE_VERSION = 1
+
+SIDECARS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def file_hash(path):
+    """
+    SHA-256 of a file, including the sidecar files of a shapefile.
+    """
+    base, ext = os.path.splitext(path)
+    files = [base + e for e in SIDECARS if os.path.exists(base + e)] if ext.lower() == '.shp' else [path]
+
+    digest = hashlib.sha256()
+    for name in files:
+        with open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def assign_regions(assets, nl_nuts, region_column='NUTS_ID'):
+    """
+    NUTS2 region of every asset, using the spatial index of the regions.
+
+    Polygons and lines are represented by a point inside them. Assets outside all regions
+    get no region (NaN).
+
+    Outputs
+        - Series of region names, aligned with assets
+        - GeoSeries of the representative points, in the CRS of nl_nuts
+    """
+    points = assets.geometry.representative_point().to_crs(nl_nuts.crs)
+
+    point_idx, region_idx = nl_nuts.sindex.query(points.values, predicate='within')
+
+    # keep the first region of points on a shared boundary
+    first = np.unique(point_idx, return_index=True)[1]
+    regions = np.full(len(points), np.nan, dtype=object)
+    regions[point_idx[first]] = nl_nuts[region_column].to_numpy()[region_idx[first]]
+
+    return pd.Series(regions, index=assets.index), points
+
+
+def asset_table(assets, nl_nuts, sector_column='sector', weight_column=None):
+    """
+    Plain table of the assets in a layer with their sector, weight, region and coordinates.
+    """
+    regions, points = assign_regions(assets, nl_nuts)
+
+    table = pd.DataFrame({'asset': np.arange(len(assets)),
+                          'sector': assets[sector_column].to_numpy(),
+                          'weight': assets[weight_column].to_numpy(dtype=float) if weight_column is not None else 1.0,
+                          'NUTS_ID': regions.to_numpy(),
+                          'x': points.x.to_numpy(),
+                          'y': points.y.to_numpy()})
+    table = table.dropna(subset=['NUTS_ID']).reset_index(drop=True)
+    table.attrs['crs'] = nl_nuts.crs.to_wkt()
+    return table
+
+
+class AssetLookup(object):
+    """
+    Cache of asset tables (see asset_table), as Parquet files in cache_dir.
+
+    Parameters
+        - cache_dir - directory of the cached tables
+        - nuts_file - NUTS2 boundaries (nl_nuts.shp)
+    """
+
+    def __init__(self, cache_dir, nuts_file):
+
+        self.cache_dir = cache_dir
+        self.nuts_file = nuts_file
+        self.nuts_hash = file_hash(nuts_file)
+        self.nl_nuts = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_file(self, asset_file, sector_column, weight_column):
+
+        key = '|'.join([str(CACHE_VERSION), file_hash(asset_file), self.nuts_hash, sector_column, str(weight_column)])
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.parquet')
+
+    def table(self, asset_file, sector_column='sector', weight_column=None):
+        """
+        Asset table of a layer, read from the cache or computed and cached.
+        """
+        cache = self._cache_file(asset_file, sector_column, weight_column)
+        if os.path.exists(cache):
+            table = pd.read_parquet(cache)
+            with open(cache + '.crs') as f:
+                table.attrs['crs'] = f.read()
+            return table
+
+        if self.nl_nuts is None:
+            self.nl_nuts = gpd.read_file(self.nuts_file)
+
+        table = asset_table(gpd.read_file(asset_file), self.nl_nuts, sector_column, weight_column)
+
+        tmp = cache + '.{}.tmp'.format(os.getpid())
+        table.to_parquet(tmp, index=False)
+        with open(cache + '.crs', 'w') as f:
+            f.write(table.attrs['crs'])
+        os.replace(tmp, cache)
+        return table
@@ -1,11 +1,38 @@
 # -*- coding: utf-8 -*-
 """
 Create the economic tables required to run the MRIA model.
+
+The prepared arrays of a table can be exported to a versioned directory of .npy files
+(export_tensors). Other jobs then open the table from that directory with the arrays memory
+mapped read-only (sut_basic.from_tensors), instead of parsing the Excel file, so that all
+jobs on a machine share one copy of the data through the page cache.
 """
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
 import numpy as np
 import pandas as pd
 
 
+TENSOR_VERSION = 1
+TENSORS = ('Use_arr', 'Sup_arr', 'ExpROW_arr')
+
+
+def tensor_dir(path, name, filepath):
+    """
+    Directory of the exported tensors of a table: its name, the export format version and a
+    hash of the source file, so that a changed table or format is never mapped by mistake.
+    """
+    digest = hashlib.sha256(str(TENSOR_VERSION).encode('utf-8'))
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return os.path.join(path, '{}_v{}_{}'.format(name, TENSOR_VERSION, digest.hexdigest()[:16]))
+
+
 class sut_basic(object):
 
 
@@ -56,4 +83,138 @@ class sut_basic(object):
         self.Sup = {r + k: v for r, kv in self.Sup_data.iterrows() for k,v in kv.to_dict().items()}
         self.ValueA = {r + (k,): v for r, kv in self.VA_data.iterrows() for k,v in kv.to_dict().items()}
         self.ImpROW = {r + (k,): v for r, kv in self.ImpROW_data.iterrows() for k,v in kv.to_dict().items()}
-        self.ExpROW = {r + (k,): v for r, kv in self.ExpROW_data.iterrows() for k,v in kv.to_dict().items()}
\ No newline at end of file
+        self.ExpROW = {r + (k,): v for r, kv in self.ExpROW_data.iterrows() for k,v in kv.to_dict().items()}
+
+    def prep_arrays(self):
+
+        try: 
+            self.Use_data is None
+        except:
+            self.load_all_data()
+
+        """
+        Dense numpy views of the tables, ordered as self.countries, self.sectors and self.products
+
+            - Use_arr: (R, P, Rb, S + FD)
+            - Sup_arr: (R, S, Rb, P)
+            - ExpROW_arr: (R, P)
+        """
+        nR, nS, nP = len(self.countries), len(self.sectors), len(self.products)
+        cols = self.sectors + self.FD_cat
+
+        use = self.Use_data.reindex(index=pd.MultiIndex.from_product([self.countries, self.products]),
+                                    columns=pd.MultiIndex.from_product([self.countries, cols]), fill_value=0)
+        sup = self.Sup_data.reindex(index=pd.MultiIndex.from_product([self.countries, self.sectors]),
+                                    columns=pd.MultiIndex.from_product([self.countries, self.products]), fill_value=0)
+        exp = self.ExpROW_data.reindex(index=pd.MultiIndex.from_product([self.countries, self.products]), fill_value=0)
+
+        self.Use_arr = use.fillna(0).to_numpy(dtype=float).reshape(nR, nP, nR, len(cols))
+        self.Sup_arr = sup.fillna(0).to_numpy(dtype=float).reshape(nR, nS, nR, nP)
+        self.ExpROW_arr = exp['Exports'].fillna(0).to_numpy(dtype=float).reshape(nR, nP)
+
+    def export_tensors(self, path):
+        """
+        Write the prepared arrays and the index lists to a versioned directory in *path* (see
+        tensor_dir) and return the directory. The files are written to a temporary directory
+        that is renamed in place, so concurrent exports of the same table are safe; an existing
+        export is kept.
+        """
+        target = tensor_dir(path, self.name, self.file)
+        if os.path.isdir(target):
+            return target
+
+        if not hasattr(self, 'Use_arr'):
+            self.prep_arrays()
+
+        os.makedirs(path, exist_ok=True)
+        tmp = os.path.join(path, '.{}.tmp'.format(uuid.uuid4().hex))
+        os.makedirs(tmp)
+        for name in TENSORS:
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(getattr(self, name), dtype=float))
+
+        index = {'version': TENSOR_VERSION, 'name': self.name, 'file': self.file,
+                 'countries': list(self.countries), 'sectors': list(self.sectors),
+                 'products': list(self.products), 'FD_cat': list(self.FD_cat)}
+        with open(os.path.join(tmp, 'index.json'), 'w') as f:
+            json.dump(index, f)
+
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # exported by another job in the meantime
+            shutil.rmtree(tmp, ignore_errors=True)
+        return target
+
+    def index_lists(self):
+        """
+        The index lists of the table. load_all_data takes them from sets, so their order
+        depends on the hash seed of the process; processes that share results have to agree
+        on one order (set_order).
+        """
+        return {'countries': list(self.countries), 'sectors': list(self.sectors), 'products': list(self.products)}
+
+    def set_order(self, countries, sectors, products):
+        """
+        Put the index lists in the given order (of the same elements); prepared arrays are
+        reordered with them, in memory.
+        """
+        if (set(countries), set(sectors), set(products)) != (set(self.countries), set(self.sectors), set(self.products)):
+            raise ValueError('Index lists do not match the regions, sectors and products of table {}'.format(self.name))
+
+        if hasattr(self, 'Use_arr'):
+            r = [self.countries.index(c) for c in countries]
+            s = [self.sectors.index(c) for c in sectors]
+            p = [self.products.index(c) for c in products]
+            fd = [len(self.sectors) + n for n in range(len(self.FD_cat))]
+            self.Use_arr = self.Use_arr[np.ix_(r, p, r, s + fd)]
+            self.Sup_arr = self.Sup_arr[np.ix_(r, s, r, p)]
+            self.ExpROW_arr = self.ExpROW_arr[np.ix_(r, p)]
+            self.tensor_dir = None
+
+        self.countries, self.sectors, self.products = list(countries), list(sectors), list(products)
+        self.total_countries = len(self.countries)
+        self._model_data = []
+
+    @classmethod
+    def from_tensors(cls, directory, mmap_mode='r'):
+        """
+        Table on the arrays of an export_tensors directory, memory mapped with *mmap_mode*.
+        The table has the index lists and the arrays (Use_arr, Sup_arr, ExpROW_arr) but not
+        the dictionaries of prep_data.
+        """
+        with open(os.path.join(directory, 'index.json')) as f:
+            index = json.load(f)
+        if index['version'] != TENSOR_VERSION:
+            raise ValueError('Tensor export {} has version {}, expected {}'.format(directory, index['version'], TENSOR_VERSION))
+
+        table = cls(index['name'], index['file'], index['countries'])
+        table.sectors = index['sectors']
+        table.products = index['products']
+        table.FD_cat = index['FD_cat']
+        table.tensor_dir = directory
+        table.mmap_mode = mmap_mode
+        table._map_tensors()
+        return table
+
+    def _map_tensors(self):
+
+        for name in TENSORS:
+            setattr(self, name, np.load(os.path.join(self.tensor_dir, name + '.npy'), mmap_mode=self.mmap_mode))
+
+    def __getstate__(self):
+        """
+        Mapped arrays are mapped again when unpickled (e.g. in pool workers) rather than copied,
+        and the cached model data is recomputed.
+        """
+        state = dict(self.__dict__)
+        state.pop('_model_data', None)
+        if getattr(self, 'tensor_dir', None) is not None:
+            for name in TENSORS:
+                state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        if getattr(self, 'tensor_dir', None) is not None:
+            self._map_tensors()
\ No newline at end of file
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Work queue of scenarios for worker processes on several machines.
+
+A sweep is submitted once to a SQLite file on shared storage: the scenarios, and a context
+that every worker needs (corrected baseline, distance dictionary, solver and options of the
+scenario engine). Any number of workers, on one or many machines, then pull scenarios from
+the queue until it is empty:
+
+    - a worker leases a scenario for *lease* seconds; a lease that runs out (the worker died
+      or hangs) makes the scenario available again
+    - a scenario is tried at most *max_attempts* times and then marked failed, with the error
+    - the record of a solved scenario is committed to a **ResultStore** before the scenario is
+      marked done, so a scenario is never lost; at worst it is solved twice
+    - the order of the regions, sectors and products of the table is kept in the context
+      (index), and every worker puts its table in that order, so that the arrays of all records
+      share one order; the index lists are stored with each record as well
+
+Leases are taken in an immediate transaction, so two workers never lease the same scenario.
+SQLite relies on the file locks of the file system: on network file systems without working
+locks, put the queue on a local disk of one machine and run the workers of that machine only.
+
+Submit and run (the workers can be started on any machine that sees both paths):
+
+    queue = WorkQueue('sweep.sqlite')
+    queue.set_context(new_Xbase=new_Xbase, distance_dict=distance_dict, solvername='mosek',
+                      index=DATA.index_lists())
+    queue.add(scenarios)
+
+    python work_queue.py sweep.sqlite results ../data --tensor-path tensors
+
+start_local_workers runs several worker processes on this machine, e.g. to test a sweep.
+"""
+import argparse
+import json
+import os
+import pickle
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+import traceback
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    key TEXT PRIMARY KEY,
+    scenario BLOB NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_until);
+CREATE TABLE IF NOT EXISTS context (
+    name TEXT PRIMARY KEY,
+    value BLOB NOT NULL
+);
+"""
+
+
+def _key(key):
+
+    return json.dumps(key, default=str)
+
+
+def _from_key(text):
+
+    def tuples(value):
+        if isinstance(value, list):
+            return tuple(tuples(v) for v in value)
+        return value
+
+    return tuples(json.loads(text))
+
+
+class WorkQueue(object):
+    """
+    Parameters
+        - path - SQLite file of the queue, created if it does not exist
+        - lease - seconds a leased scenario stays with its worker
+        - max_attempts - number of times a scenario is tried before it is marked failed
+    """
+
+    def __init__(self, path, lease=3600, max_attempts=3, timeout=60):
+
+        self.path = path
+        self.lease_time = lease
+        self.max_attempts = max_attempts
+
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+
+        self.db.close()
+
+    def _transaction(self, statements):
+
+        cursor = self.db.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(cursor)
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        return result
+
+    def set_context(self, **values):
+        """
+        Store the objects shared by all scenarios, e.g. new_Xbase, distance_dict, solvername
+        and the options of the scenario engine.
+        """
+        rows = [(name, pickle.dumps(value)) for name, value in values.items()]
+        self._transaction(lambda c: c.executemany('INSERT OR REPLACE INTO context VALUES (?, ?)', rows))
+
+    def setdefault_context(self, name, value):
+        """
+        Store *value* under *name* unless the context has it already; returns the stored value.
+        """
+        def insert(c):
+            c.execute('INSERT OR IGNORE INTO context VALUES (?, ?)', (name, pickle.dumps(value)))
+            return pickle.loads(c.execute('SELECT value FROM context WHERE name = ?', (name,)).fetchone()[0])
+
+        return self._transaction(insert)
+
+    def context(self):
+
+        return {name: pickle.loads(value) for name, value in self.db.execute('SELECT name, value FROM context')}
+
+    def add(self, scenarios):
+        """
+        Add scenarios (dictionaries with a 'key'); keys already in the queue are skipped.
+        Returns the number of scenarios added.
+        """
+        now = time.time()
+        rows = [(_key(scenario['key']), pickle.dumps(scenario), now) for scenario in scenarios]
+
+        def insert(c):
+            before = c.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            c.executemany('INSERT OR IGNORE INTO tasks (key, scenario, updated) VALUES (?, ?, ?)', rows)
+            return c.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - before
+
+        return self._transaction(insert)
+
+    def lease(self, worker, n=1):
+        """
+        Lease up to *n* scenarios to *worker*: pending ones, or ones whose lease ran out.
+
+        Outputs
+            - list of scenarios
+        """
+        now = time.time()
+
+        def take(c):
+            # leases that ran out after the last attempt
+            c.execute("UPDATE tasks SET state = 'failed', error = 'lease expired', updated = ? "
+                      "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                      (now, now, self.max_attempts))
+            rows = c.execute("SELECT key, scenario FROM tasks WHERE state = 'pending' "
+                             "OR (state = 'leased' AND lease_until < ?) ORDER BY rowid LIMIT ?",
+                             (now, n)).fetchall()
+            c.executemany("UPDATE tasks SET state = 'leased', attempts = attempts + 1, worker = ?, "
+                          "lease_until = ?, updated = ? WHERE key = ?",
+                          [(worker, now + self.lease_time, now, key) for key, scenario in rows])
+            return [pickle.loads(scenario) for key, scenario in rows]
+
+        return self._transaction(take)
+
+    def renew(self, worker, keys):
+        """
+        Extend the leases of *worker* on the scenarios with the given keys.
+        """
+        now = time.time()
+        rows = [(now + self.lease_time, now, _key(key), worker) for key in keys]
+        self._transaction(lambda c: c.executemany(
+            "UPDATE tasks SET lease_until = ?, updated = ? WHERE key = ? AND worker = ? AND state = 'leased'", rows))
+
+    def complete(self, worker, key):
+        """
+        Mark a scenario done. Returns False if the worker had lost its lease, in which case
+        the scenario is left to the worker that holds it now.
+        """
+        def done(c):
+            c.execute("UPDATE tasks SET state = 'done', error = NULL, updated = ? "
+                      "WHERE key = ? AND worker = ? AND state = 'leased'", (time.time(), _key(key), worker))
+            return c.rowcount == 1
+
+        return self._transaction(done)
+
+    def fail(self, worker, key, error):
+        """
+        Give a scenario back after an error: pending again, or failed after the last attempt.
+        """
+        self._transaction(lambda c: c.execute(
+            "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_until = NULL, updated = ? WHERE key = ? AND worker = ? AND state = 'leased'",
+            (self.max_attempts, error, time.time(), _key(key), worker)))
+
+    def retry_failed(self):
+        """
+        Make all failed scenarios pending again with a new set of attempts.
+        """
+        return self._transaction(lambda c: c.execute(
+            "UPDATE tasks SET state = 'pending', attempts = 0, updated = ? WHERE state = 'failed'",
+            (time.time(),)).rowcount)
+
+    def counts(self):
+        """
+        Number of scenarios per state: pending, leased, done and failed.
+        """
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(dict(self.db.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state')))
+        return counts
+
+    def errors(self):
+        """
+        Dictionary {key: error} of the failed scenarios.
+        """
+        return {_from_key(key): error for key, error in
+                self.db.execute("SELECT key, error FROM tasks WHERE state = 'failed'")}
+
+
+def run_worker(queue, engine, store, worker=None, batch=1, poll=0, log=None):
+    """
+    Solve scenarios from a queue until it has nothing left to lease.
+
+    Parameters
+        - queue - **WorkQueue**
+        - engine - **ScenarioEngine** of the sweep (run in this process)
+        - store - **ResultStore** the records are committed to
+        - worker - name of the worker, by default host:pid
+        - batch - number of scenarios leased at a time
+        - poll - seconds to wait and ask again when nothing can be leased while other workers
+          still hold leases (0 stops at once)
+
+    Outputs
+        - number of scenarios solved by this worker
+    """
+    worker = worker or '{}:{}'.format(socket.gethostname(), os.getpid())
+    solved = 0
+
+    while True:
+        scenarios = queue.lease(worker, batch)
+        if not scenarios:
+            if poll and queue.counts()['leased']:
+                time.sleep(poll)
+                continue
+            return solved
+
+        for n, scenario in enumerate(scenarios):
+            key = scenario['key']
+            try:
+                record = engine.run(scenario)
+                record.update(engine.DATA.index_lists())
+                store.put(key, record)
+            except Exception:
+                queue.fail(worker, key, traceback.format_exc())
+                continue
+
+            queue.complete(worker, key)
+            solved += 1
+            if log is not None:
+                log('{} solved {} ({})'.format(worker, key, record.get('status')))
+            # keep the leases of the rest of the batch
+            queue.renew(worker, [s['key'] for s in scenarios[n + 1:]])
+
+
+def start_local_workers(n, queue_path, store_path, input_path, tensor_path=None, batch=1):
+    """
+    Run *n* worker processes of this module on this machine and wait for them.
+
+    Outputs
+        - list of the exit codes of the workers
+    """
+    command = [sys.executable, os.path.abspath(__file__), queue_path, store_path, input_path, '--batch', str(batch)]
+    if tensor_path is not None:
+        command += ['--tensor-path', tensor_path]
+
+    workers = [subprocess.Popen(command + ['--worker', '{}:local{}'.format(socket.gethostname(), k)])
+               for k in range(n)]
+    return [w.wait() for w in workers]
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Solve MRIA scenarios from a work queue.')
+    parser.add_argument('queue', help='SQLite file of the queue')
+    parser.add_argument('store', help='directory of the result store')
+    parser.add_argument('input_path', help='input directory with the SUT table in MRIO/')
+    parser.add_argument('--tensor-path', default=None, help='directory of the SUT tensor exports')
+    parser.add_argument('--worker', default=None, help='name of the worker (default host:pid)')
+    parser.add_argument('--batch', type=int, default=1, help='scenarios leased at a time')
+    parser.add_argument('--lease', type=float, default=3600, help='lease in seconds')
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--poll', type=float, default=0, help='seconds between polls while others hold leases')
+    args = parser.parse_args(argv)
+
+    from input_loader import mria_inputs
+    from result_store import ResultStore
+    from scenario_engine import ScenarioEngine
+
+    queue = WorkQueue(args.queue, lease=args.lease, max_attempts=args.max_attempts)
+
+    DATA, regions = mria_inputs(args.input_path, tensor_path=args.tensor_path)
+    # the first worker fixes the order of the index lists if the submitter did not
+    DATA.set_order(**queue.setdefault_context('index', DATA.index_lists()))
+    context = queue.context()
+
+    engine = ScenarioEngine(DATA, context['distance_dict'], context['solvername'],
+                            new_Xbase=context.get('new_Xbase'), **context.get('options', {}))
+
+    solved = run_worker(queue, engine, ResultStore(args.store), worker=args.worker, batch=args.batch,
+                        poll=args.poll, log=print)
+    print('{} scenarios solved, queue: {}'.format(solved, queue.counts()))
+    queue.close()
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
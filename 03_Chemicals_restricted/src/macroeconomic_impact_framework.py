@@ -5,6 +5,7 @@ Importing required packages and function files
 
 
 from input_loader import inputs_for_analysis, mria_inputs
+from parameter_loader import load_parameters
 from run_mria import mria_run
 from pyomo.environ import value
 import matplotlib.pyplot as plt
@@ -107,18 +108,11 @@ dis_array = [0.1]
 op_array = [1.025]
 ip_array =  [1]
 
-# Loading sector specific overproduction data
+# Loading sector specific overproduction data and disaster import data
+# The sheets are pivoted to arrays in the order of DATA and cached, see parameter_loader.py
 
-op_file = pd.read_excel('overproduction.xlsx', index_col= [0])
-op_dict = {(idx, col): op_file.loc[idx,col] for idx in op_file.index for col in op_file.columns}
-
-# Loading disaster import data
-if_file = pd.read_excel('trade_flexibility.xlsx')
-if_file
-if_dict = {(if_file.loc[a,'Index1'], 
-            if_file.loc[a,'Index2'],
-            if_file.loc[a,'Index3']): 
-            if_file.loc[a,'value'] for a in if_file.index }
+op_dict, if_dict, op_arr, if_arr = load_parameters(DATA, 'overproduction.xlsx', 'trade_flexibility.xlsx',
+                                                   cache_dir=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
 
 print(if_dict[('NL41','NL33','CPA_C20')] , if_dict[('NL33','NL41','CPA_C20')])
 
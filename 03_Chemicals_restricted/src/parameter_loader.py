@@ -0,0 +1,147 @@
+"""
+This function loads the sector and link specific model parameters
+
+    1. overproduction.xlsx: overproduction capacity (op_factor) with sectors as rows and regions as columns
+    2. trade_flexibility.xlsx: disaster import flexibility (imp_flex) as a long table with columns
+       Index1 (exporting region Rb), Index2 (importing region R), Index3 (product P) and value
+
+Both sheets are pivoted with vectorised indexing into dense arrays in the order of the
+regions, sectors and products of the SUT table (DATA), and the arrays are cached as .npz,
+keyed by a hash of the Excel files and of the index order. The dictionaries for the MRIA
+models are built in bulk from the arrays.
+
+"""
+
+#### Importing required pacakages
+
+import hashlib
+import itertools
+import numpy as np
+import os
+import pandas as pd
+
+
+CACHE_VERSION = 3
+
+
+def _cache_file(cache_dir, files, *index_lists):
+
+    digest = hashlib.sha256(str(CACHE_VERSION).encode('utf-8'))
+    for file in files:
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    for index in index_lists:
+        digest.update('|'.join(map(str, index)).encode('utf-8'))
+    return os.path.join(cache_dir, 'parameters_' + digest.hexdigest()[:32] + '.npz')
+
+
+def _codes(values, index):
+
+    return pd.Categorical(values, categories=index).codes
+
+
+def overproduction_array(op_file, countries, sectors):
+
+    """
+    Dense (R, S) array of overproduction.xlsx. The sheet has sectors as rows and regions as
+    columns (a sheet with regions as rows is read as well); every region-sector pair of the
+    table must have a value.
+    """
+
+    op = pd.read_excel(op_file, index_col=[0])
+    if set(countries) & set(op.columns):
+        op = op.T
+    op = op.reindex(index=countries, columns=sectors)
+
+    missing = [(R, S) for (R, S), missing in op.isna().stack().items() if missing]
+    if missing:
+        raise ValueError('{} region-sector pairs without overproduction in {}, e.g. {}'.format(
+            len(missing), op_file, missing[:5]))
+    return op.to_numpy(dtype=float)
+
+
+def trade_flexibility_array(if_file, countries, products, fill=None):
+
+    """
+    Dense (Rb, R, P) array of trade_flexibility.xlsx: imports of product P by region R from
+    region Rb (Index1 = Rb, Index2 = R). Labels that are not regions or products of the table
+    raise a ValueError, as do links not in the sheet unless a *fill* value is given for them.
+    """
+
+    tf = pd.read_excel(if_file)
+
+    codes = {}
+    for column, index in (('Index1', countries), ('Index2', countries), ('Index3', products)):
+        codes[column] = _codes(tf[column], index)
+        unknown = sorted(set(tf[column][codes[column] < 0].astype(str)))
+        if unknown:
+            raise ValueError('Unknown {} labels in {}: {}'.format(column, if_file, unknown[:5]))
+
+    arr = np.full((len(countries), len(countries), len(products)), np.nan, dtype=float)
+    arr[codes['Index1'], codes['Index2'], codes['Index3']] = tf['value'].to_numpy(dtype=float)
+
+    missing = np.isnan(arr)
+    if missing.any():
+        if fill is None:
+            example = [(countries[rb], countries[r], products[p]) for rb, r, p in np.argwhere(missing)[:5]]
+            raise ValueError('{} trade links without trade flexibility in {}, e.g. {}'.format(
+                int(missing.sum()), if_file, example))
+        arr[missing] = fill
+    return arr
+
+
+def array_to_dict(arr, *index_lists):
+
+    """
+    Dictionary {index tuple: value} of a dense array, for the model parameters.
+    """
+
+    return dict(zip(itertools.product(*index_lists), arr.reshape(-1).tolist()))
+
+
+def load_parameters(DATA, op_file='overproduction.xlsx', if_file='trade_flexibility.xlsx', cache_dir=None,
+                    if_fill=None):
+
+    """
+    Overproduction and trade flexibility of the SUT table, from the cache if available.
+    *if_fill* is the trade flexibility of links missing from the sheet (None: raise, see
+    trade_flexibility_array).
+
+        - outputs: op_dict {(R, S): op_factor} and if_dict {(Rb, R, P): imp_flex}, as used by the MRIA models,
+          and the dense arrays op_arr (R, S) and if_arr (Rb, R, P)
+    """
+
+    countries, sectors, products = list(DATA.countries), list(DATA.sectors), list(DATA.products)
+
+    # The index sets of DATA come from sets, so their order differs between sessions; the arrays
+    # are cached in sorted order and reordered to DATA afterwards
+    sorted_c, sorted_s, sorted_p = sorted(countries), sorted(sectors), sorted(products)
+
+    cache = None
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache = _cache_file(cache_dir, [op_file, if_file], sorted_c, sorted_s, sorted_p, [if_fill])
+
+    if cache is not None and os.path.exists(cache):
+        with np.load(cache) as data:
+            op_arr, if_arr = data['op'], data['if']
+    else:
+        op_arr = overproduction_array(op_file, sorted_c, sorted_s)
+        if_arr = trade_flexibility_array(if_file, sorted_c, sorted_p, if_fill)
+
+        if cache is not None:
+            tmp = cache + '.{}.tmp.npz'.format(os.getpid())
+            np.savez(tmp, op=op_arr, **{'if': if_arr})
+            os.replace(tmp, cache)
+
+    c = np.array([sorted_c.index(x) for x in countries], dtype=int)
+    sec = np.array([sorted_s.index(x) for x in sectors], dtype=int)
+    p = np.array([sorted_p.index(x) for x in products], dtype=int)
+    op_arr = op_arr[np.ix_(c, sec)]
+    if_arr = if_arr[np.ix_(c, c, p)]
+
+    op_dict = array_to_dict(op_arr, countries, sectors)
+    if_dict = array_to_dict(if_arr, countries, countries, products)
+
+    return op_dict, if_dict, op_arr, if_arr
\ No newline at end of file